@@ -0,0 +1,345 @@
+"""
+手術室ガントチャート生成ベンチマーク
+===================================
+実データ（病院の手術実施データ）を使わずに generate_gantt_chart.py の処理時間を測定します。
+シード固定の疑似データ（ガントチャートデータシート＋テンプレートシート）を生成し、
+読み込み・テンプレート解析・データシートのコピー・各ガントチャートシート・保存の
+処理時間とピークメモリを計測して、結果をJSONファイルに追記します。
+
+使い方:
+    python benchmark_gantt_chart.py
+    python benchmark_gantt_chart.py --days 365 --rooms 11 --cases-per-room 4 --repeat 3
+    python benchmark_gantt_chart.py --streaming --memory
+    python benchmark_gantt_chart.py --writer direct
+
+出力: benchmark_results.json（実行ごとに1件追記。バージョン間の比較用）
+"""
+
+from contextlib import contextmanager, redirect_stdout
+from datetime import date, datetime, time, timedelta
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time as time_module
+import tracemalloc
+
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+from openpyxl.utils import get_column_letter
+
+import generate_gantt_chart as gantt
+
+try:
+    import resource  # Windows にはない
+except ImportError:
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = os.path.join(BASE_DIR, "benchmark_results.json")
+
+# ガントチャートデータシートの列（元データと同じ並び）
+DATA_COLUMNS = ["手術実施管理番号", "手術実施日", "曜日", "執刀診療科名", "実施手術室名",
+                "入室時刻", "麻酔終了時刻", "実施申込区分", "実施手術名０１"]
+
+WEEKDAY_NAMES = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
+
+SURGERY_NAMES = [
+    "腹腔鏡下胆嚢摘出術", "結腸切除術（悪性腫瘍手術）", "人工膝関節置換術", "乳房部分切除術",
+    "経皮的冠動脈形成術", "白内障手術（眼内レンズ挿入）", "腹腔鏡下子宮全摘術", "腰椎椎弓切除術",
+    "内視鏡下鼻副鼻腔手術", "胸腔鏡下肺葉切除術", "経尿道的膀胱腫瘍切除術", "開頭腫瘍摘出術",
+]
+
+# 実施申込区分の出現比率（定時・臨時・緊急）
+URGENCY_WEIGHTS = [("定時", 0.7), ("臨時", 0.2), ("緊急", 0.1)]
+
+
+def synthetic_rooms(n_rooms):
+    """部屋名の一覧（ROOM_ORDER を先頭から使い、足りない分は R12, R13, ... を追加）"""
+    rooms = list(gantt.ROOM_ORDER[:n_rooms])
+    rooms += [f"R{i}" for i in range(len(rooms) + 1, n_rooms + 1)]
+    return rooms
+
+
+def generate_cases(days, rooms, cases_per_room, seed=0, start_date=date(2025, 1, 6)):
+    """シード固定の疑似手術データを行のリストで返す（日曜は休み、土曜は件数半分）"""
+    rng = random.Random(seed)
+    depts = list(gantt.DEPT_SHORT)
+    urgencies, weights = zip(*URGENCY_WEIGHTS)
+    rows = []
+    case_id = 1000000000
+    for day in range(days):
+        d = start_date + timedelta(days=day)
+        if d.weekday() == 6:
+            continue
+        n_cases = cases_per_room if d.weekday() < 5 else max(1, cases_per_room // 2)
+        for room in rooms:
+            minute = 8 * 60 + rng.randrange(0, 60)
+            for _ in range(rng.randint(max(0, n_cases - 1), n_cases + 1)):
+                duration = rng.randrange(30, 300)
+                end = minute + duration
+                if end >= 23 * 60:
+                    break
+                case_id += 1
+                rows.append([
+                    str(case_id),
+                    f"{d.year}/{d.month:02d}/{d.day:02d}",
+                    WEEKDAY_NAMES[d.weekday()],
+                    rng.choice(depts),
+                    room,
+                    time(minute // 60, minute % 60),
+                    time(end // 60, end % 60),
+                    rng.choices(urgencies, weights)[0],
+                    rng.choice(SURGERY_NAMES),
+                ])
+                minute = end + rng.randrange(15, 60)
+    return rows
+
+
+def build_template_sheet(ws):
+    """テンプレートシート（C2～C5の色・フォント、B6:CO17のレイアウト見本）を作る"""
+    for row, color in ((2, "A0C8E4"), (3, "6DABD5"), (4, "FF8CCC")):
+        ws.cell(row=row, column=3).fill = PatternFill('solid', fgColor=color)
+    ws.cell(row=5, column=3, value="ラベル").font = Font(name=gantt.FONT_NAME, size=6)
+
+    thin = Side(style='thin', color="999999")
+    hair = Side(style='hair', color="CCCCCC")
+    ws.column_dimensions['B'].width = 12
+    ws.column_dimensions['C'].width = 6
+    for col in range(4, gantt.TPL_COL_END + 1):
+        ws.column_dimensions[get_column_letter(col)].width = 2.5
+    for row in range(gantt.TPL_HEADER_ROW, gantt.TPL_LAST_ROOM_ROW + 1):
+        ws.row_dimensions[row].height = 18
+        for col in range(gantt.TPL_COL_START, gantt.TPL_COL_END + 1):
+            hour_edge = col >= 4 and (col - 4) % gantt.COLS_PER_HOUR == 0
+            ws.cell(row=row, column=col).border = Border(
+                left=thin if hour_edge or col < 4 else hair, right=hair if col >= 4 else thin,
+                top=thin, bottom=thin)
+    header_font = Font(name=gantt.FONT_NAME, size=8, bold=True)
+    for col in range(gantt.TPL_COL_START, gantt.TPL_COL_END + 1):
+        cell = ws.cell(row=gantt.TPL_HEADER_ROW, column=col)
+        cell.font = header_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+    ws.cell(row=gantt.TPL_FIRST_ROOM_ROW, column=2).font = Font(name=gantt.FONT_NAME, size=9, bold=True)
+    ws.cell(row=gantt.TPL_FIRST_ROOM_ROW, column=2).alignment = Alignment(
+        horizontal='center', vertical='center', wrap_text=True)
+    ws.cell(row=gantt.TPL_FIRST_ROOM_ROW, column=3).font = Font(name=gantt.FONT_NAME, size=7)
+
+
+def build_room_sheet(ws, rooms):
+    """手術室一覧シート（既定の部屋は既定の重み、追加の部屋は重み1.0で稼働率に含める）"""
+    ws.append(list(gantt.ROOM_COLUMNS))
+    for room in rooms:
+        weight = gantt.ROOM_WEIGHT.get(room, 1.0)
+        ws.append([room, room, weight or 1.0, "×" if weight == 0 else "○"])
+
+
+def write_synthetic_input(path, days=30, n_rooms=11, cases_per_room=3, seed=0):
+    """疑似データの入力ファイルを作成し、データ行数を返す
+
+    部屋数が既定の部屋（ROOM_ORDER）より多い場合は、全部屋の手術室一覧シートも作る。
+    """
+    rooms = synthetic_rooms(n_rooms)
+    rows = generate_cases(days, rooms, cases_per_room, seed)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "ガントチャートデータ"
+    header_font = Font(name="ＭＳ Ｐゴシック", size=10, bold=True)
+    body_font = Font(name="ＭＳ Ｐゴシック", size=10)
+    ws.append(DATA_COLUMNS)
+    for cell in ws[1]:
+        cell.font = header_font
+    for row in rows:
+        ws.append(row)
+    for row in ws.iter_rows(min_row=2):
+        for cell in row:
+            cell.font = body_font
+        row[5].number_format = row[6].number_format = "h:mm"
+    build_template_sheet(wb.create_sheet("テンプレート"))
+    if n_rooms > len(gantt.ROOM_ORDER):
+        build_room_sheet(wb.create_sheet(gantt.ROOM_SHEET_TITLE), rooms)
+    wb.save(path)
+    return len(rows)
+
+
+def measure_startup(repeat=3):
+    """新しいプロセスで generate_gantt_chart を読み込むまでの時間（exe の起動時間の目安）
+
+    (インタプリタ起動を含む経過秒, モジュール自身が計測した読み込み秒) の最小値を返す。
+    """
+    code = "import generate_gantt_chart as g; print(g.IMPORT_SECONDS)"
+    wall, imports = [], []
+    for _ in range(repeat):
+        start = time_module.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR,
+                             capture_output=True, text=True, check=True).stdout
+        wall.append(time_module.perf_counter() - start)
+        imports.append(float(out.split()[-1]))
+    return min(wall), min(imports)
+
+
+def git_revision():
+    """計測対象のバージョン（git のコミット。取得できなければ None）"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def peak_rss_kb():
+    """プロセスのピーク常駐メモリ（KB。取得できない環境では None）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class PhaseTimer:
+    """処理段階ごとの経過時間（とトレース時はPythonヒープのピーク）を記録する"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.peak_bytes = {}
+
+    @contextmanager
+    def phase(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time_module.perf_counter()
+        yield
+        self.seconds[name] = self.seconds.get(name, 0.0) + time_module.perf_counter() - start
+        if self.trace_memory:
+            self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), tracemalloc.get_traced_memory()[1])
+
+
+def run_once(input_path, output_path, streaming=False, trace_memory=False, writer="openpyxl"):
+    """generate_workbook と同じ手順を段階ごとに計測しながら実行する"""
+    timer = PhaseTimer(trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with redirect_stdout(io.StringIO()):
+            with timer.phase("load"):
+                table, src_wb = gantt.load_input(input_path)
+                table = gantt.prepare_table(table)
+            with timer.phase("template"):
+                gantt.read_template_settings(src_wb)
+                catalogue = gantt.load_room_catalogue(input_path=input_path)
+                if catalogue is not None:
+                    gantt.set_room_catalogue(catalogue)
+
+            dates = gantt.unique_dates(table)
+            day_index = gantt.build_day_index(table)
+            weekday_map = dict(zip(table["手術実施日"], table["曜日"]))
+            if writer == "direct":
+                wb, streaming = gantt.DirectWorkbook(), True
+            else:
+                wb = Workbook(write_only=streaming)
+            styles = gantt.StyleRegistry(wb)
+
+            with timer.phase("data_sheet"):
+                data_sheet = gantt.read_data_sheet(src_wb["ガントチャートデータ"])
+                data_ws = wb.create_sheet("ガントチャートデータ") if streaming else wb.active
+                data_ws.title = "ガントチャートデータ"
+                gantt.write_data_sheet(data_ws, data_sheet, styles)
+            src_wb.close()
+
+            with timer.phase("blocks"):
+                blocks = gantt.compute_day_blocks(table, dates, weekday_map, day_index, styles)
+            with timer.phase("sheet_date"):
+                ws_date = wb.create_sheet("手術室ガントチャート")
+                gantt.setup_gantt_sheet(ws_date, "手術室 ガントチャート（ベンチマーク）")
+                gantt.write_gantt_for_dates(ws_date, blocks, dates, styles)
+            with timer.phase("sheet_weekday"):
+                ws_weekday = wb.create_sheet("手術室ガントチャート・曜日順")
+                gantt.setup_gantt_sheet(ws_weekday, "手術室 ガントチャート・曜日順（ベンチマーク）")
+                gantt.write_gantt_for_dates(ws_weekday, blocks,
+                                            gantt.order_dates_by_weekday(dates, weekday_map), styles)
+            with timer.phase("sheet_heatmap"):
+                gantt.write_heatmap_sheet(wb.create_sheet("曜日別ヒートマップ"), gantt.build_weekday_heatmap(table),
+                                          "手術室 曜日別ヒートマップ（ベンチマーク）", styles)
+            with timer.phase("save"):
+                wb.save(output_path)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return timer, len(dates)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="手術室ガントチャート生成のベンチマーク（疑似データ）")
+    parser.add_argument("--days", type=int, default=30, help="生成する日数（日曜は除く）")
+    parser.add_argument("--rooms", type=int, default=len(gantt.ROOM_ORDER), help="部屋数")
+    parser.add_argument("--cases-per-room", type=int, default=3, help="1部屋あたりの1日の手術件数の目安")
+    parser.add_argument("--seed", type=int, default=0, help="疑似データの乱数シード")
+    parser.add_argument("--repeat", type=int, default=1, help="計測の繰り返し回数（各段階の最小値を記録）")
+    parser.add_argument("--streaming", action="store_true", help="書き込み専用モードで計測する")
+    parser.add_argument("--writer", choices=["openpyxl", "direct"], default="openpyxl",
+                        help="xlsx の書き出し方（direct はシートのXMLを直接書き出す）")
+    parser.add_argument("--memory", action="store_true",
+                        help="tracemalloc で段階ごとのPythonヒープのピークも記録する（処理は遅くなる）")
+    parser.add_argument("--output", default=RESULTS_FILE, help="結果を追記するJSONファイル")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "ガントチャート-元データ.xlsx")
+        output_path = os.path.join(tmp_dir, "手術室ガントチャート-結果.xlsx")
+        n_rows = write_synthetic_input(input_path, args.days, args.rooms, args.cases_per_room, args.seed)
+        print(f"疑似データ: {args.days}日 × {args.rooms}室、{n_rows}件")
+
+        runs = [run_once(input_path, output_path, args.streaming, args.memory, args.writer)
+                for _ in range(args.repeat)]
+        output_bytes = os.path.getsize(output_path)
+    startup_seconds, import_seconds = measure_startup()
+
+    phases = {name: min(timer.seconds[name] for timer, _ in runs) for name in runs[0][0].seconds}
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "days": args.days, "rooms": args.rooms, "cases_per_room": args.cases_per_room,
+            "seed": args.seed, "repeat": args.repeat, "streaming": args.streaming, "writer": args.writer,
+        },
+        "rows": n_rows,
+        "gantt_days": runs[0][1],
+        "output_bytes": output_bytes,
+        "seconds": phases,
+        "total_seconds": sum(phases.values()),
+        "peak_rss_kb": peak_rss_kb(),
+        "startup_seconds": startup_seconds,
+        "import_seconds": import_seconds,
+    }
+    if args.memory:
+        result["peak_traced_bytes"] = {name: max(timer.peak_bytes[name] for timer, _ in runs)
+                                       for name in runs[0][0].peak_bytes}
+
+    for name, seconds in phases.items():
+        print(f"  {name:<14}{seconds:8.3f} 秒")
+    print(f"  {'合計':<12}{result['total_seconds']:8.3f} 秒   ピークメモリ: {result['peak_rss_kb']} KB")
+    print(f"  起動（読み込み）{startup_seconds:8.3f} 秒（うちモジュール {import_seconds:.3f} 秒）")
+
+    results = []
+    if os.path.exists(args.output):
+        with open(args.output, encoding="utf-8") as f:
+            results = json.load(f)
+    results.append(result)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果を追記しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
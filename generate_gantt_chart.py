@@ -6,19 +6,74 @@
 
 使い方:
     python generate_gantt_chart.py
+    python generate_gantt_chart.py --format html   # ブラウザで開くHTML（手術室ガントチャート-結果.html）
+    python generate_gantt_chart.py --streaming   # 長期間のデータ向け（省メモリ出力）
+    python generate_gantt_chart.py --writer direct   # シートのXMLを直接書き出す（大量の日付を速く出力）
+    python generate_gantt_chart.py --data-sheet link   # 元データシートをコピーせずリンクのみ置く
+    python generate_gantt_chart.py --batch month   # 月ごとに別々のブックを並列に出力
+    python generate_gantt_chart.py --parallel   # 1つのブックのデータシート・日付順・曜日順を並行して作成
+    python generate_gantt_chart.py --incremental   # 前回から内容が変わった日付だけ再計算
+    python generate_gantt_chart.py --append   # 出力済みのブックに新しい日付だけを追加（入力は新しい日付だけでよい）
+    python generate_gantt_chart.py --profile   # 処理段階ごとの時間・件数を計測（.profile.json）
+    python generate_gantt_chart.py --from 2025-09-01 --to 2025-09-30   # 期間・部屋（--room）・診療科（--dept）で絞り込み
+    python generate_gantt_chart.py --room-list 手術室一覧.csv   # 手術室の表示順・重み等（省略時は「手術室」シート）
+    python generate_gantt_chart.py --scenarios 試算条件.json   # 稼働率の計算条件を変えた試算シートを追加
+    python generate_gantt_chart.py --watch   # 起動したまま入力ファイルを監視し、更新のたびに出力
+    python generate_gantt_chart.py --ingest   # 入力ファイルを蓄積データ（手術データ.sqlite3）に追加
+    python generate_gantt_chart.py --store --from 2025-09-01 --to 2025-09-30   # 蓄積データから出力
 
 入力: ガントチャート-元データ.xlsx（同一フォルダに配置）
 出力: 手術室ガントチャート-結果.xlsx（同一フォルダに生成）
 """
 
-import pandas as pd
+import time as time_module
+
+# 起動時間の計測用（exe をダブルクリックしてから処理が始まるまでの大半はモジュールの読み込み）
+IMPORT_STARTED = time_module.perf_counter()
+
+import numpy as np
 from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+from openpyxl.styles import Font, PatternFill, GradientFill, Alignment, Border, Side
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE, BUILTIN_FORMATS_REVERSE
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.utils.datetime import to_excel
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import Cell, ERROR_CODES, ILLEGAL_CHARACTERS_RE
+from openpyxl.compat import safe_string
+from openpyxl.styles.stylesheet import apply_stylesheet, write_stylesheet
+from openpyxl.writer.theme import theme_xml
+from openpyxl.xml.functions import tostring
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from collections import defaultdict
+from contextlib import contextmanager
 from copy import copy
 from datetime import datetime, timedelta
+from html import escape as html_escape
+import argparse
+import hashlib
+import hmac
+import io
+import json
+import multiprocessing
 import os
+import pickle
+import posixpath
+import re
+import secrets
+import shutil
 import sys
+import tempfile
+import tracemalloc
+import zipfile
+from types import SimpleNamespace
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape, quoteattr
+
+# モジュールの読み込みにかかった時間（秒）。並列処理・cProfile は使うときに読み込む
+IMPORT_SECONDS = time_module.perf_counter() - IMPORT_STARTED
 
 # ========== 設定 ==========
 # PyInstaller exe の場合は exe の場所、通常実行の場合はスクリプトの場所を基準にする
@@ -29,16 +84,55 @@ else:
 
 INPUT_FILE = os.path.join(BASE_DIR, "ガントチャート-元データ.xlsx")
 OUTPUT_FILE = os.path.join(BASE_DIR, "手術室ガントチャート-結果.xlsx")
+STORE_FILE = os.path.join(BASE_DIR, "手術データ.sqlite3")   # --ingest で蓄積するデータ
 
-# 手術室の表示順
+# 手術室の表示順（既定値。手術室一覧を読み込むと set_room_catalogue で置き換わる）
 ROOM_ORDER = ["01A", "01B", "02", "03", "05", "06", "07", "08", "09", "10", "ｱﾝｷﾞｵ"]
 
+# 部屋名の列に表示する名前（データの実施手術室名と違う部屋だけ）
+ROOM_LABELS = {}
+
+# 稼働率の凡例で使う部屋の呼び方（既定の部屋構成のときだけ。手術室一覧を読み込むと表示名を使う）
+ROOM_NOTE_LABELS = {"ｱﾝｷﾞｵ": "アンギオ室"}
+
+# 手術室一覧（--room-list の設定ファイル、または入力ファイルのこのシート）の見出しと項目
+ROOM_SHEET_TITLE = "手術室"
+ROOM_COLUMNS = {"部屋名": "name", "表示名": "label", "重み": "weight", "稼働率": "utilization"}
+# 稼働率の列で「含めない」とみなす値（それ以外・空欄は含める）
+ROOM_EXCLUDE_VALUES = {"0", "false", "no", "x", "×", "✕", "除外", "含まない", "いいえ"}
+
 # 時間範囲: 8:00 ~ 22:00（10分刻み）
 TIME_START_HOUR = 8
 TIME_END_HOUR = 22
 COLS_PER_HOUR = 6  # 1時間=6列（10分刻み）
 
+# 時刻を分単位に正規化した列（main で一度だけ計算）。読み取れない時刻は INVALID_MINUTE
+START_MIN_COL = "入室時刻_分"
+END_MIN_COL = "麻酔終了時刻_分"
+INVALID_MINUTE = -1
+
+# 稼働率計算の部屋重み（01A・01Bは各0.5室換算、アンギオ室は除外。その他は1.0）
+# 手術室一覧を読み込んだ場合は一覧の全部屋の重み（稼働率に含めない部屋は0）になる
+ROOM_WEIGHT = {
+    "01A": 0.5,
+    "01B": 0.5,
+    "ｱﾝｷﾞｵ": 0,
+}
+
+# 稼働率の計算時間帯（経過分、[開始, 終了)）と分母の部屋数（8h×9室 / 4h×9室）
+# 分母の部屋数は、手術室一覧を読み込んだ場合は稼働率に含める部屋の重みの合計になる
+UTILIZATION_WEEKDAY_WINDOW = (9 * 60, 17 * 60)
+UTILIZATION_SATURDAY_WINDOW = (9 * 60, 13 * 60)
+UTILIZATION_ROOM_COUNT = 9.0
+
+# 実施申込区分のコード（占有行列・色分けで使用。定義のない区分は定時扱い）
+URGENCY_SCHEDULED = 0
+URGENCY_URGENT = 1
+URGENCY_EMERGENCY = 2
+URGENCY_CODES = {"定時": URGENCY_SCHEDULED, "臨時": URGENCY_URGENT, "緊急": URGENCY_EMERGENCY}
+
 # テンプレート行オフセット（テンプレートの6行目=ヘッダ、7~17行目=部屋行）
+# 部屋数が部屋行より多い場合は template_row_offset で部屋行を繰り返して使う
 TPL_HEADER_ROW = 6
 TPL_FIRST_ROOM_ROW = 7
 TPL_LAST_ROOM_ROW = 17
@@ -86,6 +180,208 @@ TPL_DATE_ALIGNMENT = None
 TPL_ROOM_FONT = None     # C7セルのフォント
 TPL_HAS_TEMPLATE = False
 
+# テンプレートに該当セルがない場合の罫線（全セルで共有）
+EMPTY_BORDER = Border()
+
+
+class StyleRegistry:
+    """ワークブック単位の書式レジストリ
+
+    Font / PatternFill / Alignment を設定値の組み合わせごとに一度だけ生成し、
+    ワークブックへの登録結果（書式ID）も使い回す。セルには書式IDを直接設定するため、
+    openpyxl の通常の代入（cell.font = ... のたびにオブジェクトの比較・ハッシュ計算を行う）
+    を経由しない。
+    """
+
+    _COLLECTIONS = {
+        'font': ('_fonts', 'fontId'),
+        'fill': ('_fills', 'fillId'),
+        'border': ('_borders', 'borderId'),
+        'alignment': ('_alignments', 'alignmentId'),
+    }
+
+    def __init__(self, wb):
+        self.wb = wb
+        self._objects = {}   # {(種類, 設定値): 書式オブジェクト}
+        self._ids = {}       # {(種類, id(書式オブジェクト)): (書式オブジェクト, 書式ID)}
+        self._keys = {}      # {id の組: style_key}
+        self._arrays = {}    # {id の組: (style_key, StyleArray)}
+        self._xfs = {}       # {id の組: セル書式の番号}
+
+    def _intern(self, kind, factory, **kwargs):
+        key = (kind, tuple(sorted(kwargs.items())))
+        obj = self._objects.get(key)
+        if obj is None:
+            obj = factory(**kwargs)
+            self._objects[key] = obj
+        return obj
+
+    def font(self, **kwargs):
+        return self._intern('font', Font, **kwargs)
+
+    def fill(self, color):
+        return self._intern('fill', PatternFill, fill_type='solid', fgColor=color)
+
+    def alignment(self, **kwargs):
+        return self._intern('alignment', Alignment, **kwargs)
+
+    def _style_id(self, kind, obj):
+        key = (kind, id(obj))
+        entry = self._ids.get(key)
+        if entry is None:
+            collection, _ = self._COLLECTIONS[kind]
+            # オブジェクトへの参照を保持して id() の再利用を防ぐ
+            entry = (obj, getattr(self.wb, collection).add(obj))
+            self._ids[key] = entry
+        return entry[1]
+
+    def apply(self, cell, font=None, fill=None, border=None, alignment=None):
+        """指定した書式だけをセルに設定する（None の項目は変更しない）"""
+        style = cell._style
+        if style is None:
+            style = cell._style = StyleArray()
+        for kind, obj in (('font', font), ('fill', fill), ('border', border), ('alignment', alignment)):
+            if obj is not None:
+                setattr(style, self._COLLECTIONS[kind][1], self._style_id(kind, obj))
+
+    def style_key(self, font=None, fill=None, border=None, alignment=None):
+        """書式の組み合わせを表す共有タプル (font, fill, border, alignment) を返す
+
+        書式オブジェクトそのものを保持するため、他のワークブックの StyleRegistry でも使える。
+        """
+        ids = (id(font), id(fill), id(border), id(alignment))
+        key = self._keys.get(ids)
+        if key is None:
+            key = self._keys[ids] = (font, fill, border, alignment)
+        return key
+
+    def key_of(self, style):
+        """このワークブックの StyleArray を style_key に変換する
+
+        既定値（ID 0）の項目も書式オブジェクトとして保持するため、既定フォントなどが
+        異なる他のブックに書き込んでも同じ見た目になる。
+        """
+        components = []
+        for kind in ('font', 'fill', 'border', 'alignment'):
+            collection, attr = self._COLLECTIONS[kind]
+            components.append(getattr(self.wb, collection)[getattr(style, attr)])
+        return self.style_key(*components)
+
+    def number_format_id(self, number_format):
+        """表示形式の書式ID（組み込み形式以外はワークブックに登録する）"""
+        if number_format in BUILTIN_FORMATS_REVERSE:
+            return BUILTIN_FORMATS_REVERSE[number_format]
+        return self.wb._number_formats.add(number_format) + BUILTIN_FORMATS_MAX_SIZE
+
+    def style_array(self, key):
+        """style_key に対応するこのワークブックの StyleArray（共有オブジェクト）"""
+        ids = tuple(map(id, key))
+        style = self._arrays.get(ids)
+        if style is None:
+            style = StyleArray()
+            for kind, obj in zip(('font', 'fill', 'border', 'alignment'), key):
+                if obj is not None:
+                    setattr(style, self._COLLECTIONS[kind][1], self._style_id(kind, obj))
+            self._arrays[ids] = (key, style)
+        else:
+            style = style[1]
+        return style
+
+    def xf_id(self, key):
+        """style_key に対応するセル書式の番号（styles.xml の cellXfs の位置。直接書き込み用）"""
+        ids = tuple(map(id, key))
+        xf = self._xfs.get(ids)
+        if xf is None:
+            xf = self._xfs[ids] = self.wb._cell_styles.add(self.style_array(key))
+        return xf
+
+
+class RunProfile:
+    """--profile 指定時の計測結果（処理段階ごとの時間・メモリ確保量と各種カウンタ）
+
+    段階は入れ子にしない（tracemalloc のピークを段階ごとにリセットするため）。
+    """
+
+    def __init__(self):
+        self.started = time_module.perf_counter()
+        self.phases = {}     # {段階名: {'seconds', 'calls', 'allocated_bytes', 'peak_bytes'}}
+        self.counters = {}   # {カウンタ名: 値}
+        self.periods = {}    # {出力パス: 期間ごとの report()}（バッチモード）
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        tracemalloc.reset_peak()
+        mem_start = tracemalloc.get_traced_memory()[0]
+        start = time_module.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time_module.perf_counter() - start
+            mem_end, mem_peak = tracemalloc.get_traced_memory()
+            stats = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0,
+                                                  'allocated_bytes': 0, 'peak_bytes': 0})
+            stats['seconds'] += seconds
+            stats['calls'] += 1
+            stats['allocated_bytes'] += mem_end - mem_start
+            stats['peak_bytes'] = max(stats['peak_bytes'], mem_peak - mem_start)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def report(self):
+        """JSONに書き出せる形の計測結果"""
+        return {
+            'import_seconds': IMPORT_SECONDS,
+            'total_seconds': time_module.perf_counter() - self.started,
+            'peak_traced_bytes': tracemalloc.get_traced_memory()[1],
+            'phases': self.phases,
+            'counters': dict(sorted(self.counters.items())),
+            'periods': self.periods,
+        }
+
+
+class ProfileCounters:
+    """カウンタだけを数える計測先（--parallel のワーカー用。数えた値は親プロセスの計測に足す）"""
+
+    def __init__(self):
+        self.counters = {}
+
+    count = RunProfile.count
+
+
+# 実行中の計測（--profile 指定時のみ RunProfile。未指定時は None で計測しない）
+PROFILE = None
+
+
+def set_profile(profile):
+    """計測先を切り替え、直前の計測先を返す（None で計測を止める）"""
+    global PROFILE
+    previous, PROFILE = PROFILE, profile
+    return previous
+
+
+@contextmanager
+def profile_phase(name):
+    """処理段階の時間とメモリ確保量を計測する（計測していなければ何もしない）"""
+    if PROFILE is None:
+        yield
+    else:
+        with PROFILE.phase(name):
+            yield
+
+
+def profile_count(name, n=1):
+    """カウンタを加算する（計測していなければ何もしない）"""
+    if PROFILE is not None:
+        PROFILE.count(name, n)
+
+
+def profile_report_path(output_path):
+    """出力ファイルに対応する計測結果（JSON）のパス"""
+    return os.path.splitext(output_path)[0] + ".profile.json"
+
 
 def load_template(tpl_ws):
     """テンプレートシートB6:CO17から書式情報を読み取る"""
@@ -145,26 +441,245 @@ def load_template(tpl_ws):
     print("テンプレートB6:CO17から書式情報を読み取りました")
 
 
-def time_to_col(time_val, col_offset=4):
-    """時刻をExcel列番号に変換（列Dが8:00開始）"""
+def time_to_minutes(time_val):
+    """時刻（文字列 / time / timedelta / datetime）を0時からの経過分に変換"""
     import datetime as dt_module
     if isinstance(time_val, str):
         parts = time_val.split(":")
-        hours, minutes = int(parts[0]), int(parts[1])
+        return int(parts[0]) * 60 + int(parts[1])
     elif isinstance(time_val, timedelta):
-        total_seconds = int(time_val.total_seconds())
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
+        return int(time_val.total_seconds()) // 60
     elif isinstance(time_val, dt_module.time):
-        hours = time_val.hour
-        minutes = time_val.minute
+        return time_val.hour * 60 + time_val.minute
     else:
-        hours = time_val.hour
-        minutes = time_val.minute
+        return time_val.hour * 60 + time_val.minute
+
+
+def minutes_to_col(minutes, col_offset=4):
+    """経過分をExcel列番号に変換（列Dが8:00開始）"""
+    total_minutes = minutes - TIME_START_HOUR * 60
+    return col_offset + int(total_minutes / 10)
+
+
+def time_to_col(time_val, col_offset=4):
+    """時刻をExcel列番号に変換（列Dが8:00開始）"""
+    return minutes_to_col(time_to_minutes(time_val), col_offset)
+
+
+def _safe_time_to_minutes(time_val):
+    """time_to_minutes の例外をINVALID_MINUTEに置き換える（欠損・不正値用）"""
+    try:
+        return time_to_minutes(time_val)
+    except Exception:
+        return INVALID_MINUTE
+
+
+def times_to_minutes(values):
+    """時刻の配列を経過分のint16配列に変換（読み取れない値はINVALID_MINUTE）"""
+    return np.fromiter((_safe_time_to_minutes(v) for v in values),
+                       dtype=np.int16, count=len(values))
+
+
+def parse_date(value):
+    """手術実施日（"2025/09/01" 形式の文字列 / date / datetime）を datetime に変換（読み取れなければ None）"""
+    if isinstance(value, datetime):
+        return value
+    if hasattr(value, "toordinal"):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        for fmt in ("%Y/%m/%d", "%Y-%m-%d", "%Y/%m/%d %H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+            try:
+                return datetime.strptime(value.strip(), fmt)
+            except ValueError:
+                pass
+    return None
+
+
+class SurgeryTable:
+    """ガントチャートデータの列ごとの配列（pandas を使わない軽量な表）
+
+    table[列名] で列の numpy 配列（文字列・時刻の列は object 配列）を返す。
+    行の取り出しは take(行位置) で、行位置には slice または配列を渡せる。
+
+    種類の少ない列（CATEGORY_COLUMNS）はカテゴリ列として、行ごとには int16 のコードだけを持つ。
+    categories[列名] はコード順の値の配列で、末尾の None が空欄（コード -1）に当たる。
+    table[列名] は値に戻した配列を返し、category_lookup はカテゴリごとに一度だけ計算した
+    値（部屋の行番号・略称など）をコードで引く。
+    """
+
+    def __init__(self, columns, n_rows=None, categories=None, lookups=None):
+        self.columns = dict(columns)
+        if n_rows is None:
+            n_rows = len(next(iter(self.columns.values()))) if self.columns else 0
+        self.n_rows = n_rows
+        self.categories = dict(categories or {})
+        self._lookups = {} if lookups is None else lookups  # take() で切り出した表と共有する
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        values = self.columns[name]
+        if name in self.categories:
+            return self.categories[name][values]
+        return values
+
+    def __setitem__(self, name, values):
+        self.columns[name] = values
+        self.categories.pop(name, None)
+
+    def __delitem__(self, name):
+        del self.columns[name]
+        self.categories.pop(name, None)
+
+    def category_lookup(self, name, key, func, dtype):
+        """列の各値に func を適用した配列を返す（カテゴリ列ならカテゴリごとに一度だけ計算する）
+
+        key: func の結果を使い回すための名前（func が同じ結果を返す限り同じ key を使う）
+        """
+        if name not in self.categories:
+            return np.fromiter((func(v) for v in self.columns[name]), dtype=dtype, count=self.n_rows)
+        lut = self._lookups.get((name, key))
+        if lut is None:
+            lut = self._lookups[(name, key)] = np.array([func(v) for v in self.categories[name]], dtype=dtype)
+        return lut[self.columns[name]]
+
+    def take(self, positions):
+        """指定した行位置の行だけを持つ表を返す（カテゴリと計算済みの値は共有する）"""
+        columns = {name: values[positions] for name, values in self.columns.items()}
+        n_rows = len(range(self.n_rows)[positions]) if isinstance(positions, slice) else len(positions)
+        return SurgeryTable(columns, n_rows, self.categories, self._lookups)
+
+
+# ガントチャートの作成に使う列（表にはこれだけを読み込む）
+GANTT_COLUMNS = ("手術実施日", "曜日", "実施手術室名", "入室時刻", "麻酔終了時刻",
+                 "執刀診療科名", "実施申込区分", "実施手術名０１")
+
+# カテゴリ列として持つ列（値の種類が少ない）
+CATEGORY_COLUMNS = ("手術実施日", "曜日", "実施手術室名", "執刀診療科名", "実施申込区分")
+
+# 文字列として読む列（数値のセルでも部屋名は "09" などの文字列として扱う）
+STRING_COLUMNS = ("実施手術室名",)
+
+
+def row_filter(header, filters):
+    """読み込む行の条件から、行の値のタプルを判定する関数を作る（条件がなければ None）
+
+    filters: {'date_from': datetime, 'date_to': datetime, 'rooms': 部屋名の集合,
+              'depts': 執刀診療科名の集合}（指定しない条件は None）
+    """
+    if not filters or all(value is None for value in filters.values()):
+        return None
+    columns = {name: col for col, name in enumerate(header)}
+    date_col = columns.get("手術実施日")
+    room_col = columns.get("実施手術室名")
+    dept_col = columns.get("執刀診療科名")
+    date_from, date_to = filters.get('date_from'), filters.get('date_to')
+    rooms, depts = filters.get('rooms'), filters.get('depts')
+    parsed_dates = {}  # 同じ日付の行が続くため、日付の変換結果を使い回す
+
+    def value_at(values, col):
+        return values[col] if col is not None and col < len(values) else None
+
+    def accept(values):
+        if date_from is not None or date_to is not None:
+            raw = value_at(values, date_col)
+            if raw not in parsed_dates:
+                parsed_dates[raw] = parse_date(raw)
+            dt = parsed_dates[raw]
+            if dt is None or (date_from is not None and dt < date_from) or (date_to is not None and dt > date_to):
+                return False
+        if rooms is not None:
+            room = value_at(values, room_col)
+            if room is None or str(room) not in rooms:
+                return False
+        if depts is not None and value_at(values, dept_col) not in depts:
+            return False
+        return True
+
+    return accept
+
+
+def table_from_rows(header, data, columns=GANTT_COLUMNS):
+    """見出しと行の値のタプルのリストから、columns の列だけを持つ SurgeryTable を作る"""
+    arrays = {}
+    categories = {}
+    for col, name in enumerate(header):
+        if name is None or name not in columns:
+            continue
+        values = (row[col] if col < len(row) else None for row in data)
+        if name in STRING_COLUMNS:
+            values = (None if v is None else str(v) for v in values)
+        if name in CATEGORY_COLUMNS:
+            codes_of = {None: -1}
+            arrays[name] = np.fromiter((codes_of.setdefault(v, len(codes_of) - 1) for v in values),
+                                       dtype=np.int16, count=len(data))
+            del codes_of[None]
+            category_values = np.empty(len(codes_of) + 1, dtype=object)
+            category_values[:-1] = list(codes_of)
+            categories[name] = category_values
+        else:
+            arrays[name] = np.empty(len(data), dtype=object)
+            arrays[name][:] = list(values)
+    return SurgeryTable(arrays, len(data), categories)
+
+
+def read_table(ws, filters=None, columns=GANTT_COLUMNS):
+    """ワークシートの1行目を見出しとして、2行目以降を SurgeryTable に読み込む（空行は除く）
+
+    filters: row_filter の条件。条件に合わない行は1行読むごとに捨て、保持しない。
+    columns: 表に持つ列（table_from_rows を参照）
+    """
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, ())
+    accept = row_filter(header, filters)
+    data = [row for row in rows
+            if any(v is not None for v in row) and (accept is None or accept(row))]
+    return table_from_rows(header, data, columns)
+
+
+def unique_dates(table):
+    """手術実施日を出現順に重複なく返す（空欄は除く）"""
+    return list(dict.fromkeys(d for d in table["手術実施日"] if d is not None))
+
+
+def normalize_time_columns(table):
+    """入室時刻・麻酔終了時刻を経過分の整数列（START_MIN_COL / END_MIN_COL）に置き換える
+
+    蓄積データから読んだ表のように経過分の列が既にある場合はそのまま使う。
+    元の時刻の列は以降使わないため表から除く。
+    """
+    for time_col, minute_col in (("入室時刻", START_MIN_COL), ("麻酔終了時刻", END_MIN_COL)):
+        if minute_col not in table:
+            table[minute_col] = times_to_minutes(table[time_col])
+        if time_col in table:
+            del table[time_col]
+    return table
 
-    total_minutes = (hours - TIME_START_HOUR) * 60 + minutes
-    col = col_offset + int(total_minutes / 10)
-    return col
+
+def _positions_to_slice(positions):
+    """連続した行位置ならsliceに、そうでなければ配列のまま返す"""
+    if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+
+def build_day_index(table):
+    """日付ごとの行位置インデックスを作成する
+
+    {手術実施日: 日付の行位置} を返す（日付は出現順）。
+    行位置は table.take に渡せる slice（ソート済みで連続している場合）または配列。
+    手術実施日が空欄の行は含めない。部屋ごとの振り分けは build_occupancy が行う。
+    """
+    day_positions = {}
+    for pos, date_str in enumerate(table["手術実施日"]):
+        if date_str is not None:
+            day_positions.setdefault(date_str, []).append(pos)
+    return {date_str: _positions_to_slice(np.array(pos, dtype=np.intp))
+            for date_str, pos in day_positions.items()}
 
 
 def shorten_surgery_name(name, max_chars=20):
@@ -177,75 +692,497 @@ def shorten_surgery_name(name, max_chars=20):
     return result
 
 
-def calculate_utilization(day_data, rooms, weekday=""):
-    """稼働率を計算"""
-    import datetime as dt_module
-
-    if "土" in weekday:
-        calc_start = 9 * 60
-        calc_end = 13 * 60
-        standard_minutes = 240
+def urgency_colors():
+    """区分コード順のバー色（テンプレート読み取り後の値を返す）"""
+    return (COLOR_SCHEDULED, COLOR_URGENT, COLOR_EMERGENCY)
+
+
+def dept_short_name(dept):
+    """診療科の略称（読み取れない場合は None）"""
+    try:
+        return DEPT_SHORT.get(dept, dept[0])
+    except Exception:
+        return None
+
+
+def bar_label(dept_short, surgery_name):
+    """手術バーのラベル「【科】-手術名」"""
+    if not isinstance(surgery_name, str):
+        surgery_name = ""
+    return f"【{dept_short}】-{shorten_surgery_name(surgery_name, max_chars=40)}"
+
+
+def minutes_to_bar_cols(start_min, end_min, first_col=4):
+    """経過分の配列をバーの開始・終了列の配列に変換（minutes_to_col と同じ0方向への切り捨て）
+
+    開始列は first_col 以降、終了列は TPL_COL_END 以前に収め、開始列以前になる場合は開始列の次の列とする。
+    """
+    start_col = np.maximum(first_col + np.fix((start_min - TIME_START_HOUR * 60) / 10).astype(np.int32), first_col)
+    end_col = np.minimum(first_col + np.fix((end_min - TIME_START_HOUR * 60) / 10).astype(np.int32), TPL_COL_END)
+    end_col = np.where(end_col <= start_col, start_col + 1, end_col)
+    return start_col, end_col
+
+
+def build_occupancy(day_data, rooms):
+    """1日分の部屋×10分枠の占有行列を作る
+
+    day_data は normalize_time_columns 済みであること。手術（case）は day_data の行順に
+    0から番号を振り、後の行ほど優先される（後から描画したバーが上に重なる）。返り値:
+        'start_min', 'end_min', 'valid', 'weight': 全手術の時刻（分）・有効フラグ・稼働率の部屋重み
+        'room_idx': rooms 内の行番号（rooms にない部屋は -1）
+        'urgency': 区分コード
+        'start_col', 'end_col': バーの開始・終了列
+        'labels': バーのラベル（描画しない手術は None）
+        'drawable': バーを描画する手術
+        'first_col': 行列の0列目に対応するExcel列番号（D列=4）
+        'owner': (部屋数, 枠数) 各枠を占める手術番号（空きは -1）
+        'urgency_grid': (部屋数, 枠数) 各枠の区分コード（空きは -1）
+        'count': (部屋数, 枠数) 各枠に重なっている手術の数
+    """
+    first_col = 4
+    n_cases = len(day_data)
+    start_min = day_data[START_MIN_COL]
+    end_min = day_data[END_MIN_COL]
+    valid = (start_min != INVALID_MINUTE) & (end_min != INVALID_MINUTE)
+
+    # 部屋・診療科・区分ごとの値はカテゴリごとに一度だけ求め、手術ごとにはコードで引く
+    weight = day_data.category_lookup("実施手術室名", "weight",
+                                      lambda r: ROOM_WEIGHT.get(str(r), 1.0), np.float64)
+    room_lookup = {room: i for i, room in enumerate(rooms)}
+    room_idx = day_data.category_lookup("実施手術室名", ("room_idx", tuple(rooms)),
+                                        lambda r: room_lookup.get(r, -1), np.int32)
+
+    if "実施申込区分" in day_data:
+        urgency = day_data.category_lookup("実施申込区分", "urgency",
+                                           lambda v: URGENCY_CODES.get(v, URGENCY_SCHEDULED), np.int8)
     else:
-        calc_start = 9 * 60
-        calc_end = 17 * 60
-        standard_minutes = 480
+        urgency = np.full(n_cases, URGENCY_SCHEDULED, dtype=np.int8)
+
+    start_col, end_col = minutes_to_bar_cols(start_min, end_min, first_col)
+
+    labels = np.full(n_cases, None, dtype=object)
+    candidates = np.flatnonzero(valid & (room_idx >= 0))
+    if len(candidates):
+        dept_shorts = day_data.category_lookup("執刀診療科名", "dept_short", dept_short_name, object)
+        names = (day_data["実施手術名０１"] if "実施手術名０１" in day_data
+                 else np.full(n_cases, "", dtype=object))
+        for case in candidates:
+            if dept_shorts[case] is not None:
+                labels[case] = bar_label(dept_shorts[case], names[case])
+    drawable = labels != None  # noqa: E711（要素ごとの比較）
+
+    n_slots = max(TPL_COL_END, int(end_col[drawable].max()) if drawable.any() else 0) - first_col + 1
+    owner = np.full((len(rooms), n_slots), -1, dtype=np.int32)
+    count = np.zeros((len(rooms), n_slots), dtype=np.int16)
+    cols = np.arange(first_col, first_col + n_slots)
+    covered = ((cols >= start_col[:, None]) & (cols <= end_col[:, None]) & drawable[:, None])
+    case_i, slot_i = np.nonzero(covered)
+    np.maximum.at(owner, (room_idx[case_i], slot_i), case_i.astype(np.int32))
+    np.add.at(count, (room_idx[case_i], slot_i), 1)
+    urgency_grid = np.where(owner >= 0, urgency[np.maximum(owner, 0)], -1).astype(np.int8)
+
+    return {
+        'start_min': start_min, 'end_min': end_min, 'valid': valid, 'weight': weight,
+        'room_idx': room_idx, 'urgency': urgency,
+        'start_col': start_col, 'end_col': end_col, 'labels': labels, 'drawable': drawable,
+        'first_col': first_col, 'owner': owner, 'urgency_grid': urgency_grid, 'count': count,
+    }
 
-    room_count = 9.0
-    total_available = standard_minutes * room_count
-    total_used = 0
 
-    ROOM_WEIGHT = {
-        "01A": 0.5,
-        "01B": 0.5,
-        "ｱﾝｷﾞｵ": 0,
-    }
+def occupancy_runs(owner_row):
+    """占有行列の1行を同じ手術が続く区間 [(開始枠, 終了枠+1, 手術番号), ...] に分割（空きは除く）"""
+    bounds = np.flatnonzero(np.diff(owner_row)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(owner_row)]))
+    return [(int(s), int(e), int(owner_row[s])) for s, e in zip(starts, ends) if owner_row[s] >= 0]
 
-    for _, row in day_data.iterrows():
-        try:
-            room_name = str(row["実施手術室名"])
-            weight = ROOM_WEIGHT.get(room_name, 1.0)
-            if weight == 0:
-                continue
 
-            t = row["入室時刻"]
-            if isinstance(t, str):
-                parts = t.split(":")
-                start_min = int(parts[0]) * 60 + int(parts[1])
-            elif isinstance(t, timedelta):
-                start_min = int(t.total_seconds()) // 60
-            elif isinstance(t, dt_module.time):
-                start_min = t.hour * 60 + t.minute
-            else:
-                start_min = t.hour * 60 + t.minute
-
-            t2 = row["麻酔終了時刻"]
-            if isinstance(t2, str):
-                parts = t2.split(":")
-                end_min = int(parts[0]) * 60 + int(parts[1])
-            elif isinstance(t2, timedelta):
-                end_min = int(t2.total_seconds()) // 60
-            elif isinstance(t2, dt_module.time):
-                end_min = t2.hour * 60 + t2.minute
-            else:
-                end_min = t2.hour * 60 + t2.minute
+def find_overlaps(occupancy, rooms):
+    """同じ部屋で手術が重なっている区間を [(部屋名, 開始列, 終了列), ...] で返す"""
+    overlaps = []
+    first_col = occupancy['first_col']
+    for room_idx, flags in enumerate(occupancy['count'] > 1):
+        for s, e, _ in occupancy_runs(np.where(flags, 0, -1)):
+            overlaps.append((rooms[room_idx], first_col + s, first_col + e - 1))
+    return overlaps
+
 
-            clipped_start = max(start_min, calc_start)
-            clipped_end = min(end_min, calc_end)
-            if clipped_end > clipped_start:
-                total_used += (clipped_end - clipped_start) * weight
-        except Exception:
-            pass
+def calculate_utilization(occupancy, weekday=""):
+    """稼働率を計算（build_occupancy の結果から、分単位で求める）"""
+    if "土" in weekday:
+        calc_start, calc_end = UTILIZATION_SATURDAY_WINDOW
+    else:
+        calc_start, calc_end = UTILIZATION_WEEKDAY_WINDOW
+    standard_minutes = calc_end - calc_start
+
+    room_count = UTILIZATION_ROOM_COUNT
+    total_available = standard_minutes * room_count
+
+    start_min = occupancy['start_min']
+    end_min = occupancy['end_min']
+    used = np.minimum(end_min, calc_end) - np.maximum(start_min, calc_start)
+    total_used = float(np.sum(np.clip(used, 0, None) * occupancy['weight'] * occupancy['valid']))
 
     if total_available > 0:
         return total_used / total_available
     return 0
 
 
+# 曜日の略称（datetime.weekday() の順）
+WEEKDAY_SHORT = ("月", "火", "水", "木", "金", "土", "日")
+
+
+def build_weekday_heatmap(table, rooms=None):
+    """曜日×部屋×10分枠ごとに、手術が入っていた日の割合と緊急手術が入っていた日の割合を求める
+
+    全日付の 日付×部屋×枠 の占有を差分配列の累積和でまとめて作り、曜日ごとの合計を
+    1回の行列積で取る（手術・日付ごとのループはない）。枠はガントチャートの列（D列～）と
+    同じで、同じ部屋で重なる手術は1つと数える。返り値:
+        'days': (7,) 曜日ごとの日数（月曜=0）
+        'occupancy': (7, 部屋数, 枠数) 手術が入っていた日の割合（日数が0の曜日は0）
+        'emergency': (7, 部屋数, 枠数) 緊急手術が入っていた日の割合
+        'first_col': 0枠目に対応するExcel列番号（D列=4）
+        'counts': (7, 2, 部屋数, 枠数) 割合の分子の日数（weekday_heatmap を参照）
+    """
+    rooms = rooms or ROOM_ORDER
+    first_col = 4
+    n_slots = TPL_COL_END - first_col + 1
+
+    def date_ordinal(value):
+        dt = parse_date(value)
+        return dt.toordinal() if dt is not None else -1
+
+    ordinal = table.category_lookup("手術実施日", "ordinal", date_ordinal, np.int64)
+    day_ordinals = np.unique(ordinal[ordinal >= 0])
+    weekday = (day_ordinals - 1) % 7  # 序数1（西暦1年1月1日）は月曜
+    days = np.bincount(weekday, minlength=7)
+
+    room_lookup = {room: i for i, room in enumerate(rooms)}
+    room_idx = table.category_lookup("実施手術室名", ("room_idx", tuple(rooms)),
+                                     lambda r: room_lookup.get(r, -1), np.int32)
+    start_min, end_min = table[START_MIN_COL], table[END_MIN_COL]
+    cases = np.flatnonzero((ordinal >= 0) & (room_idx >= 0)
+                           & (start_min != INVALID_MINUTE) & (end_min != INVALID_MINUTE))
+    if "実施申込区分" in table:
+        urgency = table.category_lookup("実施申込区分", "urgency",
+                                        lambda v: URGENCY_CODES.get(v, URGENCY_SCHEDULED), np.int8)
+        emergency = np.flatnonzero(urgency[cases] == URGENCY_EMERGENCY)
+    else:
+        emergency = np.empty(0, dtype=np.intp)
+
+    # バーと同じ開始列～終了列の枠を占有とする（開始枠に +1、終了枠の次に -1）
+    start_col, end_col = minutes_to_bar_cols(start_min[cases], end_min[cases], first_col)
+    start_slot = np.clip(start_col - first_col, 0, n_slots)
+    end_slot = np.clip(end_col - first_col + 1, 0, n_slots)
+    day_idx = np.searchsorted(day_ordinals, ordinal[cases])
+
+    # 種類 0: 全手術、1: 緊急手術
+    picked = np.concatenate((np.arange(len(cases)), emergency))
+    kind = np.concatenate((np.zeros(len(cases), dtype=np.intp), np.ones(len(emergency), dtype=np.intp)))
+    index = (kind, day_idx[picked], room_idx[cases][picked])
+    diff = np.zeros((2, len(day_ordinals), len(rooms), n_slots + 1), dtype=np.int16)
+    np.add.at(diff, index + (start_slot[picked],), 1)
+    np.add.at(diff, index + (end_slot[picked],), -1)
+    occupied = np.cumsum(diff[..., :n_slots], axis=-1, dtype=np.int16) > 0
+
+    # (7, 日数) の曜日の対応表との積で、曜日ごとの占有日数を求める
+    per_weekday = np.tensordot(np.eye(7, dtype=np.float32)[weekday], occupied, axes=([0], [1]))
+    return weekday_heatmap(days, per_weekday, first_col)
+
+
+def weekday_heatmap(days, counts, first_col=4):
+    """曜日ごとの日数と占有日数から build_weekday_heatmap の結果を作る
+
+    counts: (7, 2, 部屋数, 枠数) 曜日・種類（0: 全手術、1: 緊急手術）ごとに手術が入っていた日数。
+    別々の期間の days・counts を足して渡すと、期間を合わせた集計になる（--append 用）。
+    """
+    rates = counts / np.maximum(days, 1)[:, None, None, None]
+    return {'days': days, 'counts': counts, 'occupancy': rates[:, 0], 'emergency': rates[:, 1],
+            'first_col': first_col}
+
+
+def room_label(room):
+    """部屋名の列に表示する名前（手術室一覧の表示名。なければ実施手術室名のまま）"""
+    return ROOM_LABELS.get(room, room)
+
+
+def room_note_label(room):
+    """稼働率の凡例での部屋の呼び方（既定の部屋構成では「アンギオ室」など。なければ表示名）"""
+    return ROOM_NOTE_LABELS.get(room, room_label(room))
+
+
+def _room_included(value):
+    """手術室一覧の稼働率の列の値を、稼働率に含めるかどうかにする（空欄は含める）"""
+    if value is None or str(value).strip() == "":
+        return True
+    if isinstance(value, (bool, int, float)):
+        return bool(value)
+    return str(value).strip().lower() not in ROOM_EXCLUDE_VALUES
+
+
+def room_catalogue_from_records(records):
+    """手術室一覧の行（{見出し: 値} の辞書、表示順）を [{'name', 'label', 'weight', 'utilization'}, ...] に揃える
+
+    見出しは ROOM_COLUMNS の日本語（部屋名・表示名・重み・稼働率）か英語のどちらでもよい。
+    部屋名が空欄の行は読み飛ばす。表示名・重みを省略した部屋は部屋名・1.0、稼働率を省略した部屋は含める。
+    """
+    catalogue = []
+    seen = set()
+    for record in records:
+        record = {ROOM_COLUMNS.get(str(key).strip(), str(key).strip()): value for key, value in record.items()
+                  if key is not None}
+        name = record.get("name")
+        if name is None or str(name).strip() == "":
+            continue
+        name = str(name).strip()
+        if name in seen:
+            raise ValueError(f"手術室一覧に同じ部屋が複数あります: {name}")
+        seen.add(name)
+        label, weight = record.get("label"), record.get("weight")
+        catalogue.append({
+            'name': name,
+            'label': name if label is None or str(label).strip() == "" else str(label).strip(),
+            'weight': 1.0 if weight is None or str(weight).strip() == "" else float(weight),
+            'utilization': _room_included(record.get("utilization")),
+        })
+    if not catalogue:
+        raise ValueError("手術室一覧に部屋がありません")
+    return catalogue
+
+
+def read_room_records(path):
+    """手術室一覧の設定ファイル（JSON / CSV）を {見出し: 値} の辞書のリストとして読む
+
+    JSON: [{"name": "01A", "label": "1A", "weight": 0.5, "utilization": true}, ...]
+    CSV: 1行目が見出し（部屋名,表示名,重み,稼働率）。Excel で保存した BOM 付きでもよい
+    """
+    if os.path.splitext(path)[1].lower() == ".csv":
+        import csv
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            return list(csv.DictReader(f))
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_room_sheet(input_path, sheet_title=ROOM_SHEET_TITLE):
+    """入力ファイルの手術室一覧シートを {見出し: 値} の辞書のリストとして読む（シートがなければ None）
+
+    シートの有無は zip 内の workbook.xml だけで確かめ、ある場合だけ読み取り専用モードで開く。
+    部屋名（"02" など）は文字列として入力しておくこと（数値の 2 は "2" として扱われる）。
+    """
+    try:
+        with zipfile.ZipFile(input_path) as zf:
+            if sheet_part_name(zf, sheet_title) is None:
+                return None
+    except Exception:
+        return None
+    wb = load_workbook(input_path, read_only=True)
+    try:
+        rows = list(wb[sheet_title].iter_rows(values_only=True))
+    finally:
+        wb.close()
+    if not rows:
+        return []
+    header = rows[0]
+    return [dict(zip(header, row)) for row in rows[1:]]
+
+
+def load_room_catalogue(path=None, input_path=None):
+    """手術室一覧を読み込む（設定ファイル path、なければ入力ファイルの手術室シート。どちらもなければ None）"""
+    if path:
+        records = read_room_records(path)
+        source = path
+    elif input_path:
+        records = read_room_sheet(input_path)
+        source = f"{os.path.basename(input_path)} の「{ROOM_SHEET_TITLE}」シート"
+        if records is None:
+            return None
+    else:
+        return None
+    catalogue = room_catalogue_from_records(records)
+    print(f"手術室一覧を読み込みました: {source}（{len(catalogue)}室）")
+    return catalogue
+
+
+def set_room_catalogue(catalogue):
+    """手術室一覧を表示順（ROOM_ORDER）・表示名・稼働率の重みと分母の部屋数に反映する
+
+    重みは一覧の全部屋について持ち（稼働率に含めない部屋は0）、分母の部屋数はその合計にする。
+    一覧にない部屋は、これまでどおりバーを描画せず、稼働率には重み1.0で数える。
+    """
+    global ROOM_ORDER, ROOM_LABELS, ROOM_NOTE_LABELS, ROOM_WEIGHT, UTILIZATION_ROOM_COUNT
+    ROOM_ORDER = [room['name'] for room in catalogue]
+    ROOM_LABELS = {room['name']: room['label'] for room in catalogue if room['label'] != room['name']}
+    ROOM_NOTE_LABELS = {}
+    ROOM_WEIGHT = {room['name']: room['weight'] if room['utilization'] else 0 for room in catalogue}
+    UTILIZATION_ROOM_COUNT = float(sum(ROOM_WEIGHT.values()))
+
+
+# 手術室一覧から決まる設定（room_state / set_room_state の対象）
+ROOM_STATE_NAMES = ("ROOM_ORDER", "ROOM_LABELS", "ROOM_NOTE_LABELS", "ROOM_WEIGHT", "UTILIZATION_ROOM_COUNT")
+
+
+def room_state():
+    """手術室一覧から決まる設定をまとめて返す（ワーカープロセス・蓄積データへの受け渡し用）"""
+    return {name: globals()[name] for name in ROOM_STATE_NAMES}
+
+
+def set_room_state(state):
+    """room_state() の結果をこのプロセスの設定として反映する
+
+    凡例用の呼び方（ROOM_NOTE_LABELS）を持たない古い蓄積データでは、表示名をそのまま使う。
+    """
+    state = dict(state)
+    state.setdefault("ROOM_NOTE_LABELS", {})
+    globals().update({name: state[name] for name in ROOM_STATE_NAMES})
+
+
+def utilization_notes():
+    """稼働率の凡例の2行（計算時間帯と部屋数、重みが1でない部屋と稼働率に含めない部屋）"""
+    windows = "、".join(
+        f"{caption}:{format_window(window)}（{(window[1] - window[0]) / 60:g}h×{UTILIZATION_ROOM_COUNT:g}室）"
+        for caption, window in (("平日", UTILIZATION_WEEKDAY_WINDOW), ("土曜", UTILIZATION_SATURDAY_WINDOW)))
+    partial, excluded = {}, []
+    for room in ROOM_ORDER:
+        weight = ROOM_WEIGHT.get(room, 1.0)
+        if weight == 0:
+            excluded.append(room_note_label(room))
+        elif weight != 1:
+            partial.setdefault(weight, []).append(room_note_label(room))
+    notes = [f"{'・'.join(names)}は{'各' if len(names) > 1 else ''}{weight:g}室換算"
+             for weight, names in partial.items()]
+    if excluded:
+        notes.append(f"{'・'.join(excluded)}は除外")
+    return f"※稼働率 = {windows}", "※" + "、".join(notes) if notes else ""
+
+
+# --scenarios でファイルを指定しないときの試算条件（scenario_from_spec の形式）
+DEFAULT_SCENARIOS = [
+    {"name": "現行"},
+    {"name": "平日8:30-17:30", "weekday": "8:30-17:30"},
+    {"name": "アンギオ室を含む", "weights": {"ｱﾝｷﾞｵ": 1.0}},
+    {"name": "01A・01Bを別室", "weights": {"01A": 1.0, "01B": 1.0}},
+]
+
+
+def parse_window(value):
+    """"8:30-17:30" 形式の時間帯を経過分の (開始, 終了) に変換"""
+    start, end = (time_to_minutes(part.strip()) for part in value.split("-"))
+    if end <= start:
+        raise ValueError(f"時間帯の終了が開始より前です: {value}")
+    return start, end
+
+
+def scenario_from_spec(spec):
+    """稼働率の試算条件を calculate_utilization と同じ形に揃える
+
+    spec: {'name': 名前, 'weekday': "9:00-17:00", 'saturday': "9:00-13:00",
+           'weights': {部屋名: 重み}, 'room_count': 分母の部屋数}
+    省略した項目は現行の条件（UTILIZATION_* と ROOM_WEIGHT）。weights は ROOM_WEIGHT への上書きで、
+    room_count を省略した場合は weights を変えたときだけ ROOM_ORDER の重みの合計を使う。
+    """
+    weights = dict(ROOM_WEIGHT)
+    weights.update(spec.get("weights") or {})
+    room_count = spec.get("room_count")
+    if room_count is None:
+        room_count = (sum(weights.get(room, 1.0) for room in ROOM_ORDER) if spec.get("weights")
+                      else UTILIZATION_ROOM_COUNT)
+    return {
+        'name': str(spec.get("name", "")),
+        'weekday': parse_window(spec["weekday"]) if spec.get("weekday") else UTILIZATION_WEEKDAY_WINDOW,
+        'saturday': parse_window(spec["saturday"]) if spec.get("saturday") else UTILIZATION_SATURDAY_WINDOW,
+        'weights': weights,
+        'room_count': float(room_count),
+    }
+
+
+def load_scenarios(path=None):
+    """試算条件のJSONファイル（scenario_from_spec の spec のリスト）を読み込む（省略時は DEFAULT_SCENARIOS）
+
+    例: [{"name": "現行"},
+         {"name": "8:30-17:30・アンギオ含む", "weekday": "8:30-17:30", "weights": {"ｱﾝｷﾞｵ": 1}}]
+    """
+    specs = DEFAULT_SCENARIOS
+    if path:
+        with open(path, encoding="utf-8") as f:
+            specs = json.load(f)
+    scenarios = []
+    for i, spec in enumerate(specs, 1):
+        scenario = scenario_from_spec(spec)
+        scenario['name'] = scenario['name'] or f"条件{i}"
+        scenarios.append(scenario)
+    return scenarios
+
+
+def evaluate_scenarios(table, dates, weekday_map, scenarios):
+    """全試算条件・全日付の稼働率をまとめて求める（calculate_utilization と同じ計算）
+
+    手術ごとの (条件数, 手術数) の稼働時間を配列で求め、条件・日付ごとの合計を1回の
+    bincount で取る。返り値: (used, available)。どちらも (条件数, 日付数) の分単位の配列で、
+    稼働率は used / available。
+    """
+    date_index = {date_str: i for i, date_str in enumerate(dates)}
+    day_idx = table.category_lookup("手術実施日", ("date_index", tuple(dates)),
+                                    lambda d: date_index.get(d, -1), np.int32)
+    saturday = np.array([isinstance(weekday_map.get(d), str) and "土" in weekday_map[d] for d in dates],
+                        dtype=np.intp)
+    # (条件数, 平日/土曜, 開始/終了)
+    windows = np.array([(s['weekday'], s['saturday']) for s in scenarios], dtype=np.int32).reshape(-1, 2, 2)
+    weights = np.stack([
+        table.category_lookup("実施手術室名", ("weight", tuple(sorted(s['weights'].items()))),
+                              lambda r, w=s['weights']: w.get(str(r), 1.0), np.float64)
+        for s in scenarios
+    ]) if scenarios else np.zeros((0, len(table)))
+
+    start_min = table[START_MIN_COL].astype(np.int32)
+    end_min = table[END_MIN_COL].astype(np.int32)
+    cases = np.flatnonzero((day_idx >= 0) & (start_min != INVALID_MINUTE) & (end_min != INVALID_MINUTE))
+    case_day = day_idx[cases]
+    case_windows = windows[:, saturday[case_day]]  # (条件数, 手術数, 開始/終了)
+    used = (np.minimum(end_min[cases], case_windows[..., 1]) - np.maximum(start_min[cases], case_windows[..., 0]))
+    used = np.clip(used, 0, None) * weights[:, cases]
+
+    n_scenarios, n_dates = len(scenarios), len(dates)
+    flat = (np.arange(n_scenarios)[:, None] * n_dates + case_day).ravel()
+    used_by_day = np.bincount(flat, weights=used.ravel(),
+                              minlength=n_scenarios * n_dates).reshape(n_scenarios, n_dates)
+    day_windows = windows[:, saturday]  # (条件数, 日付数, 開始/終了)
+    room_count = np.array([s['room_count'] for s in scenarios], dtype=np.float64)
+    available = (day_windows[..., 1] - day_windows[..., 0]) * room_count[:, None]
+    return used_by_day, available
+
+
 def get_tpl_border(row_offset, col):
-    """テンプレートの罫線を取得（なければ空Border）"""
+    """テンプレートの罫線を取得（なければ空Border）
+
+    返り値は共有オブジェクトのため、変更せずに StyleRegistry.apply に渡すこと。
+    """
     if TPL_HAS_TEMPLATE and (row_offset, col) in TPL_BORDERS:
-        return copy(TPL_BORDERS[(row_offset, col)])
-    return Border()
+        return TPL_BORDERS[(row_offset, col)]
+    return EMPTY_BORDER
+
+
+def template_row_offset(room_idx, n_rooms):
+    """room_idx 番目（0始まり）の部屋行に使うテンプレートの行オフセット（1=7行目）
+
+    部屋数がテンプレートの部屋行（7～17行目）以下なら先頭から順に使う。多い場合は先頭・末尾の部屋に
+    テンプレートの先頭・末尾の行を使い、間の部屋には中間の行（8～16行目）を順に繰り返して使う。
+    """
+    tpl_rooms = TPL_LAST_ROOM_ROW - TPL_FIRST_ROOM_ROW + 1
+    if n_rooms <= tpl_rooms or room_idx == 0:
+        return 1 + room_idx
+    if room_idx == n_rooms - 1:
+        return tpl_rooms
+    return 2 + (room_idx - 1) % (tpl_rooms - 2)
+
+
+def block_row_heights(n_rooms):
+    """1日分のブロックの行高 {行オフセット: 高さ}（0=ヘッダ行。テンプレートがなければ空）"""
+    if not TPL_HAS_TEMPLATE:
+        return {}
+    tpl_offsets = [0] + [template_row_offset(room_idx, n_rooms) for room_idx in range(n_rooms)]
+    return {offset: TPL_ROW_HEIGHTS[tpl_offset] for offset, tpl_offset in enumerate(tpl_offsets)
+            if tpl_offset in TPL_ROW_HEIGHTS}
 
 
 def merge_border_with_fill(tpl_border):
@@ -253,17 +1190,16 @@ def merge_border_with_fill(tpl_border):
     return copy(tpl_border)
 
 
-def write_day_block(ws, start_row, date_str, weekday, day_data, rooms):
-    """1日分のガントチャートブロックを書き込む"""
+def write_block_frame(ws, start_row, date_label, rooms, styles):
+    """1日分のブロックの枠（行高・時間軸ヘッダ・罫線・日付列・部屋名）を書き込む
 
+    手術バーは含まない。date_label は日付列（全部屋行を縦結合）に表示する文字列。
+    """
     header_row = start_row
-    utilization = calculate_utilization(day_data, rooms, weekday)
-    last_col = TPL_COL_END  # CO列=93
 
     # 行高を設定
-    if TPL_HAS_TEMPLATE:
-        for offset, h in TPL_ROW_HEIGHTS.items():
-            ws.row_dimensions[start_row + offset].height = h
+    for offset, h in block_row_heights(len(rooms)).items():
+        ws.row_dimensions[start_row + offset].height = h
 
     # --- ヘッダ行（時間軸） ---
     # テンプレートの6行目の書式を適用
@@ -271,9 +1207,8 @@ def write_day_block(ws, start_row, date_str, weekday, day_data, rooms):
         cell = ws.cell(row=header_row, column=c)
         if TPL_HAS_TEMPLATE and c in TPL_HEADER_CELLS:
             hdr = TPL_HEADER_CELLS[c]
-            cell.font = copy(hdr['font'])
-            cell.alignment = copy(hdr['alignment'])
-        cell.border = get_tpl_border(0, c)
+            styles.apply(cell, font=hdr['font'], alignment=hdr['alignment'])
+        styles.apply(cell, border=get_tpl_border(0, c))
 
     # B6: "日付"
     ws.cell(row=header_row, column=2, value="日付")
@@ -292,84 +1227,683 @@ def write_day_block(ws, start_row, date_str, weekday, day_data, rooms):
     # --- 部屋ごとの行 ---
     for room_idx, room in enumerate(rooms):
         row = start_row + 1 + room_idx
-        room_data = day_data[day_data["実施手術室名"] == room]
-        tpl_row_offset = 1 + room_idx  # テンプレートの7行目~17行目に対応
+        tpl_row_offset = template_row_offset(room_idx, len(rooms))  # テンプレートの7行目~17行目に対応
 
         # 罫線をテンプレートから適用
         for c in range(TPL_COL_START, TPL_COL_END + 1):
-            ws.cell(row=row, column=c).border = get_tpl_border(tpl_row_offset, c)
+            styles.apply(ws.cell(row=row, column=c), border=get_tpl_border(tpl_row_offset, c))
 
         # 日付列（最初の部屋行のみ表示、全部屋を縦結合）
         if room_idx == 0:
-            util_label = f"{date_str}\n{utilization:.1%}"
-            date_cell = ws.cell(row=row, column=2, value=util_label)
+            date_cell = ws.cell(row=row, column=2, value=date_label)
             if TPL_HAS_TEMPLATE and TPL_DATE_FONT:
-                date_cell.font = copy(TPL_DATE_FONT)
-                date_cell.alignment = copy(TPL_DATE_ALIGNMENT)
+                styles.apply(date_cell, font=TPL_DATE_FONT, alignment=TPL_DATE_ALIGNMENT)
             else:
-                date_cell.font = Font(name=FONT_NAME, size=9, bold=True)
-                date_cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            date_cell.border = get_tpl_border(tpl_row_offset, 2)
+                styles.apply(date_cell,
+                             font=styles.font(name=FONT_NAME, size=9, bold=True),
+                             alignment=styles.alignment(horizontal='center', vertical='center', wrap_text=True))
+            styles.apply(date_cell, border=get_tpl_border(tpl_row_offset, 2))
             if len(rooms) > 1:
                 ws.merge_cells(start_row=row, start_column=2, end_row=row + len(rooms) - 1, end_column=2)
 
         # 部屋名
-        room_cell = ws.cell(row=row, column=3, value=room)
+        room_cell = ws.cell(row=row, column=3, value=room_label(room))
         if TPL_HAS_TEMPLATE and TPL_ROOM_FONT:
-            room_cell.font = copy(TPL_ROOM_FONT)
+            styles.apply(room_cell, font=TPL_ROOM_FONT)
+        else:
+            styles.apply(room_cell, font=styles.font(name=FONT_NAME, size=7))
+        styles.apply(room_cell, alignment=styles.alignment(horizontal='center', vertical='center'))
+
+
+def bar_label_styles(styles):
+    """手術バーのラベルセルの (font, alignment)"""
+    return (styles.font(name=LABEL_FONT_NAME, size=LABEL_FONT_SIZE, color="000000"),
+            styles.alignment(vertical='center', wrap_text=False))
+
+
+def build_block_skeleton(rooms):
+    """手術バーと日付ラベルを除いた1日分のブロックの完成形を作る（全日付で共通）
+
+    作業用ワークブックに write_block_frame で枠を書き込み、結合セルの罫線処理まで
+    済んだ状態を読み出す。返り値:
+        {'rows': [{列: (値, style_key)}, ...]  # 行オフセット順（0=ヘッダ行）
+         'merges': [(開始行オフセット, 開始列, 終了行オフセット, 終了列), ...],
+         'heights': {行オフセット: 行高}}
+    """
+    scratch_wb = Workbook()
+    scratch_styles = StyleRegistry(scratch_wb)
+    scratch = scratch_wb.active
+    write_block_frame(scratch, 1, None, rooms, scratch_styles)
+
+    rows = [{} for _ in range(1 + len(rooms))]
+    for cell in scratch._cells.values():
+        key = scratch_styles.key_of(cell._style) if cell.has_style else None
+        rows[cell.row - 1][cell.column] = (cell.value, key)
+    for row_cells in rows:
+        sorted_cells = sorted(row_cells.items())
+        row_cells.clear()
+        row_cells.update(sorted_cells)
+
+    merges = [(mcr.min_row - 1, mcr.min_col, mcr.max_row - 1, mcr.max_col)
+              for mcr in scratch.merged_cells.ranges]
+    return {'rows': rows, 'merges': merges, 'heights': block_row_heights(len(rooms))}
+
+
+def compute_day_block(date_str, weekday, day_data, rooms, styles, skeleton):
+    """1日分のガントチャートブロックの内容を計算する（ワークシートには書き込まない）
+
+    返り値:
+        {'skeleton': skeleton,
+         'cells': [{列: (値, style_key)}, ...]  # 行オフセットごとの skeleton への上書き
+         'utilization': 稼働率,
+         'overlaps': find_overlaps の結果}
+    skeleton: build_block_skeleton(rooms) の結果
+    """
+    occupancy = build_occupancy(day_data, rooms)
+    utilization = calculate_utilization(occupancy, weekday)
+    if PROFILE is not None:
+        # 時刻・診療科が読み取れない行（_safe_time_to_minutes / dept_short_name の例外）と
+        # ROOM_ORDER にない部屋の行は、稼働率またはバーから除外される
+        valid, room_idx = occupancy['valid'], occupancy['room_idx']
+        profile_count("rows_dropped.utilization.invalid_time", np.count_nonzero(~valid))
+        profile_count("rows_dropped.bars.invalid_time", np.count_nonzero(~valid))
+        profile_count("rows_dropped.bars.unknown_room", np.count_nonzero(valid & (room_idx < 0)))
+        profile_count("rows_dropped.bars.invalid_dept",
+                      np.count_nonzero(valid & (room_idx >= 0) & ~occupancy['drawable']))
+    skeleton_rows = skeleton['rows']
+    cells = [{} for _ in skeleton_rows]
+
+    # 日付列（最初の部屋行、全部屋を縦結合済み）
+    _, date_key = skeleton_rows[1].get(2, (None, None))
+    cells[1][2] = (f"{date_str}\n{utilization:.1%}", date_key)
+
+    # ラベル位置 {部屋行: {列: ラベル}}（同じ列に複数あれば後の手術が優先）
+    labels_at = [{} for _ in rooms]
+    for case in np.flatnonzero(occupancy['drawable']):
+        labels_at[occupancy['room_idx'][case]][int(occupancy['start_col'][case])] = occupancy['labels'][case]
+
+    # 手術バー：占有行列の区間ごとに塗りつぶし、ラベル列にはラベル書式を設定
+    fills = [styles.fill(color) for color in urgency_colors()]
+    bar_font, bar_alignment = bar_label_styles(styles)
+    first_col = occupancy['first_col']
+    for room_idx, owner_row in enumerate(occupancy['owner']):
+        offset = 1 + room_idx
+        tpl_offset = template_row_offset(room_idx, len(rooms))
+        base_cells = skeleton_rows[offset]
+        row_cells = cells[offset]
+        room_labels = labels_at[room_idx]
+        for s, e, case in occupancy_runs(owner_row):
+            fill = fills[occupancy['urgency'][case]]
+            for c in range(first_col + s, first_col + e):
+                value, key = base_cells.get(c, (None, None))
+                font, _, _, alignment = key or (None, None, None, None)
+                if c in room_labels:
+                    value, font, alignment = room_labels[c], bar_font, bar_alignment
+                # 塗りつぶし後もテンプレート罫線を保持
+                row_cells[c] = (value, styles.style_key(font, fill, get_tpl_border(tpl_offset, c), alignment))
+
+    return {'skeleton': skeleton, 'cells': cells, 'utilization': utilization,
+            'overlaps': find_overlaps(occupancy, rooms)}
+
+
+def place_day_block(ws, block, start_row, styles):
+    """compute_day_block の結果を ws の start_row 行目から書き込む
+
+    ws が書き込み専用・直接書き込みのワークシートの場合は行単位で追記する
+    （start_row は次に追記される行番号と一致していること）。
+    """
+    skeleton = block['skeleton']
+    streaming = is_streaming(ws)
+    direct = isinstance(ws, DirectWorksheet)
+
+    for offset, (base_cells, over_cells) in enumerate(zip(skeleton['rows'], block['cells'])):
+        row = start_row + offset
+        if offset in skeleton['heights']:
+            ws.row_dimensions[row].height = skeleton['heights'][offset]
+
+        if over_cells:
+            row_cells = dict(base_cells)
+            row_cells.update(over_cells)
+            if max(over_cells) > max(base_cells, default=0):
+                row_cells = dict(sorted(row_cells.items()))
         else:
-            room_cell.font = Font(name=FONT_NAME, size=7)
-        room_cell.alignment = Alignment(horizontal='center', vertical='center')
+            row_cells = base_cells
+        profile_count("cells_written.gantt", len(row_cells))
+
+        if direct:
+            ws.append_styled({col: (value, 0 if key is None else styles.xf_id(key))
+                              for col, (value, key) in sorted(row_cells.items())})
+        elif streaming:
+            values = [None] * max(row_cells, default=0)
+            for col, (value, key) in row_cells.items():
+                if key is None:
+                    values[col - 1] = value
+                    continue
+                cell = WriteOnlyCell(ws, value=value)
+                cell._style = copy(styles.style_array(key))
+                values[col - 1] = cell
+            ws.append(values)
+        else:
+            for col, (value, key) in row_cells.items():
+                cell = ws.cell(row=row, column=col, value=value)
+                if key is not None:
+                    cell._style = copy(styles.style_array(key))
+
+    for r1, c1, r2, c2 in skeleton['merges']:
+        ws.merged_cells.add(CellRange(min_row=start_row + r1, min_col=c1,
+                                      max_row=start_row + r2, max_col=c2))
+    profile_count("merges.gantt", len(skeleton['merges']))
+
+    return start_row + len(skeleton['rows'])
+
+
+def day_label(date_str, weekday_map):
+    """日付列に表示する日付（"09/01(月)"）と曜日の略称を返す（読み取れない日付はそのまま表示）"""
+    weekday = weekday_map.get(date_str, "")
+    weekday_short = weekday.replace("曜日", "") if isinstance(weekday, str) else ""
+    dt = parse_date(date_str)
+    if dt is None:
+        profile_count("dates.unparsed_label")
+        return date_str, weekday_short
+    return f"{dt.month:02d}/{dt.day:02d}({weekday_short})", weekday_short
+
+
+def compute_day_blocks(table, dates, weekday_map, day_index, styles, rooms=None, cache=None):
+    """全日付のブロックを一度だけ計算する（各シートは並び順を変えて再利用する）
+
+    {手術実施日: compute_day_block の結果} を返す。
+    day_index: build_day_index(table) の結果
+    cache: {手術実施日: (day_hashes の値, ブロック)}。指定時はハッシュが一致する日付の
+           ブロックを再利用し、再計算した日付の結果を書き戻す
+    """
+    rooms = rooms or ROOM_ORDER
+    skeleton = None
+    hashes = day_hashes(table, day_index) if cache is not None else {}
+    blocks = {}
+    for date_str in dates:
+        if cache is not None:
+            cached = cache.get(date_str)
+            if cached is not None and cached[0] == hashes.get(date_str):
+                blocks[date_str] = cached[1]
+                profile_count("blocks.reused")
+                continue
 
-        # 手術バーを描画
-        for _, op in room_data.iterrows():
-            try:
-                start_col = time_to_col(op["入室時刻"])
-                end_col = time_to_col(op["麻酔終了時刻"])
+        day_pos = day_index.get(date_str, slice(0, 0))
+        day_data = table.take(day_pos)
+        date_display, weekday_short = day_label(date_str, weekday_map)
+
+        if skeleton is None:
+            skeleton = build_block_skeleton(rooms)
+        blocks[date_str] = compute_day_block(date_display, weekday_short, day_data, rooms,
+                                             styles, skeleton)
+        profile_count("blocks.computed")
+        if cache is not None:
+            cache[date_str] = (hashes.get(date_str), blocks[date_str])
+    return blocks
+
+
+def compute_day_bars(table, dates, weekday_map, day_index, rooms=None):
+    """各日付のバー・ラベル・稼働率を、HTML出力用の単純な値のリストにする
+
+    compute_day_block と同じ占有行列から作るため、塗りつぶす枠・ラベルの位置・稼働率は
+    ワークシートと同じになる。枠は0始まり（0枠目がD列）。返り値（日付順）:
+        [{'date': 日付列の表示, 'weekday': 曜日の略称, 'utilization': 稼働率,
+          'bars': [[部屋行, 開始枠, 終了枠+1, 区分コード], ...],
+          'labels': [[部屋行, 枠, ラベル], ...]}, ...]
+    """
+    rooms = rooms or ROOM_ORDER
+    days = []
+    for date_str in dates:
+        day_pos = day_index.get(date_str, slice(0, 0))
+        occupancy = build_occupancy(table.take(day_pos), rooms)
+        date_display, weekday_short = day_label(date_str, weekday_map)
+
+        bars = []
+        for room_idx, owner_row in enumerate(occupancy['owner']):
+            for start, end, case in occupancy_runs(owner_row):
+                bars.append([room_idx, start, end, int(occupancy['urgency'][case])])
+        labels_at = {}  # 同じ位置に複数あれば後の手術が優先
+        for case in np.flatnonzero(occupancy['drawable']):
+            position = (int(occupancy['room_idx'][case]),
+                        int(occupancy['start_col'][case]) - occupancy['first_col'])
+            labels_at[position] = occupancy['labels'][case]
+        days.append({
+            'date': date_display,
+            'weekday': weekday_short,
+            'utilization': round(calculate_utilization(occupancy, weekday_short), 4),
+            'bars': bars,
+            'labels': [[room_idx, slot, label] for (room_idx, slot), label in labels_at.items()],
+        })
+    return days
+
+
+# ブロックの内容に影響する入力列（day_hashes の対象）
+BLOCK_INPUT_COLUMNS = ["手術実施日", "曜日", "実施手術室名", START_MIN_COL, END_MIN_COL,
+                       "執刀診療科名", "実施申込区分", "実施手術名０１"]
+
+# ブロックキャッシュの形式が変わったら上げる
+BLOCK_CACHE_VERSION = 3
+
+
+def value_pickle(obj):
+    """obj の値だけで決まる pickle（同じ値のオブジェクトの共有のしかたに左右されない）
+
+    通常の pickle は同じオブジェクトへの2回目以降の参照を短く書くため、元ファイルの文字列の
+    持ち方（共有文字列かどうか）や、キャッシュから読んだかどうかで結果が変わる。
+    共有を記録しない fast モードで書き出す（循環参照のあるオブジェクトには使えない）。
+    """
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.fast = True
+    pickler.dump(obj)
+    return buffer.getvalue()
+
+
+def day_hashes(table, day_index):
+    """日付ごとの入力行の内容ハッシュ {手術実施日: 16進文字列}"""
+    columns = [table[c] for c in BLOCK_INPUT_COLUMNS if c in table]
+    return {date_str: hashlib.blake2b(value_pickle([values[day_pos].tolist() for values in columns]),
+                                      digest_size=16).hexdigest()
+            for date_str, day_pos in day_index.items()}
+
+
+def settings_fingerprint(rooms=None):
+    """ブロックの描画結果に影響する設定（テンプレート・部屋と表示名・略称など）のハッシュ"""
+    payload = value_pickle((
+        BLOCK_CACHE_VERSION, template_state(), list(rooms or ROOM_ORDER), ROOM_LABELS, ROOM_NOTE_LABELS,
+        DEPT_SHORT, ROOM_WEIGHT,
+        UTILIZATION_WEEKDAY_WINDOW, UTILIZATION_SATURDAY_WINDOW, UTILIZATION_ROOM_COUNT,
+        TIME_START_HOUR, TIME_END_HOUR, COLS_PER_HOUR, TPL_COL_START, TPL_COL_END, FONT_NAME,
+    ))
+    return hashlib.sha256(payload).hexdigest()
+
+
+# キャッシュの署名鍵。共有フォルダではなく、利用者ごとの設定フォルダに置く
+CACHE_KEY_FILE = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~"),
+                              ".手術室ガントチャート", "cache.key")
+CACHE_KEY = None
+
+
+def cache_key():
+    """キャッシュの署名鍵（初回は乱数で作り、CACHE_KEY_FILE に利用者だけが読める権限で保存する）"""
+    global CACHE_KEY
+    if CACHE_KEY is None:
+        os.makedirs(os.path.dirname(CACHE_KEY_FILE), exist_ok=True)
+        try:
+            fd = os.open(CACHE_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(CACHE_KEY_FILE, "rb") as f:
+                CACHE_KEY = f.read()
+        else:
+            CACHE_KEY = secrets.token_bytes(32)
+            with os.fdopen(fd, "wb") as f:
+                f.write(CACHE_KEY)
+    return CACHE_KEY
 
-                start_col = max(start_col, 4)
-                end_col = min(end_col, last_col)
 
-                if end_col <= start_col:
-                    end_col = start_col + 1
+def signed_pickle(obj):
+    """obj の pickle の先頭に、cache_key() による HMAC-SHA256 の署名を付けたバイト列"""
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return hmac.new(cache_key(), data, hashlib.sha256).digest() + data
 
-                dept_short = DEPT_SHORT.get(op["執刀診療科名"], op["執刀診療科名"][0])
 
-                urgency = op.get("実施申込区分", "定時")
-                if urgency == "緊急":
-                    color = COLOR_EMERGENCY
-                elif urgency == "臨時":
-                    color = COLOR_URGENT
-                else:
-                    color = COLOR_SCHEDULED
-                fill = PatternFill('solid', fgColor=color)
+def load_signed_pickle(raw):
+    """signed_pickle の結果を読み込む
 
-                surgery_name = op.get("実施手術名０１", "")
-                if not isinstance(surgery_name, str):
-                    surgery_name = ""
-                short_name = shorten_surgery_name(surgery_name, max_chars=40)
+    キャッシュは出力フォルダ（共有フォルダ）に置かれ、pickle は読み込むだけでコードを実行できるため、
+    このプロセスの利用者が書いた（署名が一致する）ものだけを読み込む。一致しなければ ValueError。
+    """
+    signature, data = raw[:32], raw[32:]
+    if not hmac.compare_digest(signature, hmac.new(cache_key(), data, hashlib.sha256).digest()):
+        raise ValueError("キャッシュの署名が一致しません")
+    return pickle.loads(data)
 
-                bar_label = f"【{dept_short}】-{short_name}"
-                bar_font = Font(name=LABEL_FONT_NAME, size=LABEL_FONT_SIZE, color="000000")
 
-                for c in range(start_col, end_col + 1):
-                    cell = ws.cell(row=row, column=c)
-                    cell.fill = fill
-                    # 塗りつぶし後もテンプレート罫線を保持
-                    cell.border = get_tpl_border(tpl_row_offset, c)
+def block_cache_path(output_path):
+    """出力ファイルに対応するブロックキャッシュ（サイドカーファイル）のパス"""
+    return os.path.splitext(output_path)[0] + ".cache"
 
-                ws.cell(row=row, column=start_col, value=bar_label)
-                ws.cell(row=row, column=start_col).font = bar_font
-                ws.cell(row=row, column=start_col).alignment = Alignment(vertical='center', wrap_text=False)
 
-            except Exception:
-                pass
+def load_block_cache(path, fingerprint):
+    """ブロックキャッシュを読み込む（ない・壊れている・設定が変わった場合は空）"""
+    try:
+        with open(path, "rb") as f:
+            saved = load_signed_pickle(f.read())
+    except Exception:
+        return {}
+    if not isinstance(saved, dict) or saved.get('fingerprint') != fingerprint:
+        return {}
+    return saved.get('days', {})
 
-    return start_row + 1 + len(rooms)
 
+def save_block_cache(path, fingerprint, cache, dates):
+    """ブロックキャッシュを保存する（今回のデータにない日付は削除する）"""
+    dates = set(dates)
+    days = {date_str: entry for date_str, entry in cache.items() if date_str in dates}
+    with open(path, "wb") as f:
+        f.write(signed_pickle({'fingerprint': fingerprint, 'days': days}))
 
-def setup_gantt_sheet(ws, title):
-    """ガントチャートシートの共通初期設定（列幅・タイトル・凡例）"""
+
+# ============================================================
+# 直接書き込み（--writer direct）
+# ============================================================
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+XLSX_MAIN_URI = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+XLSX_REL_URI = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_URI = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPE_PREFIX = "application/vnd.openxmlformats-officedocument."
+
+
+def text_xml(text):
+    """文字列の <t> 要素（共有文字列・インライン文字列の中身）"""
+    text = ILLEGAL_CHARACTERS_RE.sub("", text)
+    space = ' xml:space="preserve"' if text.strip() and text != text.strip() else ""
+    return f"<t{space}>{xml_escape(text)}</t>"
+
+
+class DirectDimension:
+    """DirectWorksheet の列幅・行の高さ（ColumnDimension / RowDimension のうち使う項目だけ）"""
+
+    def __init__(self):
+        self.width = None
+        self.height = None
+        self.hidden = False
+
+
+class DirectMergedCells:
+    """DirectWorksheet の結合セル（ws.merged_cells.add だけに対応。重複の確認はしない）"""
+
+    def __init__(self):
+        self.ranges = []
+
+    def add(self, cell_range):
+        self.ranges.append(str(cell_range))
+
+
+class DirectWorksheet:
+    """シートのXMLを直接書き出すワークシート（--writer direct）
+
+    書き込み専用ワークシートと同じく append で1行ずつ追記する（値と WriteOnlyCell を混在できる）。
+    append_styled では書式番号（StyleRegistry.xf_id）を直接指定でき、セルのオブジェクトを作らない。
+    行のXMLは一時ファイルにためておき、列幅・結合セル・印刷設定などは保存時に前後へ付け足す。
+    """
+
+    FLUSH_ROWS = 1000   # この行数ごとに一時ファイルへ書き出す
+
+    def __init__(self, parent, title, first_row=1):
+        self.parent = parent
+        self.title = title
+        self.column_dimensions = defaultdict(DirectDimension)
+        self.row_dimensions = defaultdict(DirectDimension)
+        self.merged_cells = DirectMergedCells()
+        self.sheet_view = SimpleNamespace(zoomScale=None)
+        self.page_setup = SimpleNamespace(orientation=None, paperSize=None, fitToWidth=None, fitToHeight=None)
+        self.hyperlinks = []   # [(セル番地, リンク先)]
+        self._max_row = first_row - 1   # first_row: 最初に append する行の行番号（追記用）
+        self._pending = []
+        self._rows = tempfile.TemporaryFile()
+
+    def append(self, row):
+        """1行を追記する（None は空セル）"""
+        self._max_row += 1
+        row_num = self._max_row
+        cells = []
+        for col, item in enumerate(row, 1):
+            if item is None:
+                continue
+            ref = f"{get_column_letter(col)}{row_num}"
+            if isinstance(item, Cell):
+                cells.append(self._object_xml(ref, item))
+            else:
+                cells.append(self._value_xml(ref, item, 0))
+        self._add_row(row_num, cells)
+
+    def append_styled(self, row_cells):
+        """1行を追記する。row_cells: {列番号: (値, 書式番号)}（列番号の昇順）"""
+        self._max_row += 1
+        row_num = self._max_row
+        self._add_row(row_num, [self._value_xml(f"{get_column_letter(col)}{row_num}", value, xf)
+                                for col, (value, xf) in row_cells.items()])
+
+    @property
+    def max_row(self):
+        """最後に append した行の行番号"""
+        return self._max_row
+
+    def append_rows_xml(self, rows_xml, last_row, merges=()):
+        """別に作った行のXML（bytes）を追記する。last_row: その最後の行番号（--parallel 用）"""
+        self._flush()
+        self._rows.write(rows_xml)
+        self._max_row = last_row
+        self.merged_cells.ranges.extend(merges)
+
+    def _value_xml(self, ref, value, xf):
+        style = f' s="{xf}"' if xf else ""
+        if value is None or value == "":
+            return f'<c r="{ref}"{style}/>'
+        kind = type(value)
+        if kind is str and value[0] != "=" and value not in ERROR_CODES:
+            return self._string_xml(ref, style, value)
+        if kind is int or kind is float:
+            return f'<c r="{ref}"{style} t="n"><v>{safe_string(value)}</v></c>'
+        # 日時・数式などは openpyxl のセルで型と表示形式を決める
+        cell = WriteOnlyCell(self)
+        if xf:
+            cell._style = copy(self.parent._cell_styles[xf])
+        cell.value = value
+        return self._object_xml(ref, cell)
+
+    def _object_xml(self, ref, cell):
+        xf = self.parent._cell_styles.add(cell._style) if cell.has_style else 0
+        style = f' s="{xf}"' if xf else ""
+        if cell.hyperlink:
+            self.hyperlinks.append((ref, cell.hyperlink.target))
+        value, data_type = cell._value, cell.data_type
+        if value is None or value == "":
+            return f'<c r="{ref}"{style}/>'
+        if data_type == "s":
+            return self._string_xml(ref, style, str(value))
+        if data_type == "f":
+            return f'<c r="{ref}"{style}><f>{xml_escape(str(value)[1:])}</f><v/></c>'
+        if data_type == "d":
+            value, data_type = to_excel(value, self.parent.epoch), "n"
+        return f'<c r="{ref}"{style} t="{data_type}"><v>{xml_escape(safe_string(value))}</v></c>'
+
+    def _string_xml(self, ref, style, text):
+        if self.parent.inline_strings:
+            return f'<c r="{ref}"{style} t="inlineStr"><is>{text_xml(text)}</is></c>'
+        return f'<c r="{ref}"{style} t="s"><v>{self.parent.shared_string(text)}</v></c>'
+
+    def _add_row(self, row_num, cells):
+        attrs = ""
+        dim = self.row_dimensions.get(row_num)
+        if dim is not None:
+            if dim.height is not None:
+                attrs += f' ht="{safe_string(dim.height)}" customHeight="1"'
+            if dim.hidden:
+                attrs += ' hidden="1"'
+        if cells or attrs:
+            self._pending.append(f'<row r="{row_num}"{attrs}>{"".join(cells)}</row>')
+            if len(self._pending) >= self.FLUSH_ROWS:
+                self._flush()
+
+    def _flush(self):
+        self._rows.write("".join(self._pending).encode("utf-8"))
+        self._pending = []
+
+    def _head_xml(self):
+        parts = [XML_DECLARATION, f'<worksheet xmlns="{XLSX_MAIN_URI}" xmlns:r="{XLSX_REL_URI}">']
+        zoom = self.sheet_view.zoomScale
+        view = f' zoomScale="{zoom}"' if zoom else ""
+        parts.append(f'<sheetViews><sheetView workbookViewId="0"{view}/></sheetViews>')
+        parts.append('<sheetFormatPr baseColWidth="8" defaultRowHeight="15"/>')
+        cols = []
+        for letter, dim in sorted(self.column_dimensions.items(), key=lambda item: column_index_from_string(item[0])):
+            attrs = ""
+            if dim.width is not None:
+                attrs += f' width="{safe_string(dim.width)}" customWidth="1"'
+            if dim.hidden:
+                attrs += ' hidden="1"'
+            if attrs:
+                index = column_index_from_string(letter)
+                cols.append(f'<col min="{index}" max="{index}"{attrs}/>')
+        if cols:
+            parts.append(f'<cols>{"".join(cols)}</cols>')
+        parts.append("<sheetData>")
+        return "".join(parts)
+
+    def _tail_xml(self):
+        parts = ["</sheetData>"]
+        ranges = self.merged_cells.ranges
+        if ranges:
+            parts.append(f'<mergeCells count="{len(ranges)}">')
+            parts.extend(f'<mergeCell ref="{ref}"/>' for ref in ranges)
+            parts.append("</mergeCells>")
+        if self.hyperlinks:
+            parts.append("<hyperlinks>")
+            parts.extend(f'<hyperlink ref="{ref}" r:id="rId{i}"/>'
+                         for i, (ref, _) in enumerate(self.hyperlinks, 1))
+            parts.append("</hyperlinks>")
+        parts.append('<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/>')
+        setup = "".join(f' {name}="{getattr(self.page_setup, name)}"'
+                        for name in ("orientation", "paperSize", "fitToWidth", "fitToHeight")
+                        if getattr(self.page_setup, name) is not None)
+        if setup:
+            parts.append(f"<pageSetup{setup}/>")
+        parts.append("</worksheet>")
+        return "".join(parts)
+
+    def rows_xml(self):
+        """append した行の XML（<row> 要素の並び、bytes）。シート全体ではなく行だけを使う場合用"""
+        self._flush()
+        self._rows.seek(0)
+        xml = self._rows.read()
+        self._rows.close()
+        return xml
+
+    def hyperlink_rels_xml(self):
+        """ハイパーリンクのリンク先（シートの .rels）"""
+        rels = "".join(f'<Relationship Id="rId{i}" Type="{XLSX_REL_URI}/hyperlink" '
+                       f'Target={quoteattr(target)} TargetMode="External"/>'
+                       for i, (_, target) in enumerate(self.hyperlinks, 1))
+        return f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_REL_URI}">{rels}</Relationships>'
+
+    def write(self, archive, name):
+        """シートのXMLを archive（ZipFile）の name に書き出す"""
+        self._flush()
+        self._rows.seek(0)
+        with archive.open(name, "w") as out:
+            out.write(self._head_xml().encode("utf-8"))
+            shutil.copyfileobj(self._rows, out)
+            out.write(self._tail_xml().encode("utf-8"))
+        self._rows.close()
+
+
+class DirectWorkbook(Workbook):
+    """--writer direct のブック
+
+    書式（フォント・塗りつぶし・セル書式の組み合わせ）の管理と styles.xml の作成は openpyxl の
+    Workbook をそのまま使い、シートと共有文字列・ブックの構成ファイルは自前で書き出す。
+    inline_strings: 文字列を共有文字列にせず、セルに直接書く（既存のブックに行を足す --append 用）
+    """
+
+    def __init__(self, inline_strings=False):
+        super().__init__(write_only=True)
+        self.inline_strings = inline_strings
+        self._strings = {}   # 共有文字列 {文字列: 番号}
+
+    # 書式の一覧（styles.xml の元。セル書式の番号は _cell_styles の位置）
+    STYLE_LIST_NAMES = ("_fonts", "_fills", "_borders", "_alignments", "_protections", "_number_formats",
+                        "_cell_styles")
+
+    def style_state(self):
+        """書式の一覧（別プロセスのブックで同じセル書式の番号を使うために渡す）"""
+        return {name: getattr(self, name) for name in self.STYLE_LIST_NAMES}
+
+    def set_style_state(self, state):
+        for name, values in state.items():
+            setattr(self, name, values)
+
+    def create_sheet(self, title=None, index=None):
+        ws = DirectWorksheet(self, title or f"Sheet{len(self._sheets) + 1}")
+        self._sheets.append(ws)
+        return ws
+
+    def shared_string(self, text):
+        """共有文字列の番号（初めての文字列は追加する）"""
+        index = self._strings.get(text)
+        if index is None:
+            index = self._strings[text] = len(self._strings)
+        return index
+
+    def _shared_strings_xml(self):
+        items = [f"<si>{text_xml(text)}</si>" for text in self._strings]
+        return (f'{XML_DECLARATION}<sst xmlns="{XLSX_MAIN_URI}" count="{len(items)}" uniqueCount="{len(items)}">'
+                f'{"".join(items)}</sst>')
+
+    def _package_parts(self):
+        """シート以外の構成ファイル {パス: XML}"""
+        n = len(self._sheets)
+        sheets = "".join(f'<sheet name={quoteattr(ws.title)} sheetId="{i}" r:id="rId{i}"/>'
+                         for i, ws in enumerate(self._sheets, 1))
+        sheet_rels = "".join(f'<Relationship Id="rId{i}" Type="{XLSX_REL_URI}/worksheet" '
+                             f'Target="worksheets/sheet{i}.xml"/>' for i in range(1, n + 1))
+        sheet_types = "".join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                              f'ContentType="{CONTENT_TYPE_PREFIX}spreadsheetml.worksheet+xml"/>'
+                              for i in range(1, n + 1))
+        return {
+            "[Content_Types].xml": (
+                f'{XML_DECLARATION}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                f'<Override PartName="/xl/workbook.xml" ContentType="{CONTENT_TYPE_PREFIX}spreadsheetml.sheet.main+xml"/>'
+                f'{sheet_types}'
+                f'<Override PartName="/xl/styles.xml" ContentType="{CONTENT_TYPE_PREFIX}spreadsheetml.styles+xml"/>'
+                f'<Override PartName="/xl/theme/theme1.xml" ContentType="{CONTENT_TYPE_PREFIX}theme+xml"/>'
+                f'<Override PartName="/xl/sharedStrings.xml" '
+                f'ContentType="{CONTENT_TYPE_PREFIX}spreadsheetml.sharedStrings+xml"/>'
+                '</Types>'),
+            "_rels/.rels": (
+                f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_REL_URI}">'
+                f'<Relationship Id="rId1" Type="{XLSX_REL_URI}/officeDocument" Target="xl/workbook.xml"/>'
+                '</Relationships>'),
+            "xl/workbook.xml": (
+                f'{XML_DECLARATION}<workbook xmlns="{XLSX_MAIN_URI}" xmlns:r="{XLSX_REL_URI}">'
+                f'<bookViews><workbookView activeTab="0"/></bookViews><sheets>{sheets}</sheets>'
+                '<calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>'),
+            "xl/_rels/workbook.xml.rels": (
+                f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_REL_URI}">{sheet_rels}'
+                f'<Relationship Id="rId{n + 1}" Type="{XLSX_REL_URI}/styles" Target="styles.xml"/>'
+                f'<Relationship Id="rId{n + 2}" Type="{XLSX_REL_URI}/theme" Target="theme/theme1.xml"/>'
+                f'<Relationship Id="rId{n + 3}" Type="{XLSX_REL_URI}/sharedStrings" Target="sharedStrings.xml"/>'
+                '</Relationships>'),
+            "xl/styles.xml": tostring(write_stylesheet(self)),
+            "xl/theme/theme1.xml": theme_xml,
+        }
+
+    def save(self, filename):
+        with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for name, xml in self._package_parts().items():
+                archive.writestr(name, xml)
+            for i, ws in enumerate(self._sheets, 1):
+                ws.write(archive, f"xl/worksheets/sheet{i}.xml")
+                if ws.hyperlinks:
+                    archive.writestr(f"xl/worksheets/_rels/sheet{i}.xml.rels", ws.hyperlink_rels_xml())
+            archive.writestr("xl/sharedStrings.xml", self._shared_strings_xml())
+
+
+def is_streaming(ws):
+    """行単位で追記するワークシート（書き込み専用・直接書き込み）かどうか"""
+    return isinstance(ws, (WriteOnlyWorksheet, DirectWorksheet))
+
+
+def setup_sheet(ws, header_cells):
+    """ガントチャート形式のシートの共通初期設定（列幅・見出し・表示倍率・印刷設定）
+
+    header_cells: 1～4行目に書き込む [(行, 列, 値, font, fill, alignment), ...]
+    書き込み専用ワークシートの場合は1～5行目を追記する。
+    """
     # 列幅をテンプレートから適用
     ws.column_dimensions['A'].width = 2
     if TPL_HAS_TEMPLATE:
@@ -382,178 +1916,2156 @@ def setup_gantt_sheet(ws, title):
         for i in range(4, 4 + total_time_cols):
             ws.column_dimensions[get_column_letter(i)].width = 2.5
 
-    ws.cell(row=1, column=2, value=title)
-    ws.cell(row=1, column=2).font = Font(name=FONT_NAME, size=14, bold=True)
-
-    legend_row = 2
-    legend_col = 2
-    ws.cell(row=legend_row, column=legend_col, value="■凡例:")
-    ws.cell(row=legend_row, column=legend_col).font = Font(name=FONT_NAME, size=8, bold=True)
-
-    cell = ws.cell(row=legend_row, column=legend_col + 2, value="定時")
-    cell.fill = PatternFill('solid', fgColor=COLOR_SCHEDULED)
-    cell.font = Font(name=FONT_NAME, size=8)
-    cell.alignment = Alignment(horizontal='center')
-
-    cell = ws.cell(row=legend_row, column=legend_col + 4, value="臨時")
-    cell.fill = PatternFill('solid', fgColor=COLOR_URGENT)
-    cell.font = Font(name=FONT_NAME, size=8)
-    cell.alignment = Alignment(horizontal='center')
-
-    cell = ws.cell(row=legend_row, column=legend_col + 6, value="緊急")
-    cell.fill = PatternFill('solid', fgColor=COLOR_EMERGENCY)
-    cell.font = Font(name=FONT_NAME, size=8)
-    cell.alignment = Alignment(horizontal='center')
-
-    ws.cell(row=legend_row + 1, column=legend_col, value="※稼働率 = 平日:9:00-17:00（8h×9室）、土曜:9:00-13:00（4h×9室）")
-    ws.cell(row=legend_row + 1, column=legend_col).font = Font(name=FONT_NAME, size=8)
-    ws.cell(row=legend_row + 2, column=legend_col, value="※01A・01Bは各0.5室換算、アンギオ室は除外")
-    ws.cell(row=legend_row + 2, column=legend_col).font = Font(name=FONT_NAME, size=8)
+    profile_count("cells_written.header", len(header_cells))
+    streamed_rows = {}
+    for row, col, value, font, fill, alignment in header_cells:
+        if is_streaming(ws):
+            cell = WriteOnlyCell(ws, value=value)
+            streamed_rows.setdefault(row, {})[col] = cell
+        else:
+            cell = ws.cell(row=row, column=col, value=value)
+        if fill:
+            cell.fill = fill
+        cell.font = font
+        if alignment:
+            cell.alignment = alignment
 
     ws.sheet_view.zoomScale = 80
     ws.page_setup.orientation = 'landscape'
-    ws.page_setup.paperSize = ws.PAPERSIZE_A3
+    ws.page_setup.paperSize = Worksheet.PAPERSIZE_A3
     ws.page_setup.fitToWidth = 1
     ws.page_setup.fitToHeight = 0
 
+    if is_streaming(ws):
+        # 1～4行目（タイトル・凡例）と5行目（空行）
+        for row in range(1, 6):
+            cells = streamed_rows.get(row, {})
+            ws.append([cells.get(c) for c in range(1, max(cells, default=0) + 1)])
 
-def write_gantt_for_dates(ws, df, date_list, weekday_map):
-    """日付リストに従ってガントチャートブロックを書き込む"""
-    current_row = 6
-    count = 0
-    for date_str in date_list:
-        day_data = df[df["手術実施日"] == date_str]
-        weekday = weekday_map.get(date_str, "")
-        weekday_short = weekday.replace("曜日", "") if isinstance(weekday, str) else ""
 
-        try:
-            dt = pd.to_datetime(date_str)
-            date_display = f"{dt.month:02d}/{dt.day:02d}({weekday_short})"
-        except Exception:
-            date_display = date_str
+def setup_gantt_sheet(ws, title):
+    """ガントチャートシートの共通初期設定（列幅・タイトル・凡例）
 
-        next_row = write_day_block(ws, current_row, date_display, weekday_short, day_data, ROOM_ORDER)
+    書き込み専用ワークシートの場合は1～5行目を追記する。
+    """
+    legend_row = 2
+    legend_col = 2
+    notes = utilization_notes()
+    # (行, 列, 値, font, fill, alignment)
+    header_cells = [
+        (1, 2, title, Font(name=FONT_NAME, size=14, bold=True), None, None),
+        (legend_row, legend_col, "■凡例:", Font(name=FONT_NAME, size=8, bold=True), None, None),
+        (legend_row, legend_col + 2, "定時", Font(name=FONT_NAME, size=8),
+         PatternFill('solid', fgColor=COLOR_SCHEDULED), Alignment(horizontal='center')),
+        (legend_row, legend_col + 4, "臨時", Font(name=FONT_NAME, size=8),
+         PatternFill('solid', fgColor=COLOR_URGENT), Alignment(horizontal='center')),
+        (legend_row, legend_col + 6, "緊急", Font(name=FONT_NAME, size=8),
+         PatternFill('solid', fgColor=COLOR_EMERGENCY), Alignment(horizontal='center')),
+        (legend_row + 1, legend_col, notes[0], Font(name=FONT_NAME, size=8), None, None),
+        (legend_row + 2, legend_col, notes[1], Font(name=FONT_NAME, size=8), None, None),
+    ]
+    setup_sheet(ws, header_cells)
+
+
+def write_gantt_for_dates(ws, blocks, date_list, styles, start_row=6):
+    """日付リストの順にガントチャートブロックを配置する
+
+    blocks: compute_day_blocks の結果
+    ws が書き込み専用ワークシートの場合は setup_gantt_sheet で5行目まで追記済みであること。
+    """
+    streaming = is_streaming(ws)
+    current_row = start_row
+    count = 0
+    for date_str in date_list:
+        if streaming and count > 0:
+            ws.append([])  # ブロック間の空行
+        next_row = place_day_block(ws, blocks[date_str], current_row, styles)
         current_row = next_row + 1
         count += 1
     return count
 
 
-def main():
-    print(f"入力ファイル読み込み: {INPUT_FILE}")
-    df = pd.read_excel(INPUT_FILE, sheet_name="ガントチャートデータ", dtype={"実施手術室名": str})
+# 曜日別ヒートマップの塗りつぶしの段階数（割合を 0～20%、～40%、… に分ける）
+HEATMAP_LEVELS = 5
 
-    # 日付でソート
-    df["手術実施日_sort"] = pd.to_datetime(df["手術実施日"], format="%Y/%m/%d")
-    df = df.sort_values(["手術実施日_sort", "実施手術室名", "入室時刻"])
 
-    dates = df["手術実施日"].unique()
-    weekday_map = dict(zip(df["手術実施日"], df["曜日"]))
+def heatmap_colors(color, levels=HEATMAP_LEVELS):
+    """白から color（"RRGGBB"）までを levels 段階に分けた色のリスト（薄い順、最後が color）"""
+    rgb = [int(color[i:i + 2], 16) for i in (0, 2, 4)]
+    return ["".join(f"{round(255 + (c - 255) * level / levels):02X}" for c in rgb)
+            for level in range(1, levels + 1)]
 
-    wb = Workbook()
 
-    # === シート1: ガントチャートデータ（元データコピー） ===
-    data_ws = wb.active
-    data_ws.title = "ガントチャートデータ"
+def compute_heatmap_blocks(heatmap, skeleton, styles):
+    """build_weekday_heatmap の結果を、曜日ごとの「占有率」「緊急」の2つのブロックにする
 
-    # テンプレートシートから設定を読み取り
-    global COLOR_SCHEDULED, COLOR_URGENT, COLOR_EMERGENCY, LABEL_FONT_NAME, LABEL_FONT_SIZE
-    src_wb = load_workbook(INPUT_FILE)
-    if "テンプレート" in src_wb.sheetnames:
-        tpl_ws = src_wb["テンプレート"]
-
-        # 色の読み取り（C2=定時、C3=臨時、C4=緊急）
-        c2_fill = tpl_ws.cell(row=2, column=3).fill
-        if c2_fill.fill_type == "solid" and c2_fill.fgColor and c2_fill.fgColor.rgb:
-            rgb = str(c2_fill.fgColor.rgb)
-            if len(rgb) == 8:
-                rgb = rgb[2:]
-            COLOR_SCHEDULED = rgb
-            print(f"テンプレートC2から定時の色を取得: #{COLOR_SCHEDULED}")
-        c3_fill = tpl_ws.cell(row=3, column=3).fill
-        if c3_fill.fill_type == "solid" and c3_fill.fgColor and c3_fill.fgColor.rgb:
-            rgb = str(c3_fill.fgColor.rgb)
-            if len(rgb) == 8:
-                rgb = rgb[2:]
-            COLOR_URGENT = rgb
-            print(f"テンプレートC3から臨時の色を取得: #{COLOR_URGENT}")
-        c4_fill = tpl_ws.cell(row=4, column=3).fill
-        if c4_fill.fill_type == "solid" and c4_fill.fgColor and c4_fill.fgColor.rgb:
-            rgb = str(c4_fill.fgColor.rgb)
-            if len(rgb) == 8:
-                rgb = rgb[2:]
-            COLOR_EMERGENCY = rgb
-            print(f"テンプレートC4から緊急の色を取得: #{COLOR_EMERGENCY}")
-
-        # ラベルフォントの読み取り
-        c5_font = tpl_ws.cell(row=5, column=3).font
-        if c5_font.name:
-            LABEL_FONT_NAME = c5_font.name
-        if c5_font.size:
-            LABEL_FONT_SIZE = c5_font.size
-        print(f"テンプレートC5からラベルフォントを取得: {LABEL_FONT_NAME}, {LABEL_FONT_SIZE}pt")
-
-        # 書式情報の読み取り（列幅・行高・罫線・フォント）
-        load_template(tpl_ws)
-
-    # ガントチャートデータシートのコピー
-    if "ガントチャートデータ" in src_wb.sheetnames:
-        src_ws = src_wb["ガントチャートデータ"]
+    ブロックは compute_day_block と同じ形式（place_day_block でそのまま書き込める）で、
+    各枠に割合（%、0 の枠は空欄）を表示し、割合に応じた濃さで塗りつぶす。
+    {(曜日番号, 種類): ブロック} と、表示順のキーのリストを返す（日数が0の曜日は含めない）。
+    skeleton: build_block_skeleton(rooms) の結果（rooms は build_weekday_heatmap と同じもの）
+    """
+    skeleton_rows = skeleton['rows']
+    n_rooms = len(skeleton_rows) - 1
+    _, date_key = skeleton_rows[1].get(2, (None, None))
+    font, alignment = bar_label_styles(styles)
+    first_col = heatmap['first_col']
+    kinds = (("occupancy", "占有率", COLOR_URGENT), ("emergency", "緊急", COLOR_EMERGENCY))
+    fills = {kind: [styles.fill(color) for color in heatmap_colors(base_color)]
+             for kind, _, base_color in kinds}
 
-        for col_letter, dim in src_ws.column_dimensions.items():
-            data_ws.column_dimensions[col_letter].width = dim.width
-            data_ws.column_dimensions[col_letter].hidden = dim.hidden
+    blocks = {}
+    keys = []
+    for weekday, n_days in enumerate(heatmap['days']):
+        if not n_days:
+            continue
+        for kind, caption, _ in kinds:
+            rates = heatmap[kind][weekday]
+            cells = [{} for _ in skeleton_rows]
+            cells[0][2] = ("曜日", skeleton_rows[0].get(2, (None, None))[1])
+            cells[1][2] = (f"{WEEKDAY_SHORT[weekday]}曜日\n{caption}\n（{n_days}日）", date_key)
+            percents = np.rint(rates * 100).astype(int)
+            levels = np.minimum(np.ceil(rates * HEATMAP_LEVELS).astype(int), HEATMAP_LEVELS)
+            for room_idx, slot in zip(*np.nonzero(rates > 0)):
+                offset = 1 + int(room_idx)
+                c = first_col + int(slot)
+                border = get_tpl_border(template_row_offset(int(room_idx), n_rooms), c)
+                cells[offset][c] = (int(percents[room_idx, slot]),
+                                    styles.style_key(font, fills[kind][levels[room_idx, slot] - 1], border, alignment))
+            blocks[(weekday, kind)] = {'skeleton': skeleton, 'cells': cells}
+            keys.append((weekday, kind))
+    return blocks, keys
+
+
+def write_heatmap_sheet(ws, heatmap, title, styles, rooms=None):
+    """曜日別ヒートマップのシートを書き込む（見出し・凡例のあとに曜日ごとのブロックを並べる）
+
+    heatmap: build_weekday_heatmap(table, rooms) の結果
+    ws が書き込み専用ワークシートの場合は行単位で追記する。
+    """
+    rooms = rooms or ROOM_ORDER
+    legend_row = 2
+    legend_col = 2
+    day_counts = "・".join(f"{WEEKDAY_SHORT[weekday]}{n_days}日"
+                          for weekday, n_days in enumerate(heatmap['days']) if n_days)
+    header_cells = [
+        (1, 2, title, Font(name=FONT_NAME, size=14, bold=True), None, None),
+        (legend_row, legend_col, "■凡例:", Font(name=FONT_NAME, size=8, bold=True), None, None),
+        (legend_row, legend_col + 2, "占有率", Font(name=FONT_NAME, size=8),
+         PatternFill('solid', fgColor=COLOR_URGENT), Alignment(horizontal='center')),
+        (legend_row, legend_col + 4, "緊急", Font(name=FONT_NAME, size=8),
+         PatternFill('solid', fgColor=COLOR_EMERGENCY), Alignment(horizontal='center')),
+        (legend_row + 1, legend_col,
+         "※各10分枠に手術が入っていた日の割合（%）。緊急は緊急手術が入っていた日の割合（色が濃いほど高い）",
+         Font(name=FONT_NAME, size=8), None, None),
+        (legend_row + 2, legend_col, f"※集計日数: {day_counts}", Font(name=FONT_NAME, size=8), None, None),
+    ]
+    setup_sheet(ws, header_cells)
+
+    blocks, keys = compute_heatmap_blocks(heatmap, build_block_skeleton(rooms), styles)
+    return write_gantt_for_dates(ws, blocks, keys, styles)
+
+
+def format_window(window):
+    """経過分の (開始, 終了) を "9:00-17:00" 形式にする"""
+    return "-".join(f"{m // 60}:{m % 60:02d}" for m in window)
+
+
+def write_scenario_sheet(ws, dates, weekday_map, scenarios, used, available, title):
+    """稼働率の試算シート（行: 日付、列: 試算条件）を書き込む
+
+    used, available: evaluate_scenarios の結果。「期間全体」の行は期間の合計から求める。
+    ws が書き込み専用ワークシートの場合は行単位で追記する。
+    """
+    title_font = Font(name=FONT_NAME, size=14, bold=True)
+    header_font = Font(name=FONT_NAME, size=9, bold=True)
+    note_font = Font(name=FONT_NAME, size=8)
+    body_font = Font(name=FONT_NAME, size=9)
+    center = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    header_fill = PatternFill('solid', fgColor=COLOR_SCHEDULED)
+
+    ws.column_dimensions['A'].width = 2
+    ws.column_dimensions['B'].width = 12
+    ws.column_dimensions['C'].width = 6
+    for i in range(len(scenarios)):
+        ws.column_dimensions[get_column_letter(4 + i)].width = 16
+    ws.sheet_view.zoomScale = 80
+    ws.row_dimensions[5].height = 36  # 条件の行（3行表示）
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(available > 0, used / available, 0.0)
+        total_available = available.sum(axis=1)
+        totals = np.where(total_available > 0, used.sum(axis=1) / total_available, 0.0)
+
+    # (値, font, fill, alignment, 表示形式) の行
+    rows = [
+        [(title, title_font, None, None, None)],
+        [("※稼働率 = 時間帯内の手術時間（部屋の重み付き）÷（時間帯の長さ × 部屋数）", note_font, None, None, None)],
+        [],
+        [("日付", header_font, header_fill, center, None), ("曜日", header_font, header_fill, center, None)]
+        + [(s['name'], header_font, header_fill, center, None) for s in scenarios],
+        [("条件", note_font, None, center, None), None]
+        + [(f"平日 {format_window(s['weekday'])}\n土曜 {format_window(s['saturday'])}\n{s['room_count']:g}室",
+            note_font, None, center, None) for s in scenarios],
+        [("期間全体", header_font, None, center, None), None]
+        + [(float(total), header_font, None, center, "0.0%") for total in totals],
+    ]
+    for i, date_str in enumerate(dates):
+        weekday = weekday_map.get(date_str, "")
+        rows.append([(date_str, body_font, None, center, None),
+                     (weekday.replace("曜日", "") if isinstance(weekday, str) else "", body_font, None, center, None)]
+                    + [(float(rate), body_font, None, center, "0.0%") for rate in rates[:, i]])
+
+    streaming = is_streaming(ws)
+    for row_num, row_cells in enumerate(rows, 1):
+        streamed = []
+        for col, spec in enumerate(row_cells, 2):
+            if spec is None:
+                streamed.append(None)
+                continue
+            value, font, fill, alignment, number_format = spec
+            if streaming:
+                cell = WriteOnlyCell(ws, value=value)
+                streamed.append(cell)
+            else:
+                cell = ws.cell(row=row_num, column=col, value=value)
+            cell.font = font
+            if fill:
+                cell.fill = fill
+            if alignment:
+                cell.alignment = alignment
+            if number_format:
+                cell.number_format = number_format
+        if streaming:
+            ws.append([None] + streamed if streamed else [])
+    profile_count("cells_written.scenarios", sum(len(row_cells) for row_cells in rows))
+
+
+def read_data_sheet(src_ws):
+    """元データのガントチャートデータシートを、書式付きのコピー用データとして読み取る
+
+    書式（フォント・塗りつぶし・罫線・配置・表示形式）は元ブックの書式の組み合わせごとに
+    一度だけ変換し、同じ組み合わせのセルでは同じオブジェクトを共有する。返り値:
+        {'title': シート名,
+         'columns': [(列記号, 列幅, 非表示), ...],
+         'rows': [[(値, 書式), ...], ...]  # 1行目から順に。書式は (style_key, 表示形式) または None
+         'row_dims': {行番号: (行高, 非表示)},
+         'merges': [結合範囲, ...]}
+    """
+    columns = [(col_letter, dim.width, dim.hidden) for col_letter, dim in src_ws.column_dimensions.items()]
+    # 行高も非表示も指定のない行は出力に影響しないため省く
+    row_dims = {row_num: (dim.height, dim.hidden) for row_num, dim in src_ws.row_dimensions.items()
+                if dim.height is not None or dim.hidden}
+
+    src_styles = StyleRegistry(src_ws.parent)
+    style_map = {}  # {元ブックの StyleArray の値: (style_key, 表示形式)}
+    rows = []
+    for row in src_ws.iter_rows(min_row=1, max_row=src_ws.max_row, max_col=src_ws.max_column):
+        row_cells = []
+        for cell in row:
+            style = None
+            if cell.has_style:
+                src_style = tuple(cell._style)
+                style = style_map.get(src_style)
+                if style is None:
+                    style = style_map[src_style] = (src_styles.key_of(cell._style), cell.number_format)
+            row_cells.append((cell.value, style))
+        rows.append(row_cells)
+
+    return {
+        'title': src_ws.title,
+        'columns': columns,
+        'rows': rows,
+        'row_dims': row_dims,
+        'merges': [str(merged_range) for merged_range in src_ws.merged_cells.ranges],
+    }
 
-        for row_num, dim in src_ws.row_dimensions.items():
-            data_ws.row_dimensions[row_num].height = dim.height
-            data_ws.row_dimensions[row_num].hidden = dim.hidden
 
-        for row in src_ws.iter_rows(min_row=1, max_row=src_ws.max_row, max_col=src_ws.max_column):
-            for cell in row:
-                dst_cell = data_ws.cell(row=cell.row, column=cell.column, value=cell.value)
-                if cell.has_style:
-                    dst_cell.font = copy(cell.font)
-                    dst_cell.fill = copy(cell.fill)
-                    dst_cell.border = copy(cell.border)
-                    dst_cell.alignment = copy(cell.alignment)
-                    dst_cell.number_format = cell.number_format
+def read_sheet_dimensions(ro_ws, all_rows=False):
+    """読み取り専用ワークシートの列幅・行高とセル結合を返す
+
+    読み取り専用モードでは column_dimensions / row_dimensions / merged_cells がないため、
+    シートのXMLを読む。all_rows が False なら先頭（<cols> と最初の <row>）だけを読み、見出し行の行高だけを返す。
+    True ならシート全体を読み、全行の行高と結合範囲も返す（セルの値は読まない）。返り値:
+        ([(列記号, 列幅, 非表示), ...], {行番号: (行高, 非表示)}, [結合範囲, ...])
+    """
+    columns = []
+    row_dims = {}
+    merges = []
+    sheet_data = None
+    with ro_ws._get_source() as src:
+        for event, elem in ElementTree.iterparse(src, events=("start", "end")):
+            tag = elem.tag.rsplit("}", 1)[-1]
+            if event == "end":
+                if tag == "row" and sheet_data is not None:
+                    sheet_data.clear()  # 読み終えた行は捨てる（シートが大きくてもメモリを使わない）
+                continue
+            if tag == "col":
+                width = elem.get("width")
+                columns.append((get_column_letter(int(elem.get("min"))),
+                                float(width) if width is not None else None,
+                                elem.get("hidden") in ("1", "true")))
+            elif tag == "sheetData":
+                sheet_data = elem
+            elif tag == "row":
+                height = elem.get("ht")
+                hidden = elem.get("hidden") in ("1", "true")
+                if height is not None or hidden:
+                    row_dims[int(elem.get("r"))] = (float(height) if height is not None else None, hidden)
+                if not all_rows:
+                    row_dims = {row_num: dims for row_num, dims in row_dims.items() if row_num == 1}
+                    break
+            elif tag == "mergeCell":
+                merges.append(elem.get("ref"))
+    return columns, row_dims, merges
+
+
+def read_table_and_data_sheet(ro_ws, filters=None, columns=GANTT_COLUMNS):
+    """読み取り専用ワークシートを1回だけ走査し、(SurgeryTable, read_data_sheet 形式のコピー用データ) を返す
+
+    filters（row_filter の条件）に合わない行は1行読むごとに捨てる。コピー用データは
+    見出し行と残った行だけを詰めて持つ（行高は見出し行のみ、セル結合は slice_data_sheet と
+    同じく引き継がない）。filters がなければ空行も含めて全行を持ち、全行の行高とセル結合も
+    読むため、元ブック全体を読み込んだ read_data_sheet と同じ内容になる。
+    """
+    src_styles = StyleRegistry(ro_ws.parent)
+    style_map = {}  # {元ブックの書式ID: (style_key, 表示形式)}
+
+    def cell_style(cell):
+        if not getattr(cell, "has_style", False):  # 値も書式もないセルは EmptyCell
+            return None
+        style = style_map.get(cell._style_id)
+        if style is None:
+            style = style_map[cell._style_id] = (src_styles.key_of(cell.style_array), cell.number_format)
+        return style
+
+    header = None
+    accept = None
+    data = []
+    rows = []
+    for cells in ro_ws.iter_rows():
+        values = tuple(cell.value for cell in cells)
+        if header is None:
+            header = values
+            accept = row_filter(header, filters)
+        elif not any(v is not None for v in values):
+            if filters is not None:
+                continue
+        elif accept is not None and not accept(values):
+            continue
+        else:
+            data.append(values)
+        rows.append([(cell.value, cell_style(cell)) for cell in cells])
+
+    column_dims, row_dims, merges = read_sheet_dimensions(ro_ws, all_rows=filters is None)
+    data_sheet = {
+        'title': ro_ws.title,
+        'columns': column_dims,
+        'rows': rows,
+        'row_dims': row_dims,
+        'merges': merges if filters is None else [],
+    }
+    return table_from_rows(header or (), data, columns), data_sheet
+
+
+def slice_data_sheet(data_sheet, dates):
+    """read_data_sheet の結果から、見出し行と手術実施日が dates に含まれる行だけを取り出す
+
+    行番号が詰まるため、セル結合は引き継がない。
+    """
+    header = [value for value, _ in data_sheet['rows'][0]] if data_sheet['rows'] else []
+    if "手術実施日" not in header:
+        return data_sheet
+    date_col = header.index("手術実施日")
+    dates = set(dates)
+
+    rows = []
+    row_dims = {}
+    for src_row_num, row_cells in enumerate(data_sheet['rows'], 1):
+        if src_row_num == 1 or (len(row_cells) > date_col and row_cells[date_col][0] in dates):
+            rows.append(row_cells)
+            if src_row_num in data_sheet['row_dims']:
+                row_dims[len(rows)] = data_sheet['row_dims'][src_row_num]
+
+    return dict(data_sheet, rows=rows, row_dims=row_dims, merges=[])
+
+
+def data_cell_style(style, styles):
+    """read_data_sheet の書式（style_key, 表示形式）を、styles のブックの StyleArray にする"""
+    key, number_format = style
+    dst_style = copy(styles.style_array(key))
+    dst_style.numFmtId = styles.number_format_id(number_format)
+    return dst_style
+
+
+def write_data_sheet(data_ws, data_sheet, styles):
+    """read_data_sheet の結果を書き込む
+
+    data_ws が書き込み専用ワークシートの場合は行単位で追記する。
+    styles: data_ws のワークブックの StyleRegistry
+    """
+    for col_letter, width, hidden in data_sheet['columns']:
+        data_ws.column_dimensions[col_letter].width = width
+        data_ws.column_dimensions[col_letter].hidden = hidden
+
+    for row_num, (height, hidden) in data_sheet['row_dims'].items():
+        data_ws.row_dimensions[row_num].height = height
+        data_ws.row_dimensions[row_num].hidden = hidden
+
+    dst_styles = {}  # {id(書式): コピー先の StyleArray}
+    streaming = is_streaming(data_ws)
+    for row_num, row_cells in enumerate(data_sheet['rows'], 1):
+        streamed = []
+        for col, (value, style) in enumerate(row_cells, 1):
+            if streaming:
+                dst_cell = WriteOnlyCell(data_ws, value=value)
+                streamed.append(dst_cell)
+            else:
+                dst_cell = data_ws.cell(row=row_num, column=col, value=value)
+            if style is not None:
+                dst_style = dst_styles.get(id(style))
+                if dst_style is None:
+                    dst_style = dst_styles[id(style)] = data_cell_style(style, styles)
+                dst_cell._style = copy(dst_style)
+        if streaming:
+            data_ws.append(streamed)
+        profile_count("cells_written.data", len(row_cells))
+
+    for merged_range in data_sheet['merges']:
+        if streaming:
+            data_ws.merged_cells.add(merged_range)
+        else:
+            data_ws.merge_cells(merged_range)
+    profile_count("merges.data", len(data_sheet['merges']))
+
+
+def link_data_sheet(data_ws, src_path, sheet_title, n_rows):
+    """データシートをコピーせず、元データファイルへのリンクだけを置く"""
+    rows = [
+        ("元データ（このブックには含めていません）", Font(name=FONT_NAME, size=11, bold=True), None),
+        (os.path.basename(src_path), Font(name=FONT_NAME, size=11, color="0563C1", underline="single"),
+         os.path.basename(src_path)),
+        (f"シート: {sheet_title}（{n_rows}件）", Font(name=FONT_NAME, size=11), None),
+    ]
+    data_ws.column_dimensions['A'].width = 60
+    for row_num, (value, font, link) in enumerate(rows, 1):
+        if is_streaming(data_ws):
+            cell = WriteOnlyCell(data_ws, value=value)
+        else:
+            cell = data_ws.cell(row=row_num, column=1, value=value)
+        cell.font = font
+        if link:
+            # 出力ファイルと同じフォルダにある元データを相対パスで開く
+            cell.hyperlink = link
+        if is_streaming(data_ws):
+            data_ws.append([cell])
 
-        for merged_range in src_ws.merged_cells.ranges:
-            data_ws.merge_cells(str(merged_range))
 
-    src_wb.close()
+def read_template_settings(src_wb):
+    """テンプレートシートからバーの色・ラベルフォント・書式情報を読み取る
 
-    # === シート2: 手術室ガントチャート（日付順） ===
-    ws_date = wb.create_sheet("手術室ガントチャート")
-    setup_gantt_sheet(ws_date, "手術室 ガントチャート（2025年9月）")
-    count_date = write_gantt_for_dates(ws_date, df, dates, weekday_map)
+    テンプレートで指定されていない設定（テンプレートシートがない場合は全設定）は既定値になる。
+    """
+    global COLOR_SCHEDULED, COLOR_URGENT, COLOR_EMERGENCY, LABEL_FONT_NAME, LABEL_FONT_SIZE
+    reset_template_settings()  # 監視モードで読み直すとき、テンプレートから消した設定が残らないように
+    if "テンプレート" not in src_wb.sheetnames:
+        return
+    tpl_ws = src_wb["テンプレート"]
+
+    # 色の読み取り（C2=定時、C3=臨時、C4=緊急）
+    c2_fill = tpl_ws.cell(row=2, column=3).fill
+    if c2_fill.fill_type == "solid" and c2_fill.fgColor and c2_fill.fgColor.rgb:
+        rgb = str(c2_fill.fgColor.rgb)
+        if len(rgb) == 8:
+            rgb = rgb[2:]
+        COLOR_SCHEDULED = rgb
+        print(f"テンプレートC2から定時の色を取得: #{COLOR_SCHEDULED}")
+    c3_fill = tpl_ws.cell(row=3, column=3).fill
+    if c3_fill.fill_type == "solid" and c3_fill.fgColor and c3_fill.fgColor.rgb:
+        rgb = str(c3_fill.fgColor.rgb)
+        if len(rgb) == 8:
+            rgb = rgb[2:]
+        COLOR_URGENT = rgb
+        print(f"テンプレートC3から臨時の色を取得: #{COLOR_URGENT}")
+    c4_fill = tpl_ws.cell(row=4, column=3).fill
+    if c4_fill.fill_type == "solid" and c4_fill.fgColor and c4_fill.fgColor.rgb:
+        rgb = str(c4_fill.fgColor.rgb)
+        if len(rgb) == 8:
+            rgb = rgb[2:]
+        COLOR_EMERGENCY = rgb
+        print(f"テンプレートC4から緊急の色を取得: #{COLOR_EMERGENCY}")
+
+    # ラベルフォントの読み取り
+    c5_font = tpl_ws.cell(row=5, column=3).font
+    if c5_font.name:
+        LABEL_FONT_NAME = c5_font.name
+    if c5_font.size:
+        LABEL_FONT_SIZE = c5_font.size
+    print(f"テンプレートC5からラベルフォントを取得: {LABEL_FONT_NAME}, {LABEL_FONT_SIZE}pt")
+
+    # 書式情報の読み取り（列幅・行高・罫線・フォント）
+    load_template(tpl_ws)
+
+
+# テンプレートから読み取る設定（template_state / set_template_state の対象）
+TEMPLATE_STATE_NAMES = (
+    "COLOR_SCHEDULED", "COLOR_URGENT", "COLOR_EMERGENCY", "LABEL_FONT_NAME", "LABEL_FONT_SIZE",
+    "TPL_COL_WIDTHS", "TPL_ROW_HEIGHTS", "TPL_BORDERS", "TPL_HEADER_CELLS",
+    "TPL_DATE_FONT", "TPL_DATE_ALIGNMENT", "TPL_ROOM_FONT", "TPL_HAS_TEMPLATE",
+)
+
+
+def reset_template_settings():
+    """テンプレートから読み取る設定を既定値に戻す（読み直す前に、前回の値が残らないようにする）"""
+    set_template_state({name: copy(value) for name, value in DEFAULT_TEMPLATE_STATE.items()})
+
+
+def template_state():
+    """テンプレートから読み取った設定をまとめて返す（pickle可能。ワーカープロセスへの受け渡し用）"""
+    return {name: globals()[name] for name in TEMPLATE_STATE_NAMES}
+
+
+def set_template_state(state):
+    """template_state() の結果をこのプロセスの設定として反映する"""
+    globals().update({name: state[name] for name in TEMPLATE_STATE_NAMES})
+
+
+# テンプレートを読み取る前の設定（reset_template_settings で戻す値。辞書は読み取りで書き足されるため複製して使う）
+DEFAULT_TEMPLATE_STATE = {name: copy(value) for name, value in template_state().items()}
+
+
+# テンプレートキャッシュの形式が変わったら上げる
+TEMPLATE_CACHE_VERSION = 1
+
+# xlsx 内のXMLの名前空間
+XLSX_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+XLSX_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+def sheet_part_name(zf, sheet_title):
+    """xlsx（zip）内で sheet_title のシートのXMLのパス（シートがなければ None）"""
+    workbook_xml = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+    rel_id = next((sheet.get(f"{XLSX_REL_NS}id") for sheet in workbook_xml.iter(f"{XLSX_MAIN_NS}sheet")
+                   if sheet.get("name") == sheet_title), None)
+    if rel_id is None:
+        return None
+    rels_xml = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    target = next(rel.get("Target") for rel in rels_xml.iter(f"{XLSX_PKG_REL_NS}Relationship")
+                  if rel.get("Id") == rel_id)
+    return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+
+def template_fingerprint(path, sheet_title="テンプレート"):
+    """ブックを開かずに、テンプレートシートの内容のハッシュを求める（シートがなければ None）
+
+    xlsx（zip）内のテンプレートシートのXMLと、罫線・フォント等の実体を持つ
+    styles.xml・theme のバイト列をハッシュする。
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            sheet_part = sheet_part_name(zf, sheet_title)
+            if sheet_part is None:
+                return None
+
+            digest = hashlib.sha256()
+            for part in (sheet_part, "xl/styles.xml", "xl/theme/theme1.xml"):
+                if part in zf.namelist():
+                    digest.update(part.encode())
+                    digest.update(zf.read(part))
+            return digest.hexdigest()
+    except Exception:
+        return None
+
+
+def template_cache_path(input_path):
+    """入力ファイルに対応するテンプレートキャッシュ（サイドカーファイル）のパス"""
+    return os.path.splitext(input_path)[0] + ".template.cache"
+
+
+def load_template_cache(path, fingerprint):
+    """テンプレートキャッシュを読み込み、template_state() の形で返す（使えなければ None）"""
+    if fingerprint is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            saved = load_signed_pickle(f.read())
+    except Exception:
+        return None
+    if (not isinstance(saved, dict) or saved.get('version') != TEMPLATE_CACHE_VERSION
+            or saved.get('fingerprint') != fingerprint):
+        return None
+    state = saved.get('state')
+    if not isinstance(state, dict) or not all(name in state for name in TEMPLATE_STATE_NAMES):
+        return None
+    return state
+
+
+def save_template_cache(path, fingerprint):
+    """現在のテンプレート設定をキャッシュに保存する
+
+    同じ内容の罫線・フォント・配置は1つのオブジェクトにまとめてから保存する
+    （B6:CO17 の罫線はほとんどが同じ組み合わせのため、ファイルが小さくなる）。
+    """
+    if fingerprint is None:
+        return
+    shared = {}
+    state = template_state()
+    state['TPL_BORDERS'] = {key: shared.setdefault(border, border)
+                            for key, border in state['TPL_BORDERS'].items()}
+    state['TPL_HEADER_CELLS'] = {
+        col: dict(info, font=shared.setdefault(info['font'], info['font']),
+                  alignment=shared.setdefault(info['alignment'], info['alignment']))
+        for col, info in state['TPL_HEADER_CELLS'].items()}
+    try:
+        with open(path, "wb") as f:
+            f.write(signed_pickle({'version': TEMPLATE_CACHE_VERSION, 'fingerprint': fingerprint,
+                                   'state': state}))
+    except OSError:
+        pass  # 書き込めないフォルダでも出力は続ける
+
+
+def prepare_table(table):
+    """時刻列の正規化と日付順のソートを行う
+
+    手術実施日・実施手術室名・入室時刻の順に並べ替える（空欄・読み取れない値は後ろ、
+    同じ値の行は元の順序のまま）。
+    """
+    normalize_time_columns(table)
 
-    # === シート3: 手術室ガントチャート・曜日順 ===
+    # 日付でソート
+    sort_dates = np.empty(len(table), dtype=object)
+    sort_dates[:] = [parse_date(v) for v in table["手術実施日"]]
+    table["手術実施日_sort"] = sort_dates
+
+    missing_day = np.iinfo(np.int64).max
+    day_key = np.fromiter((d.toordinal() if d is not None else missing_day for d in sort_dates),
+                          dtype=np.int64, count=len(table))
+    room_names = sorted({r for r in table["実施手術室名"] if r is not None})
+    room_rank = {room: i for i, room in enumerate(room_names)}
+    room_key = np.fromiter((room_rank.get(r, len(room_names)) for r in table["実施手術室名"]),
+                           dtype=np.int64, count=len(table))
+    start_min = table[START_MIN_COL].astype(np.int32)
+    start_key = np.where(start_min == INVALID_MINUTE, np.iinfo(np.int32).max, start_min)
+    return table.take(np.lexsort((start_key, room_key, day_key)))
+
+
+def order_dates_by_weekday(dates, weekday_map):
+    """曜日順シート用に、日付を（曜日, 第何週）の順に並べ替える"""
     WEEKDAY_ORDER = {"月": 0, "火": 1, "水": 2, "木": 3, "金": 4, "土": 5, "日": 6}
 
     date_info = []
     for date_str in dates:
         weekday = weekday_map.get(date_str, "")
         weekday_short = weekday.replace("曜日", "") if isinstance(weekday, str) else ""
-        try:
-            dt = pd.to_datetime(date_str)
-            nth = (dt.day - 1) // 7 + 1
-        except Exception:
-            nth = 1
+        dt = parse_date(date_str)
+        nth = (dt.day - 1) // 7 + 1 if dt is not None else 1
         wday_order = WEEKDAY_ORDER.get(weekday_short, 9)
         date_info.append((wday_order, nth, date_str))
 
     date_info.sort(key=lambda x: (x[0], x[1]))
-    dates_by_weekday = [d[2] for d in date_info]
+    return [d[2] for d in date_info]
+
+
+def period_label(first, last, by_day=False):
+    """タイトル用の期間表記（例: 2025年9月、2025年9月～11月、2025年9月1日～9月7日）"""
+    if by_day:
+        end = f"{last.month}月{last.day}日" if first.year == last.year else f"{last.year}年{last.month}月{last.day}日"
+        return f"{first.year}年{first.month}月{first.day}日～{end}"
+    if (first.year, first.month) == (last.year, last.month):
+        return f"{first.year}年{first.month}月"
+    if first.year == last.year:
+        return f"{first.year}年{first.month}月～{last.month}月"
+    return f"{first.year}年{first.month}月～{last.year}年{last.month}月"
+
+
+# --parallel でワーカーへの1回の依頼にまとめる日数・データシートの行数
+PARALLEL_CHUNK_DAYS = 60
+PARALLEL_CHUNK_ROWS = 5000
+
+
+def render_rows_job(job):
+    """シートの一部の行のXMLを作る（--parallel のワーカー処理）
+
+    job: (種類, 最初の行番号, 内容, 書式の一覧)
+      種類 "gantt": 内容は (blocks, 日付のリスト)。write_gantt_for_dates と同じ並びで書く
+      種類 "data": 内容は read_data_sheet の形式の一部の行（row_dims はシート全体の行番号）
+      書式の一覧: 親プロセスのブックの DirectWorkbook.style_state()
+    使う書式は親プロセスで登録済みであること（セル書式の番号を親のブックと一致させるため）。
+    文字列はセルに直接書く。返り値: (行のXML, 結合範囲, 最後の行番号, カウンタ)
+    カウンタ（書き込んだセル数・結合数など）は親プロセスで計測結果に足す（collect_rows）。
+    """
+    kind, first_row, content, state = job
+    wb = DirectWorkbook(inline_strings=True)
+    wb.set_style_state(state)
+    n_styles = len(wb._cell_styles)
+    styles = StyleRegistry(wb)
+    ws = DirectWorksheet(wb, "", first_row=first_row)
+    counters = ProfileCounters()
+    previous = set_profile(counters)
+    try:
+        if kind == "gantt":
+            blocks, date_list = content
+            write_gantt_for_dates(ws, blocks, date_list, styles, start_row=first_row)
+        else:
+            write_data_sheet(ws, content, styles)
+    finally:
+        set_profile(previous)
+    if len(wb._cell_styles) != n_styles:
+        raise RuntimeError("親プロセスで登録していない書式があります")
+    return ws.rows_xml(), ws.merged_cells.ranges, ws.max_row, counters.counters
+
+
+def register_block_styles(blocks, styles):
+    """ブロックで使う書式をすべてセル書式としてブックに登録する（ワーカーに書式の一覧を渡す前に行う）"""
+    keys = {}
+    skeletons = set()
+    for block in blocks.values():
+        rows = block['cells']
+        if id(block['skeleton']) not in skeletons:
+            skeletons.add(id(block['skeleton']))
+            rows = rows + block['skeleton']['rows']
+        for row_cells in rows:
+            for _, key in row_cells.values():
+                if key is not None:
+                    keys[id(key)] = key
+    for key in keys.values():
+        styles.xf_id(key)
+
+
+def register_data_styles(data_sheet, styles):
+    """データシートで使う書式をすべてセル書式としてブックに登録する（write_data_sheet と同じ変換）
+
+    書式のない日時のセルには openpyxl が値の型に応じた表示形式を付けるため、型ごとに登録する。
+    """
+    distinct = {}
+    unstyled = {}   # {値の型: 値}
+    for row_cells in data_sheet['rows']:
+        for value, style in row_cells:
+            if style is not None:
+                distinct[id(style)] = style
+            elif value is not None and type(value) not in (str, int, float):
+                unstyled[type(value)] = value
+    for style in distinct.values():
+        styles.wb._cell_styles.add(data_cell_style(style, styles))
+    for value in unstyled.values():
+        cell = WriteOnlyCell(None, value=value)
+        if cell.has_style:
+            styles.wb._cell_styles.add(cell._style)
+
+
+def submit_gantt_rows(pool, blocks, date_list, styles, start_row=6):
+    """write_gantt_for_dates と同じ配置の行を、PARALLEL_CHUNK_DAYS 日ずつワーカーに依頼する"""
+    state = styles.wb.style_state()
+    futures = []
+    row = start_row
+    for i in range(0, len(date_list), PARALLEL_CHUNK_DAYS):
+        chunk = date_list[i:i + PARALLEL_CHUNK_DAYS]
+        content = ({date_str: blocks[date_str] for date_str in chunk}, chunk)
+        futures.append(pool.submit(render_rows_job, ("gantt", row, content, state)))
+        row += sum(len(blocks[date_str]['skeleton']['rows']) + 1 for date_str in chunk)  # ブロックと空行
+    return futures
+
+
+def submit_data_rows(pool, data_sheet, styles):
+    """データシートの行を PARALLEL_CHUNK_ROWS 行ずつワーカーに依頼する（列幅・結合は親で書く）"""
+    state = styles.wb.style_state()
+    rows, row_dims = data_sheet['rows'], data_sheet['row_dims']
+    futures = []
+    for start in range(0, len(rows), PARALLEL_CHUNK_ROWS):
+        end = start + PARALLEL_CHUNK_ROWS
+        content = dict(data_sheet, rows=rows[start:end], columns=[], merges=[],
+                       row_dims={row_num: dims for row_num, dims in row_dims.items() if start < row_num <= end})
+        futures.append(pool.submit(render_rows_job, ("data", start + 1, content, state)))
+    return futures
+
+
+def collect_rows(ws, futures):
+    """ワーカーが作った行のXMLを、依頼した順に ws に追記し、ワーカーのカウンタを計測結果に足す"""
+    for future in futures:
+        rows_xml, merges, last_row, counters = future.result()
+        ws.append_rows_xml(rows_xml, last_row, merges)
+        for name, n in counters.items():
+            profile_count(name, n)
+
+
+def generate_workbook(table, output_path, period, data_sheet=None, data_link=None, streaming=False,
+                      incremental=False, scenarios=None, block_cache=None, writer="openpyxl", sheet_workers=None):
+    """ガントチャートのブックを作成して保存し、出力した日数を返す
+
+    table: prepare_table 済みのデータ
+    period: タイトルに表示する期間（period_label の結果）
+    data_sheet: read_data_sheet の結果（ガントチャートデータシートにコピーする）
+    data_link: (元データのパス, シート名, 件数)。指定時はコピーの代わりにリンクを置く
+    incremental: 出力ファイル横のブロックキャッシュを使い、内容が変わった日付だけ再計算する
+    scenarios: load_scenarios の結果。指定時は稼働率の試算シートを追加する
+    block_cache: compute_day_blocks の cache。指定時はファイルの代わりにこの辞書を使い回す（監視モード用）
+    writer: "direct" の場合は openpyxl のワークシートを使わず、シートのXMLを直接書き出す（行単位の追記）
+    sheet_workers: 2以上の場合は writer="direct" で、データシートと日付順・曜日順のシートの行のXMLを
+        その数のワーカープロセスで並行して作る（ブロックの計算・ヒートマップ・試算は親プロセスで同時に行う）
+    """
+    dates = unique_dates(table)
+    day_index = build_day_index(table)
+    weekday_map = dict(zip(table["手術実施日"], table["曜日"]))
+
+    pool = None
+    if sheet_workers and sheet_workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=sheet_workers)
+        writer = "direct"
+    try:
+        return write_workbook(table, output_path, period, dates, day_index, weekday_map, data_sheet,
+                              data_link, streaming, incremental, scenarios, block_cache, writer, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def write_workbook(table, output_path, period, dates, day_index, weekday_map, data_sheet, data_link,
+                   streaming, incremental, scenarios, block_cache, writer, pool):
+    """generate_workbook の本体（pool: --parallel のワーカー。None なら全シートをこのプロセスで作る）"""
+    if writer == "direct":
+        wb, streaming = DirectWorkbook(), True
+    else:
+        wb = Workbook(write_only=streaming)
+    styles = StyleRegistry(wb)
+    futures = {}   # {ワークシート: 行の作成を依頼した Future のリスト}
 
+    # === シート1: ガントチャートデータ（元データコピー） ===
+    if streaming:
+        data_ws = wb.create_sheet("ガントチャートデータ")
+    else:
+        data_ws = wb.active
+        data_ws.title = "ガントチャートデータ"
+
+    with profile_phase("data_sheet"):
+        if data_link is not None:
+            link_data_sheet(data_ws, *data_link)
+        elif data_sheet is not None and pool is not None:
+            register_data_styles(data_sheet, styles)
+            write_data_sheet(data_ws, dict(data_sheet, rows=[], row_dims={}), styles)
+            futures[data_ws] = submit_data_rows(pool, data_sheet, styles)
+        elif data_sheet is not None:
+            write_data_sheet(data_ws, data_sheet, styles)
+
+    # 各日付のブロックを一度だけ計算し、日付順・曜日順の両シートで再利用する
+    cache = block_cache
+    if incremental and cache is None:
+        fingerprint = settings_fingerprint()
+        cache = load_block_cache(block_cache_path(output_path), fingerprint)
+    if cache is not None:
+        previous = dict(cache)
+    with profile_phase("blocks"):
+        blocks = compute_day_blocks(table, dates, weekday_map, day_index, styles, cache=cache)
+    if cache is not None:
+        reused = sum(1 for date_str in dates
+                     if date_str in previous and previous[date_str][1] is blocks[date_str])
+        print(f"ブロックキャッシュ: {reused}日分を再利用、{len(dates) - reused}日分を再計算")
+    overlap_count = sum(len(block['overlaps']) for block in blocks.values())
+    if overlap_count:
+        print(f"同じ部屋で時間帯が重なる手術があります: {overlap_count}箇所（後の手術のバーが上に表示されます）")
+    if pool is not None:
+        register_block_styles(blocks, styles)
+
+    # === シート2: 手術室ガントチャート（日付順） ===
+    ws_date = wb.create_sheet("手術室ガントチャート")
+    with profile_phase("sheet_date"):
+        setup_gantt_sheet(ws_date, f"手術室 ガントチャート（{period}）")
+        if pool is not None:
+            futures[ws_date] = submit_gantt_rows(pool, blocks, dates, styles)
+            count_date = len(dates)
+        else:
+            count_date = write_gantt_for_dates(ws_date, blocks, dates, styles)
+
+    # === シート3: 手術室ガントチャート・曜日順 ===
     ws_weekday = wb.create_sheet("手術室ガントチャート・曜日順")
-    setup_gantt_sheet(ws_weekday, "手術室 ガントチャート・曜日順（2025年9月）")
-    write_gantt_for_dates(ws_weekday, df, dates_by_weekday, weekday_map)
+    with profile_phase("sheet_weekday"):
+        setup_gantt_sheet(ws_weekday, f"手術室 ガントチャート・曜日順（{period}）")
+        if pool is not None:
+            futures[ws_weekday] = submit_gantt_rows(pool, blocks, order_dates_by_weekday(dates, weekday_map), styles)
+        else:
+            write_gantt_for_dates(ws_weekday, blocks, order_dates_by_weekday(dates, weekday_map), styles)
+
+    # === シート4: 曜日別ヒートマップ（曜日×部屋×10分枠の占有率・緊急の割合） ===
+    ws_heatmap = wb.create_sheet("曜日別ヒートマップ")
+    with profile_phase("sheet_heatmap"):
+        write_heatmap_sheet(ws_heatmap, build_weekday_heatmap(table),
+                            f"手術室 曜日別ヒートマップ（{period}）", styles)
+
+    # === シート5: 稼働率の試算（条件ごと・日付ごとの稼働率） ===
+    if scenarios:
+        ws_scenarios = wb.create_sheet("稼働率試算")
+        with profile_phase("sheet_scenarios"):
+            used, available = evaluate_scenarios(table, dates, weekday_map, scenarios)
+            write_scenario_sheet(ws_scenarios, dates, weekday_map, scenarios, used, available,
+                                 f"稼働率の試算（{period}）")
+
+    # ワーカーが作った行を各シートに追記する
+    if futures:
+        with profile_phase("sheet_workers"):
+            for ws, sheet_futures in futures.items():
+                collect_rows(ws, sheet_futures)
 
     # 保存
-    wb.save(OUTPUT_FILE)
+    with profile_phase("save"):
+        wb.save(output_path)
+    if PROFILE is not None:
+        # 保存時に登録された書式の数（セル書式の組み合わせと、フォント・塗りつぶし等の実体）
+        for name in ("_cell_styles", "_fonts", "_fills", "_borders", "_alignments", "_number_formats"):
+            profile_count(f"styles.{name.lstrip('_')}", len(getattr(wb, name)))
+        profile_count("styles.registry_arrays", len(styles._arrays))
+    if incremental and block_cache is None:
+        save_block_cache(block_cache_path(output_path), fingerprint, cache, dates)
+    elif block_cache is not None:
+        # 今回のデータにない日付は捨てる（save_block_cache と同じ）
+        for date_str in set(block_cache) - set(dates):
+            del block_cache[date_str]
+    return count_date
+
+
+# 追記（--append）の配置情報（出力ファイル横の .layout）の形式のバージョン
+APPEND_LAYOUT_VERSION = 1
+
+# シートのXMLのうち、追記で書き換える部分（行・セル番地・結合範囲・使用範囲）
+SHEET_DATA_RE = re.compile(rb"<sheetData\s*/>|<sheetData>(.*)</sheetData>", re.S)
+ROW_START_RE = re.compile(rb'<row\b[^>]*?\br="(\d+)"')
+ROW_REF_RE = re.compile(rb'(<(?:row|c)\b[^>]*?\br="[A-Z]*)(\d+)"')
+MERGE_CELLS_RE = re.compile(rb"<mergeCells\b[^>]*?(?:/>|>(.*?)</mergeCells>)", re.S)
+MERGE_REF_RE = re.compile(rb'<mergeCell ref="([A-Z]+)(\d+):([A-Z]+)(\d+)"\s*/>')
+DIMENSION_RE = re.compile(rb'(<dimension ref="[A-Z]+\d+:[A-Z]+)(\d+)"')
+
+
+def append_layout_path(output_path):
+    """出力ブックの配置情報（--append で使う。サイドカーファイル）のパス"""
+    return os.path.splitext(output_path)[0] + ".layout"
+
+
+def append_options(data_sheet, data_link, scenarios):
+    """配置情報に記録する出力の種類（データシートの形式と試算条件）"""
+    data_mode = "link" if data_link is not None else "copy" if data_sheet is not None else None
+    return data_mode, hashlib.sha256(value_pickle(scenarios)).hexdigest()
+
+
+def build_append_layout(table, data_sheet=None, data_link=None, scenarios=None):
+    """ブック全体を出力したときの配置情報（日付の並び・内容のハッシュ・集計の途中結果）を作る
+
+    ヒートマップは割合ではなく曜日ごとの日数と占有日数を、試算は日付ごとの used・available を
+    持っておき、追記では新しい日付の分だけを足す。
+    """
+    dates = unique_dates(table)
+    weekday_map = dict(zip(table["手術実施日"], table["曜日"]))
+    heatmap = build_weekday_heatmap(table)
+    layout = {
+        'version': APPEND_LAYOUT_VERSION,
+        'settings': settings_fingerprint(),
+        'options': append_options(data_sheet, data_link, scenarios),
+        'dates': dates,
+        'weekdays': {date_str: weekday_map.get(date_str) for date_str in dates},
+        'hashes': day_hashes(table, build_day_index(table)),
+        'heatmap_days': heatmap['days'],
+        'heatmap_counts': heatmap['counts'],
+        'data_rows': data_link[2] if data_link is not None else len(data_sheet['rows']) if data_sheet else 0,
+    }
+    if scenarios:
+        layout['used'], layout['available'] = evaluate_scenarios(table, dates, weekday_map, scenarios)
+    return layout
+
+
+def load_append_layout(output_path):
+    """配置情報を読み込む（ないか、形式・出力ファイルが前回の保存時と違う場合は None）"""
+    try:
+        with open(append_layout_path(output_path), "rb") as f:
+            layout = load_signed_pickle(f.read())
+    except Exception:
+        return None
+    if not isinstance(layout, dict) or layout.get('version') != APPEND_LAYOUT_VERSION or layout.get('signature') != file_signature(output_path):
+        return None
+    return layout
+
+
+def save_append_layout(output_path, layout):
+    """出力ブックの現在の状態（更新時刻・サイズ）とともに配置情報を保存する"""
+    layout['signature'] = file_signature(output_path)
+    try:
+        with open(append_layout_path(output_path), "wb") as f:
+            f.write(signed_pickle(layout))
+    except OSError as e:
+        print(f"配置情報を保存できませんでした: {e}")
+
+
+def shift_rows_xml(rows_xml, shift):
+    """<row> 要素の並びの行番号とセル番地を shift 行ずらす"""
+    return ROW_REF_RE.sub(lambda m: m.group(1) + str(int(m.group(2)) + shift).encode() + b'"', rows_xml)
+
+
+def last_row_number(rows_xml):
+    """<row> 要素の並びの最後の行番号（行がなければ 0）"""
+    match = ROW_START_RE.match(rows_xml, max(rows_xml.rfind(b"<row "), 0))
+    return int(match.group(1)) if match else 0
+
+
+def splice_sheet_blocks(sheet_xml, first_row, stride, old_keys, new_keys, new_blocks, header_rows=None):
+    """既存シートのXMLに新しいブロック（first_row 行目から stride 行ごとの行のまとまり）を挿し込む
+
+    old_keys: 既存シートのブロックの並び
+    new_keys: 挿し込んだ後の並び（old_keys の順序を保ったまま新しいキーを加えたもの）
+    new_blocks: {新しいキー: (行のXML, 結合範囲のリスト)}。挿し込んだ後の行番号で作ったもの
+    header_rows: first_row 行目より前の行を置き換える行のXML（None なら既存のまま）
+    既存のブロックは行番号をずらすだけで、セルの中身は読まない（後ろにずれないブロックはそのまま）。
+    """
+    match = SHEET_DATA_RE.search(sheet_xml)
+    if match is None:
+        raise ValueError("シートのXMLに sheetData がありません")
+    body = match.group(1) or b""
+    starts = [(m.start(), int(m.group(1))) for m in ROW_START_RE.finditer(body)]
+
+    new_pos = {key: i for i, key in enumerate(new_keys)}
+    shifts = [(new_pos[key] - i) * stride for i, key in enumerate(old_keys)]
+    header, block_rows = [], [[] for _ in old_keys]
+    for i, (start, row_num) in enumerate(starts):
+        chunk = body[start:starts[i + 1][0] if i + 1 < len(starts) else len(body)]
+        if row_num < first_row:
+            header.append(chunk)
+            continue
+        block = (row_num - first_row) // stride
+        if block >= len(old_keys):
+            raise ValueError(f"配置情報にない行があります（{row_num}行目）")
+        block_rows[block].append(chunk)
+
+    rows = [header_rows if header_rows is not None else b"".join(header)]
+    last_row = last_row_number(rows[0])
+    old_index = {key: i for i, key in enumerate(old_keys)}
+    for key in new_keys:
+        i = old_index.get(key)
+        if i is None:
+            rows_xml = new_blocks[key][0]
+            last_row = max(last_row, last_row_number(rows_xml))
+        elif shifts[i]:
+            rows_xml = shift_rows_xml(b"".join(block_rows[i]), shifts[i])
+            last_row = max(last_row, last_row_number(rows_xml))
+        else:
+            rows_xml = b"".join(block_rows[i])
+            if block_rows[i]:
+                last_row = max(last_row, last_row_number(block_rows[i][-1]))
+        rows.append(rows_xml)
+
+    # 結合範囲: 既存の範囲をブロックと同じだけずらし、新しいブロックの範囲を加える
+    tail = sheet_xml[match.end():]
+    merges = []
+    merge_match = MERGE_CELLS_RE.search(tail)
+    if merge_match is not None:
+        for m in MERGE_REF_RE.finditer(merge_match.group(1) or b""):
+            col1, row1, col2, row2 = m.group(1), int(m.group(2)), m.group(3), int(m.group(4))
+            shift = shifts[(row1 - first_row) // stride] if row1 >= first_row else 0
+            merges.append(b"%s%d:%s%d" % (col1, row1 + shift, col2, row2 + shift))
+    for key in new_keys:
+        if key not in old_index:
+            merges.extend(ref.encode() for ref in new_blocks[key][1])
+    merge_xml = b"".join([b'<mergeCells count="%d">' % len(merges)]
+                         + [b'<mergeCell ref="%s"/>' % ref for ref in merges]
+                         + [b"</mergeCells>"]) if merges else b""
+    if merge_match is not None:
+        tail = tail[:merge_match.start()] + merge_xml + tail[merge_match.end():]
+    else:
+        tail = merge_xml + tail
+
+    head = DIMENSION_RE.sub(lambda m: m.group(1) + str(max(last_row, 1)).encode() + b'"',
+                            sheet_xml[:match.start()], count=1)
+    return b"".join([head, b"<sheetData>"] + rows + [b"</sheetData>", tail])
+
+
+def render_rows(wb, first_row, write):
+    """write(ws) で書き込んだ行を、first_row 行目からの行のXMLと結合範囲にして返す"""
+    ws = DirectWorksheet(wb, "", first_row=first_row)
+    write(ws)
+    return ws.rows_xml(), ws.merged_cells.ranges
+
+
+def append_workbook(table, output_path, layout, data_sheet=None, data_link=None, scenarios=None):
+    """出力済みのブックに table の新しい日付を挿し込み、更新した配置情報を返す
+
+    table: 新しい日付の行だけを持つ表（prepare_table 済み）
+    layout: 出力済みのブックの配置情報（load_append_layout の結果）
+    日付順・曜日順のシートは出力済みのブロックの行をずらして新しいブロックを挟み、ヒートマップと
+    試算のシートは集計の途中結果に新しい日付の分を足して作り直す。データシートは末尾に行を足す。
+    styles.xml は出力済みのものを読み込んで書式を追加し、新しいセルの文字列はセルに直接書く
+    （共有文字列の番号を変えないため）。
+    """
+    new_dates = unique_dates(table)
+    weekday_map = dict(layout['weekdays'])
+    weekday_map.update(zip(table["手術実施日"], table["曜日"]))
+
+    def date_order(date_str):
+        dt = parse_date(date_str)
+        return (dt is None, dt.toordinal() if dt is not None else 0)
+
+    old_dates = layout['dates']
+    all_dates = sorted(old_dates + new_dates, key=date_order)
+    sort_dates = [dt for dt in map(parse_date, all_dates) if dt is not None]
+    period = period_label(min(sort_dates), max(sort_dates))
+    stride = len(build_block_skeleton(ROOM_ORDER)['rows']) + 1   # ブロックの行数と空行
+    first_row = 6
+
+    wb = DirectWorkbook(inline_strings=True)
+    replaced = {}     # {シートのXMLのパス: 新しいXML（bytes）}
+    rendered = {}     # {シートのXMLのパス: 作り直した DirectWorksheet}
+    with zipfile.ZipFile(output_path) as src:
+        apply_stylesheet(src, wb)
+        styles = StyleRegistry(wb)
+
+        with profile_phase("blocks"):
+            blocks = compute_day_blocks(table, new_dates, weekday_map, build_day_index(table), styles)
+
+        sheets = (("手術室ガントチャート", f"手術室 ガントチャート（{period}）", old_dates, all_dates),
+                  ("手術室ガントチャート・曜日順", f"手術室 ガントチャート・曜日順（{period}）",
+                   order_dates_by_weekday(old_dates, weekday_map), order_dates_by_weekday(all_dates, weekday_map)))
+        for sheet_title, title, old_keys, new_keys in sheets:
+            with profile_phase("sheet_date" if sheet_title == "手術室ガントチャート" else "sheet_weekday"):
+                part = sheet_part_name(src, sheet_title)
+                new_blocks = {}
+                for i, date_str in enumerate(new_keys):
+                    if date_str in blocks:
+                        start = first_row + i * stride
+                        new_blocks[date_str] = render_rows(
+                            wb, start, lambda ws: place_day_block(ws, blocks[date_str], start, styles))
+                header_rows, _ = render_rows(wb, 1, lambda ws: setup_gantt_sheet(ws, title))
+                replaced[part] = splice_sheet_blocks(src.read(part), first_row, stride, old_keys, new_keys,
+                                                     new_blocks, header_rows)
+
+        with profile_phase("sheet_heatmap"):
+            heatmap = build_weekday_heatmap(table)
+            days = layout['heatmap_days'] + heatmap['days']
+            counts = layout['heatmap_counts'] + heatmap['counts']
+            ws = DirectWorksheet(wb, "曜日別ヒートマップ")
+            write_heatmap_sheet(ws, weekday_heatmap(days, counts, heatmap['first_col']),
+                                f"手術室 曜日別ヒートマップ（{period}）", styles)
+            rendered[sheet_part_name(src, "曜日別ヒートマップ")] = ws
+
+        if scenarios:
+            with profile_phase("sheet_scenarios"):
+                used, available = evaluate_scenarios(table, new_dates, weekday_map, scenarios)
+                combined = {date_str: i for i, date_str in enumerate(old_dates + new_dates)}
+                order = [combined[date_str] for date_str in all_dates]
+                used = np.concatenate((layout['used'], used), axis=1)[:, order]
+                available = np.concatenate((layout['available'], available), axis=1)[:, order]
+                ws = DirectWorksheet(wb, "稼働率試算")
+                write_scenario_sheet(ws, all_dates, weekday_map, scenarios, used, available,
+                                     f"稼働率の試算（{period}）")
+                rendered[sheet_part_name(src, "稼働率試算")] = ws
+
+        data_rows = layout['data_rows']
+        with profile_phase("data_sheet"):
+            part = sheet_part_name(src, "ガントチャートデータ")
+            if data_link is not None:
+                data_rows += len(table)
+                ws = DirectWorksheet(wb, "ガントチャートデータ")
+                link_data_sheet(ws, data_link[0], data_link[1], data_rows)
+                rendered[part] = ws
+            elif data_sheet is not None:
+                # 見出し行を除いた新しい日付の行を、出力済みの行の後ろに足す
+                sliced = slice_data_sheet(data_sheet, new_dates)
+                added = dict(sliced, rows=sliced['rows'][1:], merges=[],
+                             row_dims={data_rows + row_num - 1: dims for row_num, dims in sliced['row_dims'].items()
+                                       if row_num > 1})
+                rows_xml, _ = render_rows(wb, data_rows + 1, lambda ws: write_data_sheet(ws, added, styles))
+                replaced[part] = splice_sheet_blocks(src.read(part), data_rows + 1, 1, [], ["rows"],
+                                                     {"rows": (rows_xml, [])})
+                data_rows += len(added['rows'])
+
+        # 書き換えたシートと styles.xml 以外は、出力済みのブックからそのまま写す
+        with profile_phase("save"):
+            for name, ws in rendered.items():
+                if ws.hyperlinks:
+                    rels = posixpath.join(posixpath.dirname(name), "_rels", posixpath.basename(name) + ".rels")
+                    replaced[rels] = ws.hyperlink_rels_xml().encode("utf-8")
+            out = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(output_path)),
+                                              suffix=".xlsx", delete=False)
+            out.close()
+            try:
+                with zipfile.ZipFile(out.name, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                    for info in src.infolist():
+                        name = info.filename
+                        if name in rendered:
+                            rendered[name].write(archive, name)
+                        elif name == "xl/styles.xml":
+                            archive.writestr(name, tostring(write_stylesheet(wb)))
+                        elif name not in replaced:
+                            with src.open(info) as f, archive.open(name, "w") as g:
+                                shutil.copyfileobj(f, g)
+                    for name, xml in replaced.items():
+                        archive.writestr(name, xml)
+            except BaseException:
+                os.remove(out.name)
+                raise
+    os.replace(out.name, output_path)
+
+    layout = dict(layout, dates=all_dates, weekdays={d: weekday_map.get(d) for d in all_dates},
+                  heatmap_days=days, heatmap_counts=counts, data_rows=data_rows)
+    if scenarios:
+        layout['used'], layout['available'] = used, available
+    return layout
+
+
+def written_dates(output_path):
+    """出力済みのブックの日付順シートに並んでいる日付の表示（日付セルの1行目。配置情報がない場合の確認用）
+
+    読み取れない場合は、入力だけで出力し直すと出力済みの日付が消えるおそれがあるため SystemExit。
+    """
+    try:
+        wb = load_workbook(output_path, read_only=True)
+        try:
+            values = [row[0] for row in wb["手術室ガントチャート"].iter_rows(
+                min_row=6, min_col=2, max_col=2, values_only=True)]
+        finally:
+            wb.close()
+    except Exception as e:
+        raise SystemExit(f"出力済みのブックを読み取れません（{e}）。出力ファイルを移動してから"
+                         "全期間の入力で出力し直してください")
+    return [value.split("\n", 1)[0] for value in values if isinstance(value, str) and "\n" in value]
+
+
+def append_output(table, output_path, data_sheet=None, data_link=None, scenarios=None, streaming=False,
+                  writer="openpyxl"):
+    """--append: 出力済みのブックに、まだ出力していない日付だけを追加する。追加した日数を返す
+
+    前回 --append で出力したときの配置情報（出力ファイル横の .layout）と出力ファイルが一致し、
+    出力済みの日付の内容が変わっていなければ、新しい日付の行だけを計算して挿し込む（入力に
+    出力済みの日付が含まれていなくてもよい）。それ以外の場合はブック全体を出力し直すが、
+    出力済みの日付（配置情報がなければ出力ファイルの日付順シートから読む）が入力にない場合は
+    出力済みの日付が消えるため SystemExit。
+    """
+    layout = load_append_layout(output_path)
+    hashes = day_hashes(table, build_day_index(table))
+    reason = None
+    if layout is None:
+        reason = "前回の配置情報がないか、出力ファイルが変更されています"
+    elif layout['settings'] != settings_fingerprint():
+        reason = "テンプレート・手術室などの設定が変わっています"
+    elif layout['options'] != append_options(data_sheet, data_link, scenarios):
+        reason = "データシートの形式か試算条件が変わっています"
+    elif data_sheet is not None and slice_data_sheet(data_sheet, []) is data_sheet:
+        reason = "データシートに手術実施日の列がありません"
+    else:
+        changed = [date_str for date_str, digest in hashes.items()
+                   if layout['hashes'].get(date_str, digest) != digest]
+        if changed:
+            reason = f"出力済みの日付の内容が変わっています（{changed[0]} など{len(changed)}日）"
+
+    if reason is None:
+        new_dates = [date_str for date_str in hashes if date_str not in layout['hashes']]
+        if not new_dates:
+            print("追加する日付はありません")
+            return 0
+        new_set = set(new_dates)
+        rows = np.flatnonzero(table.category_lookup("手術実施日", ("in", tuple(new_dates)),
+                                                    lambda d: d in new_set, np.bool_))
+        layout = append_workbook(table.take(rows), output_path, layout, data_sheet, data_link, scenarios)
+        layout['hashes'] = {**layout['hashes'], **{date_str: hashes[date_str] for date_str in new_dates}}
+        save_append_layout(output_path, layout)
+        print(f"{len(new_dates)}日分を追加しました（出力済み {len(layout['dates']) - len(new_dates)}日分はそのまま）")
+        return len(new_dates)
+
+    if layout is not None:
+        missing = [date_str for date_str in layout['dates'] if date_str not in hashes]
+    elif os.path.exists(output_path):
+        # 配置情報がなければ、シートの日付の表示（"09/01(月)"）で入力の日付と突き合わせる
+        weekday_map = dict(zip(table["手術実施日"], table["曜日"]))
+        shown = {day_label(date_str, weekday_map)[0] for date_str in hashes}
+        missing = [label for label in written_dates(output_path) if label not in shown]
+    else:
+        missing = []
+    if missing:
+        raise SystemExit(f"{reason}。入力にない出力済みの日付（{missing[0]} など{len(missing)}日）が消えるため、"
+                         "全期間の入力で出力し直してください")
+    print(f"{reason}。ブック全体を出力します")
+    sort_dates = [dt for dt in table["手術実施日_sort"] if dt is not None]
+    count = generate_workbook(table, output_path, period_label(min(sort_dates), max(sort_dates)),
+                              data_sheet, data_link, streaming, scenarios=scenarios, writer=writer)
+    save_append_layout(output_path, build_append_layout(table, data_sheet, data_link, scenarios))
+    return count
+
+
+# HTML出力のひな形（__DATA__ を描画データのJSONに置き換える）。外部ファイル・サーバーなしで開ける。
+# 日付ブロックは画面に近づいたときだけSVGを作り、離れたら捨てる（数千日分でもすぐに開く）
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { margin: 16px; font-family: __FONT__, sans-serif; color: #000; }
+h1 { font-size: 18px; margin: 0 0 6px; }
+.note { font-size: 12px; margin: 2px 0; }
+.legend span { display: inline-block; padding: 0 10px; margin-right: 6px; }
+.toolbar { margin: 8px 0; font-size: 12px; }
+.block { margin-bottom: 8px; }
+svg text { font-family: __FONT__, sans-serif; }
+</style>
+</head>
+<body>
+<h1>__TITLE__</h1>
+<div class="note legend">■凡例: <span id="c0">定時</span><span id="c1">臨時</span><span id="c2">緊急</span></div>
+<div class="note">__NOTE__</div>
+<div class="note" id="summary"></div>
+<div class="toolbar">並び順:
+  <label><input type="radio" name="order" value="date" checked> 日付順</label>
+  <label><input type="radio" name="order" value="weekday"> 曜日順</label>
+</div>
+<div id="blocks"></div>
+<script>
+const DATA = __DATA__;
+const SLOT_W = 9, ROW_H = 20, HEAD_H = 18, DATE_W = 80, ROOM_W = 44;
+const BLOCK_H = HEAD_H + DATA.rooms.length * ROW_H + 1;
+const WIDTH = DATE_W + ROOM_W + DATA.slots * SLOT_W + 1;
+const LABEL_SIZE = Math.min(DATA.labelSize, ROW_H - 6);
+
+DATA.colors.forEach((color, i) => { document.getElementById("c" + i).style.background = "#" + color; });
+const average = DATA.days.reduce((sum, day) => sum + day.utilization, 0) / Math.max(DATA.days.length, 1);
+document.getElementById("summary").textContent =
+  DATA.days.length + "日分　平均稼働率 " + (average * 100).toFixed(1) + "%";
+
+function esc(text) {
+  return String(text).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+}
+
+function renderDay(day) {
+  const x0 = DATE_W + ROOM_W;
+  const parts = [];
+  parts.push('<svg xmlns="http://www.w3.org/2000/svg" width="' + WIDTH + '" height="' + BLOCK_H + '">');
+  // 手術バー（占有行列の区間）
+  for (const [room, start, end, urgency] of day.bars) {
+    parts.push('<rect x="' + (x0 + start * SLOT_W) + '" y="' + (HEAD_H + room * ROW_H) + '" width="' +
+               ((end - start) * SLOT_W) + '" height="' + ROW_H + '" fill="#' + DATA.colors[urgency] + '"/>');
+  }
+  // 罫線（部屋の行・1時間ごと）と時間軸
+  for (let r = 0; r <= DATA.rooms.length; r++) {
+    const y = HEAD_H + r * ROW_H + 0.5;
+    parts.push('<line x1="' + DATE_W + '" y1="' + y + '" x2="' + WIDTH + '" y2="' + y + '" stroke="#999"/>');
+  }
+  for (let h = 0; h * DATA.slotsPerHour <= DATA.slots; h++) {
+    const x = x0 + h * DATA.slotsPerHour * SLOT_W + 0.5;
+    parts.push('<line x1="' + x + '" y1="0" x2="' + x + '" y2="' + BLOCK_H + '" stroke="#999"/>');
+    if (h * DATA.slotsPerHour < DATA.slots) {
+      parts.push('<text x="' + (x + 3) + '" y="13" font-size="11">' + (DATA.startHour + h) * 100 + '</text>');
+    }
+  }
+  parts.push('<rect x="0.5" y="0.5" width="' + (WIDTH - 1) + '" height="' + (BLOCK_H - 1) +
+             '" fill="none" stroke="#666"/>');
+  parts.push('<line x1="' + (DATE_W + 0.5) + '" y1="0" x2="' + (DATE_W + 0.5) + '" y2="' + BLOCK_H + '" stroke="#666"/>');
+  parts.push('<line x1="' + (x0 + 0.5) + '" y1="0" x2="' + (x0 + 0.5) + '" y2="' + BLOCK_H + '" stroke="#666"/>');
+  parts.push('<text x="4" y="13" font-size="11">日付</text><text x="' + (DATE_W + 4) + '" y="13" font-size="11">部屋名</text>');
+  // 日付と稼働率、部屋名
+  const middle = HEAD_H + DATA.rooms.length * ROW_H / 2;
+  parts.push('<text x="' + (DATE_W / 2) + '" y="' + (middle - 4) + '" font-size="13" font-weight="bold" text-anchor="middle">' +
+             esc(day.date) + '</text>');
+  parts.push('<text x="' + (DATE_W / 2) + '" y="' + (middle + 14) + '" font-size="13" font-weight="bold" text-anchor="middle">' +
+             (day.utilization * 100).toFixed(1) + '%</text>');
+  DATA.rooms.forEach((room, r) => {
+    parts.push('<text x="' + (DATE_W + ROOM_W / 2) + '" y="' + (HEAD_H + r * ROW_H + ROW_H / 2 + 4) +
+               '" font-size="10" text-anchor="middle">' + esc(room) + '</text>');
+  });
+  // ラベル「【科】-手術名」
+  for (const [room, slot, label] of day.labels) {
+    parts.push('<text x="' + (x0 + slot * SLOT_W + 1) + '" y="' + (HEAD_H + room * ROW_H + ROW_H / 2 + LABEL_SIZE / 2 - 1) +
+               '" font-size="' + LABEL_SIZE + '">' + esc(label) + '</text>');
+  }
+  parts.push('</svg>');
+  return parts.join("");
+}
+
+// 画面に近づいたブロックだけ描画し、離れたブロックは捨てる
+const observer = new IntersectionObserver(entries => {
+  for (const entry of entries) {
+    const element = entry.target;
+    if (entry.isIntersecting) {
+      if (!element.firstChild) element.innerHTML = renderDay(DATA.days[element.dataset.day]);
+    } else if (element.firstChild) {
+      element.innerHTML = "";
+    }
+  }
+}, { rootMargin: "1500px 0px" });
+
+function layout(order) {
+  observer.disconnect();
+  const container = document.getElementById("blocks");
+  const fragment = document.createDocumentFragment();
+  for (const index of order) {
+    const element = document.createElement("div");
+    element.className = "block";
+    element.style.height = BLOCK_H + "px";
+    element.style.width = WIDTH + "px";
+    element.dataset.day = index;
+    fragment.appendChild(element);
+  }
+  container.replaceChildren(fragment);
+  for (const element of container.children) observer.observe(element);
+}
+
+for (const input of document.querySelectorAll('input[name="order"]')) {
+  input.addEventListener("change", () => layout(input.value === "weekday" ? DATA.weekdayOrder : DATA.dateOrder));
+}
+layout(DATA.dateOrder);
+</script>
+</body>
+</html>
+"""
+
+
+def html_report_path(output_path):
+    """出力ファイルに対応するHTMLファイルのパス"""
+    return os.path.splitext(output_path)[0] + ".html"
+
+
+def generate_html(table, output_path, period, rooms=None):
+    """ガントチャートを1つのHTMLファイル（SVG、日付順・曜日順の切り替え付き）として保存し、日数を返す
+
+    バー・ラベル・稼働率は compute_day_bars で求める（ワークシートと同じ計算）。
+    openpyxl のブックは作らない。
+    """
+    rooms = rooms or ROOM_ORDER
+    dates = unique_dates(table)
+    day_index = build_day_index(table)
+    weekday_map = dict(zip(table["手術実施日"], table["曜日"]))
+
+    with profile_phase("html_bars"):
+        days = compute_day_bars(table, dates, weekday_map, day_index, rooms)
+    position = {date_str: i for i, date_str in enumerate(dates)}
+    data = {
+        'rooms': [room_label(room) for room in rooms],
+        'slots': max([TPL_COL_END - 4 + 1] + [bar[2] for day in days for bar in day['bars']]),
+        'slotsPerHour': COLS_PER_HOUR,
+        'startHour': TIME_START_HOUR,
+        'colors': list(urgency_colors()),
+        'labelSize': LABEL_FONT_SIZE,
+        'days': days,
+        'dateOrder': list(range(len(dates))),
+        'weekdayOrder': [position[date_str] for date_str in order_dates_by_weekday(dates, weekday_map)],
+    }
+    title = f"手術室 ガントチャート（{period}）"
+    replacements = {
+        '__TITLE__': html_escape(title),
+        '__FONT__': json.dumps(LABEL_FONT_NAME, ensure_ascii=False),
+        '__NOTE__': html_escape("　".join(utilization_notes())),
+        # </script> で終わらないように "</" をエスケープする
+        '__DATA__': json.dumps(data, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/"),
+    }
+    page = HTML_TEMPLATE
+    for placeholder, value in replacements.items():
+        page = page.replace(placeholder, value)
+    with profile_phase("save"):
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(page)
+    return len(dates)
+
+
+def period_key(dt, period):
+    """日付の期間キー（"month": 2025-09 / "week": ISO週 2025-W36 / "year": 2025）"""
+    if period == "week":
+        iso = dt.isocalendar()
+        return f"{iso[0]}-W{iso[1]:02d}"
+    if period == "year":
+        return f"{dt.year}"
+    return f"{dt.year}-{dt.month:02d}"
+
+
+def split_periods(table, period):
+    """prepare_table 済みのデータを期間ごとに分割し [(期間キー, 期間表記, SurgeryTable), ...] を返す
+
+    period: "month" / "week" / "year"（period_key を参照）。手術実施日が読み取れない行は除く。
+    """
+    positions = {}
+    for pos, dt in enumerate(table["手術実施日_sort"]):
+        if dt is not None:
+            positions.setdefault(period_key(dt, period), []).append(pos)
+
+    periods = []
+    for key in sorted(positions):
+        group = table.take(np.array(positions[key], dtype=np.intp))
+        first, last = group["手術実施日_sort"][0], group["手術実施日_sort"][-1]
+        periods.append((key, period_label(first, last, by_day=(period == "week")), group))
+    return periods
+
+
+def init_worker(state, profiling=False, rooms=None):
+    """バッチモードのワーカープロセスの初期化（テンプレートの設定・手術室一覧・計測の有無を引き継ぐ）"""
+    set_template_state(state)
+    if rooms is not None:
+        set_room_state(rooms)
+    if profiling:
+        set_profile(RunProfile())
+
+
+def render_period(job):
+    """1期間分のブックを作成する（バッチモードのワーカー処理）
+
+    data_sheet・data_link は親プロセスでこの期間の分に絞ったもの（run_batch を参照）。
+    (出力パス, 日数, 計測結果) を返す。計測結果は計測中のみ（それ以外は None）。
+    """
+    output_path, period, table, data_sheet, data_link, streaming, incremental, scenarios, writer = job
+    outer = PROFILE
+    if outer is not None:
+        set_profile(RunProfile())  # 期間ごとに別々に計測する
+    try:
+        count = generate_workbook(table, output_path, period, data_sheet, data_link, streaming, incremental,
+                                  scenarios, writer=writer)
+    finally:
+        report = PROFILE.report() if outer is not None else None
+        set_profile(outer)
+    return output_path, count, report
+
+
+def run_batch(table, period, workers, data_sheet=None, data_link=None, streaming=False, incremental=False,
+              scenarios=None, writer="openpyxl"):
+    """期間ごとのブックをワーカープロセスで並列に作成する
+
+    テンプレートの設定と手術室一覧は親プロセスで一度だけ読み取り、各ワーカーの起動時に渡す。
+    データシートのコピー用データは親プロセスで期間ごとに絞り、各ワーカーには担当する期間の行だけを送る。
+    """
+    stem, ext = os.path.splitext(OUTPUT_FILE)
+    jobs = [(f"{stem}_{key}{ext}", label, group,
+             slice_data_sheet(data_sheet, unique_dates(group)) if data_sheet is not None else None,
+             (data_link[0], data_link[1], len(group)) if data_link is not None else None,
+             streaming, incremental, scenarios, writer)
+            for key, label, group in split_periods(table, period)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    print(f"バッチモード: {len(jobs)}期間を{workers}プロセスで出力します")
+
+    if workers == 1:
+        results = [render_period(job) for job in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(template_state(), PROFILE is not None, room_state())) as pool:
+            results = list(pool.map(render_period, jobs))
+
+    for output_path, count, report in results:
+        print(f"ガントチャート生成完了: {output_path}（{count}日分）")
+        if PROFILE is not None:
+            PROFILE.periods[output_path] = report
+    return results
+
+
+def load_input(path):
+    """入力ファイルを一度だけ読み込み、(ガントチャートデータの SurgeryTable, 元ブック) を返す
+
+    表は読み込み済みの openpyxl ブックから作るため、XMLの解析は1回で済む。
+    元ブックはテンプレートの読み取りとデータシートのコピーに使う。
+    """
+    src_wb = load_workbook(path)
+    return read_table(src_wb["ガントチャートデータ"]), src_wb
+
+
+def load_table(path, filters=None, with_data_sheet=False, columns=GANTT_COLUMNS):
+    """ガントチャートデータシートだけを読み取り専用モードで1行ずつ読み込む（元ブックが不要な場合）
+
+    filters: row_filter の条件。条件に合わない行は保持しないため、元データが何年分あっても
+             メモリ使用量は抽出した行数に比例する。
+    with_data_sheet: True の場合はデータシートのコピー用データも同じ走査で作る
+    columns: 表に持つ列（table_from_rows を参照）
+    返り値: (SurgeryTable, コピー用データ または None)
+    """
+    src_wb = load_workbook(path, read_only=True)
+    try:
+        src_ws = src_wb["ガントチャートデータ"]
+        if with_data_sheet:
+            return read_table_and_data_sheet(src_ws, filters, columns)
+        return read_table(src_ws, filters, columns), None
+    finally:
+        src_wb.close()
+
+
+# 蓄積データ（SQLite）のテーブル定義。部屋・診療科・申込区分はコード表に分け、
+# 時刻は0時からの経過分（読み取れない値は NULL）で持つ
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rooms (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS depts (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS urgencies (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER PRIMARY KEY,
+    case_no TEXT UNIQUE,
+    surgery_date TEXT,
+    date_label TEXT,
+    weekday TEXT,
+    room_id INTEGER REFERENCES rooms (id),
+    dept_id INTEGER REFERENCES depts (id),
+    urgency_id INTEGER REFERENCES urgencies (id),
+    start_min INTEGER,
+    end_min INTEGER,
+    surgery_name TEXT
+);
+CREATE INDEX IF NOT EXISTS cases_date_room ON cases (surgery_date, room_id);
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value BLOB);
+"""
+
+# 蓄積データから作るガントチャートデータシートの列（元データと同じ並び）
+STORE_DATA_COLUMNS = ["手術実施管理番号", "手術実施日", "曜日", "執刀診療科名", "実施手術室名",
+                      "入室時刻", "麻酔終了時刻", "実施申込区分", "実施手術名０１"]
+
+
+def connect_store(path):
+    """蓄積データを開く（なければ作成する）"""
+    import sqlite3
+    conn = sqlite3.connect(path)
+    conn.executescript(STORE_SCHEMA)
+    return conn
+
+
+def _store_codes(conn, table_name, names):
+    """コード表（rooms / depts / urgencies）に名前を登録し {名前: コード} を返す"""
+    names = {name for name in names if name is not None}
+    conn.executemany(f"INSERT OR IGNORE INTO {table_name} (name) VALUES (?)", [(name,) for name in names])
+    return {name: code for code, name in conn.execute(f"SELECT id, name FROM {table_name}")}
+
+
+def _minutes_or_none(minutes):
+    return None if minutes == INVALID_MINUTE else int(minutes)
+
+
+def ingest_table(conn, table):
+    """normalize_time_columns 済みの表を蓄積データに追加し、(新規件数, 更新件数) を返す
+
+    手術実施管理番号が同じ行は新しい内容で置き換える（並び順は最初に取り込んだ位置のまま）ため、
+    同じファイルを何度取り込んでもよい。
+    """
+    n_rows = len(table)
+
+    def column(name):
+        return table[name] if name in table else np.full(n_rows, None, dtype=object)
+
+    rooms = _store_codes(conn, "rooms", column("実施手術室名"))
+    depts = _store_codes(conn, "depts", column("執刀診療科名"))
+    urgencies = _store_codes(conn, "urgencies", column("実施申込区分"))
+
+    rows = []
+    for case_no, date_label, weekday, room, dept, urgency, start, end, name in zip(
+            column("手術実施管理番号"), column("手術実施日"), column("曜日"), column("実施手術室名"),
+            column("執刀診療科名"), column("実施申込区分"), table[START_MIN_COL], table[END_MIN_COL],
+            column("実施手術名０１")):
+        dt = parse_date(date_label)
+        rows.append((
+            None if case_no is None else str(case_no),
+            dt.strftime("%Y-%m-%d") if dt is not None else None,
+            None if date_label is None else str(date_label),
+            weekday, rooms.get(room), depts.get(dept), urgencies.get(urgency),
+            _minutes_or_none(start), _minutes_or_none(end), name,
+        ))
+
+    before = conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+    columns = ["case_no", "surgery_date", "date_label", "weekday", "room_id", "dept_id",
+               "urgency_id", "start_min", "end_min", "surgery_name"]
+    conn.executemany(
+        f"INSERT INTO cases ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        f" ON CONFLICT (case_no) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns[1:])}",
+        rows)
+    added = conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0] - before
+    return added, n_rows - added
+
+
+# 蓄積データの設定に保存できる書式のクラス（XMLの要素として保存する。これ以外のオブジェクトは保存しない）
+SETTING_STYLE_CLASSES = {cls.__name__: cls for cls in (Font, PatternFill, GradientFill, Border, Alignment)}
+
+
+def setting_to_json(value):
+    """設定の値を JSON で書ける形にする
+
+    文字列以外のキーを持つ辞書は {"__dict__": [[キー, 値], ...]}、タプルは {"__tuple__": [...]}、
+    書式（SETTING_STYLE_CLASSES）は {"__style__": クラス名, "xml": 要素のXML} にする。
+    """
+    if isinstance(value, dict):
+        if all(isinstance(key, str) and not key.startswith("__") for key in value):
+            return {key: setting_to_json(item) for key, item in value.items()}
+        return {"__dict__": [[setting_to_json(key), setting_to_json(item)] for key, item in value.items()]}
+    if isinstance(value, tuple):
+        return {"__tuple__": [setting_to_json(item) for item in value]}
+    if isinstance(value, list):
+        return [setting_to_json(item) for item in value]
+    if type(value) is SETTING_STYLE_CLASSES.get(type(value).__name__):
+        return {"__style__": type(value).__name__, "xml": tostring(value.to_tree()).decode("utf-8")}
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    raise TypeError(f"蓄積データに保存できない設定の値です: {type(value).__name__}")
+
+
+def setting_from_json(value):
+    """setting_to_json の結果を元の値に戻す（書式は SETTING_STYLE_CLASSES のクラスだけを作る）"""
+    if isinstance(value, list):
+        return [setting_from_json(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__dict__" in value:
+        return {setting_from_json(key): setting_from_json(item) for key, item in value["__dict__"]}
+    if "__tuple__" in value:
+        return tuple(setting_from_json(item) for item in value["__tuple__"])
+    if "__style__" in value:
+        return SETTING_STYLE_CLASSES[value["__style__"]].from_tree(ElementTree.fromstring(value["xml"]))
+    return {key: setting_from_json(item) for key, item in value.items()}
+
+
+def save_store_setting(conn, name, value):
+    """設定（テンプレート設定・手術室一覧・データシートの書式）を JSON で蓄積データに保存する
+
+    蓄積データは共有フォルダに置かれるため pickle は使わない（読み込むだけでコードを実行できるため）。
+    """
+    conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)",
+                 (name, json.dumps(setting_to_json(value), ensure_ascii=False)))
+
+
+def load_store_setting(conn, name):
+    """蓄積データに保存した設定（なければ None）
+
+    JSON として読めない値（以前の形式の pickle など）は読み込まずに SystemExit。
+    """
+    row = conn.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+    try:
+        return setting_from_json(json.loads(row[0]))
+    except Exception:
+        raise SystemExit(f"蓄積データの設定「{name}」を読み取れません。--ingest で取り込み直してください")
+
+
+def data_sheet_format(data_sheet):
+    """コピー用データから、列幅・行高と列ごとの書式（見出し行・1件目のデータ行）を取り出す
+
+    蓄積データから作るデータシートに元データと同じ書式を付けるために保存する。
+    返り値: {'columns', 'row_dims', 'header': {列名: 書式}, 'body': {列名: 書式}}
+    """
+    rows = data_sheet['rows']
+    header = [value for value, _ in rows[0]] if rows else []
+    return {
+        'columns': data_sheet['columns'],
+        'row_dims': {row_num: dims for row_num, dims in data_sheet['row_dims'].items() if row_num == 1},
+        'header': {name: style for name, (_, style) in zip(header, rows[0])} if rows else {},
+        'body': {name: style for name, (_, style) in zip(header, rows[1])} if len(rows) > 1 else {},
+    }
+
+
+def read_store(conn, filters=None):
+    """蓄積データから条件に合う行だけを読み込み、(SurgeryTable, コピー用データ) を返す
+
+    filters: row_filter と同じ条件。手術実施日・部屋のインデックスを使う SQL の条件として渡す。
+    コピー用データ（read_data_sheet と同じ形）には、取り込み時に保存した data_sheet_format の
+    書式を列ごとに付ける。
+    """
+    filters = filters or {}
+    where, params = [], []
+    if filters.get('date_from') is not None:
+        where.append("c.surgery_date >= ?")
+        params.append(filters['date_from'].strftime("%Y-%m-%d"))
+    if filters.get('date_to') is not None:
+        where.append("c.surgery_date <= ?")
+        params.append(filters['date_to'].strftime("%Y-%m-%d"))
+    for key, alias in (('rooms', "r"), ('depts', "d")):
+        if filters.get(key) is not None:
+            names = sorted(filters[key])
+            where.append(f"{alias}.name IN ({', '.join('?' * len(names))})")
+            params.extend(names)
+
+    query = (
+        "SELECT c.case_no, c.date_label, c.weekday, d.name, r.name, c.start_min, c.end_min, u.name,"
+        " c.surgery_name FROM cases c"
+        " LEFT JOIN rooms r ON r.id = c.room_id"
+        " LEFT JOIN depts d ON d.id = c.dept_id"
+        " LEFT JOIN urgencies u ON u.id = c.urgency_id"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY c.surgery_date, c.id"  # データシートは取り込んだ順（表は prepare_table で並べ替える）
+    )
+    rows = conn.execute(query, params).fetchall()
+
+    def to_time(minutes):
+        return None if minutes is None else (datetime.min + timedelta(minutes=minutes)).time()
+
+    data = [(case_no, date_label, weekday, dept, room, to_time(start), to_time(end), urgency, name)
+            for case_no, date_label, weekday, dept, room, start, end, urgency, name in rows]
+    table = table_from_rows(STORE_DATA_COLUMNS, data)
+    for col_name, index in ((START_MIN_COL, 5), (END_MIN_COL, 6)):
+        table[col_name] = np.fromiter((INVALID_MINUTE if row[index] is None else row[index] for row in rows),
+                                      dtype=np.int16, count=len(rows))
+
+    sheet_format = load_store_setting(conn, 'data_sheet_format') or {}
+    header_styles = [sheet_format.get('header', {}).get(name) for name in STORE_DATA_COLUMNS]
+    body_styles = [sheet_format.get('body', {}).get(name) for name in STORE_DATA_COLUMNS]
+    data_sheet = {
+        'title': "ガントチャートデータ",
+        'columns': sheet_format.get('columns', []),
+        'rows': ([list(zip(STORE_DATA_COLUMNS, header_styles))]
+                 + [list(zip(row, body_styles)) for row in data]),
+        'row_dims': sheet_format.get('row_dims', {}),
+        'merges': [],
+    }
+    return table, data_sheet
+
+
+def ingest(input_path, store_path, filters=None):
+    """入力ファイルのガントチャートデータを蓄積データに取り込む（テンプレート設定・手術室一覧も保存する）"""
+    fingerprint = template_fingerprint(input_path)
+    cached_template = load_template_cache(template_cache_path(input_path), fingerprint)
+    if cached_template is not None:
+        set_template_state(cached_template)
+    else:
+        tpl_wb = load_workbook(input_path)
+        read_template_settings(tpl_wb)
+        tpl_wb.close()
+        save_template_cache(template_cache_path(input_path), fingerprint)
+
+    table, data_sheet = load_table(input_path, filters, with_data_sheet=True, columns=STORE_DATA_COLUMNS)
+    normalize_time_columns(table)
+    conn = connect_store(store_path)
+    try:
+        with conn:
+            added, updated = ingest_table(conn, table)
+            save_store_setting(conn, 'template', template_state())
+            save_store_setting(conn, 'rooms', room_state())
+            save_store_setting(conn, 'data_sheet_format', data_sheet_format(data_sheet))
+        total = conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+    finally:
+        conn.close()
+    print(f"蓄積データに取り込みました: {store_path}（新規 {added}件、更新 {updated}件、合計 {total}件）")
+
+
+def date_arg(value):
+    """--from / --to の日付（2025-09-01 または 2025/09/01）"""
+    dt = parse_date(value)
+    if dt is None:
+        raise argparse.ArgumentTypeError(f"日付として読み取れません: {value}")
+    return dt
+
+
+def filters_from_args(args):
+    """コマンドライン引数から row_filter の条件を作る（指定がなければ None）"""
+    filters = {
+        'date_from': args.date_from,
+        'date_to': args.date_to,
+        'rooms': set(args.room) if args.room else None,
+        'depts': set(args.dept) if args.dept else None,
+    }
+    if all(value is None for value in filters.values()):
+        return None
+    return filters
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="手術室ガントチャート生成")
+    parser.add_argument("--format", choices=["xlsx", "html"], default="xlsx",
+                        help="出力形式。html はブラウザで開く1つのHTMLファイル（SVG、日付順・曜日順の切り替え付き）")
+    parser.add_argument("--streaming", action="store_true",
+                        help="書き込み専用ワークブックで行単位に出力する（長期間のデータでメモリ使用量を抑える）")
+    parser.add_argument("--writer", choices=["openpyxl", "direct"], default="openpyxl",
+                        help="xlsx の書き出し方。direct は openpyxl のセル・ワークシートを経由せずシートのXMLを直接"
+                             "書き出す（--streaming と同じく行単位。大量の日付を速く出力する）")
+    parser.add_argument("--data-sheet", choices=["copy", "link"], default="copy",
+                        help="ガントチャートデータシートを書式ごとコピーする（copy）か、元データへのリンクだけを置く（link）")
+    parser.add_argument("--batch", choices=["month", "week", "year"],
+                        help="期間ごとに別々のブックを出力する（出力ファイル名の末尾に期間を付ける）")
+    parser.add_argument("--parallel", action="store_true",
+                        help="データシートと日付順・曜日順のシートの中身を複数のプロセスで並行して作る"
+                             "（--writer direct で出力する。プロセス数は --workers）")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="バッチモード・--parallel で使うプロセス数（省略時はCPUコア数）")
+    parser.add_argument("--incremental", action="store_true",
+                        help="前回の計算結果（出力ファイル横の .cache）を使い、内容が変わった日付だけ再計算する")
+    parser.add_argument("--append", action="store_true",
+                        help="出力済みのブックに、まだ出力していない日付のブロックだけを追加する（出力済みの日付は"
+                             "作り直さない。出力ファイル横の .layout を使い、使えない場合はブック全体を出力する）")
+    parser.add_argument("--from", dest="date_from", type=date_arg, metavar="DATE",
+                        help="この日付以降の手術だけを出力する（例 2025-09-01）")
+    parser.add_argument("--to", dest="date_to", type=date_arg, metavar="DATE",
+                        help="この日付までの手術だけを出力する（例 2025-09-30）")
+    parser.add_argument("--room", action="append", metavar="ROOM",
+                        help="指定した手術室の手術だけを出力する（複数指定可）")
+    parser.add_argument("--dept", action="append", metavar="DEPT",
+                        help="指定した執刀診療科の手術だけを出力する（複数指定可）")
+    parser.add_argument("--room-list", metavar="FILE",
+                        help="手術室一覧（表示順・表示名・稼働率の重み・稼働率に含めるか）の JSON / CSV ファイル。"
+                             "省略時は入力ファイルの「手術室」シート、それもなければ既定の11室")
+    parser.add_argument("--scenarios", nargs="?", const="", metavar="JSON",
+                        help="稼働率の計算条件（時間帯・部屋の重み・部屋数）を変えた試算のシートを追加する"
+                             "（JSON を省略すると現行・平日8:30-17:30・アンギオ室を含む・01A/01B別室の4条件）")
+    parser.add_argument("--watch", action="store_true",
+                        help="起動したまま入力ファイルを監視し、更新されるたびに出力し直す（Ctrl+C で終了）")
+    parser.add_argument("--ingest", action="store_true",
+                        help="入力ファイルのデータを蓄積データ（手術データ.sqlite3）に追加して終了する")
+    parser.add_argument("--store", action="store_true",
+                        help="入力ファイルの代わりに蓄積データから出力する（--from/--to 等の条件で必要な分だけ読む）")
+    parser.add_argument("--profile", action="store_true",
+                        help="処理段階ごとの時間・メモリ確保量と件数を計測し、出力ファイル横の .profile.json に書き出す")
+    parser.add_argument("--profile-dump", metavar="FILE",
+                        help="cProfile の計測結果（pstats形式）を FILE に書き出す")
+    args = parser.parse_args(argv)
+    if args.watch and (args.batch or args.store or args.ingest):
+        parser.error("--watch は --batch / --store / --ingest と同時に指定できません")
+    if args.format == "html" and args.batch:
+        parser.error("--format html は --batch と同時に指定できません")
+    if args.append and (args.batch or args.watch or args.format == "html"):
+        parser.error("--append は --batch / --watch / --format html と同時に指定できません")
+    if args.parallel and (args.batch or args.append or args.format == "html"):
+        parser.error("--parallel は --batch / --append / --format html と同時に指定できません")
+    return args
+
+
+def sheet_workers(args):
+    """--parallel のワーカープロセス数（指定がなければ None）"""
+    return max(1, args.workers or os.cpu_count() or 1) if args.parallel else None
+
+
+def load_source(args, filters):
+    """入力ファイルを読み込み、テンプレート設定を反映して (表, コピー用データ, リンク) を返す
+
+    テンプレートのキャッシュが使える場合は、元ブック全体を読み込まない（書式の走査もしない）。
+    """
+    print(f"入力ファイル読み込み: {INPUT_FILE}")
+    # テンプレートが前回と同じなら、キャッシュした設定を使う
+    with profile_phase("template_cache"):
+        fingerprint = template_fingerprint(INPUT_FILE)
+        cached_template = load_template_cache(template_cache_path(INPUT_FILE), fingerprint)
+
+    # データシートは読み取り専用モードで1行ずつ読む（抽出条件があれば条件に合う行だけを残す。
+    # 条件がなければ行高・セル結合も含めて読む）。元ブック全体の読み込みは、条件がなく、
+    # テンプレートのキャッシュが使えない（テンプレートシートの書式を読む必要がある）場合だけ行い、
+    # そのときはデータシートも同じブックから読む
+    # HTML出力ではデータシートを使わない
+    copy_data_sheet = args.data_sheet == "copy" and args.format == "xlsx"
+    src_wb = None
+    data_sheet = None
+    with profile_phase("load"):
+        if filters is None and cached_template is None:
+            table, src_wb = load_input(INPUT_FILE)
+        else:
+            table, data_sheet = load_table(INPUT_FILE, filters, with_data_sheet=copy_data_sheet)
+        table = prepare_table(table)
+    profile_count("rows_read", len(table))
+
+    # テンプレートシートから設定を読み取り
+    with profile_phase("template"):
+        if cached_template is not None:
+            set_template_state(cached_template)
+            print("テンプレートの設定をキャッシュから読み込みました")
+        else:
+            tpl_wb = src_wb or load_workbook(INPUT_FILE)
+            read_template_settings(tpl_wb)
+            save_template_cache(template_cache_path(INPUT_FILE), fingerprint)
+            if tpl_wb is not src_wb:
+                tpl_wb.close()
+
+    # ガントチャートデータシートのコピー元
+    data_link = None
+    if args.data_sheet == "link":
+        data_link = (INPUT_FILE, "ガントチャートデータ", len(table))
+    elif copy_data_sheet and src_wb is not None and "ガントチャートデータ" in src_wb.sheetnames:
+        with profile_phase("data_sheet_read"):
+            data_sheet = read_data_sheet(src_wb["ガントチャートデータ"])
+
+    if src_wb is not None:
+        src_wb.close()
+    return table, data_sheet, data_link
+
+
+def load_store_source(args, filters):
+    """蓄積データから条件に合う行を読み込み、(表, コピー用データ, リンク) を返す（xlsx は読まない）"""
+    print(f"蓄積データ読み込み: {STORE_FILE}")
+    if not os.path.exists(STORE_FILE):
+        raise SystemExit(f"蓄積データがありません。先に --ingest で取り込んでください: {STORE_FILE}")
+    conn = connect_store(STORE_FILE)
+    try:
+        with profile_phase("load"):
+            table, data_sheet = read_store(conn, filters)
+            table = prepare_table(table)
+        with profile_phase("template"):
+            state = load_store_setting(conn, 'template')
+            if state is not None:
+                set_template_state(state)
+            rooms = load_store_setting(conn, 'rooms') if args.room_list is None else None
+            if rooms is not None:
+                set_room_state(rooms)
+    finally:
+        conn.close()
+    profile_count("rows_read", len(table))
+
+    data_link = None
+    if args.data_sheet == "link":
+        data_link, data_sheet = (INPUT_FILE, "ガントチャートデータ", len(table)), None
+    return table, data_sheet, data_link
+
+
+def run(args):
+    """コマンドライン引数に従ってガントチャートを出力する"""
+    filters = filters_from_args(args)
+    # 手術室一覧（試算条件の部屋の重みより先に読む）。蓄積データからの出力では取り込み時の一覧を使う
+    catalogue = load_room_catalogue(args.room_list, None if args.store else INPUT_FILE)
+    if catalogue is not None:
+        set_room_catalogue(catalogue)
+    if args.ingest:
+        ingest(INPUT_FILE, STORE_FILE, filters)
+        return
+
+    scenarios = load_scenarios(args.scenarios) if args.scenarios is not None else None
+    if args.watch:
+        watch(args, filters, scenarios)
+        return
+
+    if args.store:
+        table, data_sheet, data_link = load_store_source(args, filters)
+    else:
+        table, data_sheet, data_link = load_source(args, filters)
+
+    if not unique_dates(table):
+        print("出力する手術データがありません（抽出条件を確認してください）")
+        return
+
+    if args.batch:
+        run_batch(table, args.batch, args.workers, data_sheet, data_link, args.streaming, args.incremental,
+                  scenarios, args.writer)
+        return
+
+    sort_dates = [dt for dt in table["手術実施日_sort"] if dt is not None]
+    first, last = min(sort_dates), max(sort_dates)
+    if args.format == "html":
+        html_path = html_report_path(OUTPUT_FILE)
+        count_date = generate_html(table, html_path, period_label(first, last))
+        print(f"ガントチャート生成完了: {html_path}")
+        print(f"全{count_date}日分のガントチャートを出力しました。")
+        return
+    if args.append:
+        append_output(table, OUTPUT_FILE, data_sheet, data_link, scenarios, args.streaming, args.writer)
+        print(f"ガントチャート生成完了: {OUTPUT_FILE}")
+        return
+    count_date = generate_workbook(table, OUTPUT_FILE, period_label(first, last),
+                                   data_sheet, data_link, args.streaming, args.incremental, scenarios,
+                                   writer=args.writer, sheet_workers=sheet_workers(args))
     print(f"ガントチャート生成完了: {OUTPUT_FILE}")
     print(f"全{count_date}日分のガントチャートを出力しました。")
 
 
+# 監視モード（--watch）の確認間隔と、ファイルの更新が止まってから出力するまでの待ち時間（秒）
+# 更新時刻・サイズが2回続けて同じなら保存が終わったとみなすので、待ち時間は確認間隔と同じでよい
+WATCH_POLL_SECONDS = 0.2
+WATCH_DEBOUNCE_SECONDS = 0.2
+# 出力に失敗したとき（出力ファイルが Excel で開かれている等）に、もう一度出力するまでの間隔（秒）
+WATCH_RETRY_SECONDS = 2.0
+
+
+def file_signature(path):
+    """ファイルの (更新時刻, サイズ)。ファイルがない・読めない場合は None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def render_watched(args, filters, scenarios, warm):
+    """監視モードの1回分の出力（テンプレートとブロックは warm に保持したものを使い回す）
+
+    warm: {'template': テンプレートの指紋, 'settings': settings_fingerprint, 'cache': ブロック}
+    テンプレートシートが変わった場合だけ設定を読み直し、描画設定が変わった場合はブロックを捨てる。
+    手術室一覧は毎回読み直す（「手術室」シートを削除した場合は直前の一覧のまま）。
+    """
+    fingerprint = template_fingerprint(INPUT_FILE)
+    if fingerprint is None or fingerprint != warm.get('template'):
+        state = load_template_cache(template_cache_path(INPUT_FILE), fingerprint)
+        if state is not None:
+            set_template_state(state)
+        else:
+            tpl_wb = load_workbook(INPUT_FILE)
+            read_template_settings(tpl_wb)
+            tpl_wb.close()
+            save_template_cache(template_cache_path(INPUT_FILE), fingerprint)
+        warm['template'] = fingerprint
+    catalogue = load_room_catalogue(args.room_list, INPUT_FILE)
+    if catalogue is not None:
+        set_room_catalogue(catalogue)
+    settings = settings_fingerprint()
+    if settings != warm.get('settings'):
+        warm['settings'], warm['cache'] = settings, {}
+
+    copy_data_sheet = args.data_sheet == "copy" and args.format == "xlsx"
+    table, data_sheet = load_table(INPUT_FILE, filters, with_data_sheet=copy_data_sheet)
+    table = prepare_table(table)
+    if not unique_dates(table):
+        print("出力する手術データがありません（抽出条件を確認してください）")
+        return 0
+    data_link = (INPUT_FILE, "ガントチャートデータ", len(table)) if args.data_sheet == "link" else None
+    sort_dates = [dt for dt in table["手術実施日_sort"] if dt is not None]
+    if args.format == "html":
+        return generate_html(table, html_report_path(OUTPUT_FILE), period_label(min(sort_dates), max(sort_dates)))
+    return generate_workbook(table, OUTPUT_FILE, period_label(min(sort_dates), max(sort_dates)),
+                             data_sheet, data_link, args.streaming, scenarios=scenarios,
+                             block_cache=warm['cache'], writer=args.writer, sheet_workers=sheet_workers(args))
+
+
+def watch(args, filters, scenarios, poll=WATCH_POLL_SECONDS, debounce=WATCH_DEBOUNCE_SECONDS,
+          retry=WATCH_RETRY_SECONDS):
+    """入力ファイルを監視し、更新されるたびにガントチャートを出力し直す（Ctrl+C で終了）
+
+    プロセスを起動したままにするため、ライブラリの読み込み・テンプレートの設定・日付ごとの
+    ブロックは2回目以降の出力で使い回され、内容が変わった日付だけが再計算される。
+    ファイルの更新が debounce 秒止まってから読み込む（保存途中のファイルを読まないため）。
+    出力ファイルが Excel で開かれている等で失敗しても、監視は続け、retry 秒ごとに出力し直す。
+    """
+    warm = {}
+    rendered = None            # 最後に出力したときのファイルの状態
+    pending, changed_at = None, 0.0
+    print(f"入力ファイルの監視を開始しました: {INPUT_FILE}（Ctrl+C で終了）")
+    try:
+        while True:
+            signature = file_signature(INPUT_FILE)
+            now = time_module.monotonic()
+            if signature is not None and signature != rendered:
+                if signature != pending:
+                    pending, changed_at = signature, now
+                elif now - changed_at >= debounce:
+                    started = time_module.perf_counter()
+                    try:
+                        count = render_watched(args, filters, scenarios, warm)
+                    except Exception as e:
+                        print(f"出力できませんでした: {e}（{retry:g} 秒後にもう一度出力します）")
+                        changed_at = now + retry - debounce
+                    else:
+                        output_path = html_report_path(OUTPUT_FILE) if args.format == "html" else OUTPUT_FILE
+                        print(f"ガントチャート生成完了: {output_path}（{count}日分、"
+                              f"{time_module.perf_counter() - started:.2f} 秒）")
+                        rendered, pending = signature, None
+            time_module.sleep(poll)
+    except KeyboardInterrupt:
+        print("監視を終了しました")
+
+
+def print_profile(report):
+    """計測結果の要約を表示する"""
+    print("--- 計測結果 ---")
+    for name, stats in report['phases'].items():
+        print(f"  {name:<16}{stats['seconds']:8.3f} 秒  確保 {stats['allocated_bytes'] / 1e6:8.1f} MB"
+              f"  ピーク {stats['peak_bytes'] / 1e6:8.1f} MB")
+    for name, value in report['counters'].items():
+        print(f"  {name}: {value}")
+    print(f"  合計 {report['total_seconds']:.3f} 秒（モジュールの読み込み {report['import_seconds']:.3f} 秒を除く）")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile:
+        set_profile(RunProfile())
+    profiler = None
+    if args.profile_dump:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+            print(f"cProfile の結果を出力しました: {args.profile_dump}")
+
+    if PROFILE is not None:
+        report = PROFILE.report()
+        print_profile(report)
+        report_path = profile_report_path(OUTPUT_FILE)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"計測結果を出力しました: {report_path}")
+
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # PyInstaller exe でのワーカープロセス起動に必要
     main()
@@ -0,0 +1,343 @@
+"""
+generate_gantt_chart.py のテスト（python -m pytest -q）
+"""
+
+import pickle
+
+import pytest
+
+import generate_gantt_chart as gantt
+
+
+@pytest.fixture(autouse=True)
+def restore_room_state():
+    """手術室一覧を読み込むテストのあとで、既定の部屋構成に戻す"""
+    state = gantt.room_state()
+    yield
+    gantt.set_room_state(state)
+
+
+@pytest.fixture
+def source():
+    """リポジトリの入力ファイルを読み込み、(表, データシート) を返す（テンプレートの設定はテスト後に戻す）"""
+    state = gantt.template_state()
+    src_wb = gantt.load_workbook(gantt.INPUT_FILE)
+    gantt.read_template_settings(src_wb)
+    src_wb.close()
+    table, data_sheet = gantt.load_table(gantt.INPUT_FILE, with_data_sheet=True)
+    yield gantt.prepare_table(table), data_sheet
+    gantt.set_template_state(state)
+
+
+@pytest.fixture(autouse=True)
+def cache_key_file(tmp_path, monkeypatch):
+    """キャッシュの署名鍵を利用者の設定フォルダではなく一時フォルダに作る"""
+    monkeypatch.setattr(gantt, "CACHE_KEY_FILE", str(tmp_path / "key" / "cache.key"))
+    monkeypatch.setattr(gantt, "CACHE_KEY", None)
+
+
+def workbook_contents(path):
+    """比較用に出力ブックの内容（値・書式・リンク・結合セル・列幅・行の高さ・印刷設定）を読み取る"""
+    wb = gantt.load_workbook(path)
+    contents = {"sheets": wb.sheetnames}
+    for ws in wb:
+        cells = {}
+        formats = {}   # {セル書式の番号の並び: 書式の表記}（同じ書式の repr を何度も作らない）
+        for row in ws.iter_rows():
+            for cell in row:
+                if cell.value is None and not cell.has_style:
+                    continue
+                key = tuple(cell._style)
+                if key not in formats:
+                    formats[key] = (repr(cell.font), repr(cell.fill), repr(cell.border), repr(cell.alignment),
+                                    cell.number_format)
+                cells[cell.coordinate] = (cell.value, *formats[key],
+                                          cell.hyperlink.target if cell.hyperlink else None)
+        contents[ws.title] = {
+            "cells": cells,
+            "merges": sorted(str(r) for r in ws.merged_cells.ranges),
+            "columns": {k: (d.width, d.hidden) for k, d in ws.column_dimensions.items() if d.width or d.hidden},
+            "rows": {k: (d.height, d.hidden) for k, d in ws.row_dimensions.items() if d.height or d.hidden},
+            "page": (ws.page_setup.orientation, ws.page_setup.paperSize, ws.page_setup.fitToWidth,
+                     ws.page_setup.fitToHeight, ws.sheet_view.zoomScale),
+        }
+    wb.close()
+    return contents
+
+
+def compare_workbooks(expected_path, actual_path, limit=3):
+    """2つの出力ブックの違いを説明する文字列のリストを返す（同じなら空のリスト）"""
+    expected, actual = workbook_contents(expected_path), workbook_contents(actual_path)
+    if expected["sheets"] != actual["sheets"]:
+        return [f"シート構成が違います: {expected['sheets']} / {actual['sheets']}"]
+    differences = []
+    for title in expected["sheets"]:
+        for part, values in expected[title].items():
+            other = actual[title][part]
+            if values == other:
+                continue
+            if isinstance(values, dict):
+                keys = sorted((k for k in values.keys() | other.keys() if values.get(k) != other.get(k)), key=str)
+                differences.append(f"{title} の {part} が {len(keys)}箇所違います")
+                differences += [f"  {k}: {values.get(k)} / {other.get(k)}" for k in keys[:limit]]
+            else:
+                differences.append(f"{title} の {part} が違います: {values} / {other}")
+    return differences
+
+
+def catalogue(**labels):
+    """既定の部屋構成と同じ重みの手術室一覧（labels で表示名を変える）"""
+    return [{'name': room, 'label': labels.get(room, room), 'weight': gantt.ROOM_WEIGHT.get(room, 1.0) or 1.0,
+             'utilization': gantt.ROOM_WEIGHT.get(room, 1.0) != 0}
+            for room in gantt.ROOM_ORDER]
+
+
+def test_default_utilization_notes():
+    assert gantt.utilization_notes() == (
+        "※稼働率 = 平日:9:00-17:00（8h×9室）、土曜:9:00-13:00（4h×9室）",
+        "※01A・01Bは各0.5室換算、アンギオ室は除外",
+    )
+
+
+def test_catalogue_utilization_notes_use_labels():
+    gantt.set_room_catalogue(catalogue(**{"01A": "1A", "01B": "1B", "ｱﾝｷﾞｵ": "血管造影室"}))
+    assert gantt.utilization_notes()[1] == "※1A・1Bは各0.5室換算、血管造影室は除外"
+
+
+def test_settings_fingerprint_changes_with_room_labels():
+    gantt.set_room_catalogue(catalogue())
+    before = gantt.settings_fingerprint()
+    gantt.set_room_catalogue(catalogue(**{"02": "第2手術室"}))
+    assert gantt.settings_fingerprint() != before
+
+
+def test_watch_retries_failed_render(monkeypatch, capsys):
+    calls = []
+
+    def render_watched(args, filters, scenarios, warm):
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise PermissionError("出力ファイルが開かれています")
+        return 1
+
+    sleeps = iter(range(6))
+
+    def sleep(seconds):
+        if next(sleeps) == 5:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(gantt, "file_signature", lambda path: (1, 1))
+    monkeypatch.setattr(gantt, "render_watched", render_watched)
+    monkeypatch.setattr(gantt.time_module, "sleep", sleep)
+    gantt.watch(gantt.SimpleNamespace(format="xlsx"), None, None, poll=0, debounce=0, retry=0)
+    assert len(calls) == 2
+    assert "ガントチャート生成完了" in capsys.readouterr().out
+
+
+def test_block_cache_rejects_unsigned_pickle(tmp_path):
+    path = str(tmp_path / "手術室ガントチャート-結果.cache")
+    cache = {"2025/09/01": {"hash": "0" * 32}}
+    gantt.save_block_cache(path, "fp", cache, cache)
+    assert gantt.load_block_cache(path, "fp") == cache
+
+    with open(path, "wb") as f:
+        pickle.dump({'fingerprint': "fp", 'days': cache}, f)
+    assert gantt.load_block_cache(path, "fp") == {}
+
+
+def test_template_cache_rejects_unsigned_pickle(tmp_path):
+    path = str(tmp_path / "ガントチャート-元データ.template.cache")
+    gantt.save_template_cache(path, "fp")
+    assert gantt.load_template_cache(path, "fp") == gantt.template_state()
+
+    with open(path, "wb") as f:
+        pickle.dump({'version': gantt.TEMPLATE_CACHE_VERSION, 'fingerprint': "fp",
+                     'state': gantt.template_state()}, f)
+    assert gantt.load_template_cache(path, "fp") is None
+
+
+def test_append_layout_rejects_unsigned_pickle(tmp_path):
+    output_path = str(tmp_path / "手術室ガントチャート-結果.xlsx")
+    with open(output_path, "wb") as f:
+        f.write(b"xlsx")
+    gantt.save_append_layout(output_path, {'version': gantt.APPEND_LAYOUT_VERSION})
+    layout = gantt.load_append_layout(output_path)
+    assert layout is not None
+
+    with open(gantt.append_layout_path(output_path), "wb") as f:
+        pickle.dump(layout, f)
+    assert gantt.load_append_layout(output_path) is None
+
+
+def test_parallel_profile_counts_match_serial(source, tmp_path, monkeypatch):
+    table, data_sheet = source
+    monkeypatch.setattr(gantt, "PARALLEL_CHUNK_DAYS", 5)
+    monkeypatch.setattr(gantt, "PARALLEL_CHUNK_ROWS", 50)
+    counters = {}
+    for workers in (None, 2):
+        previous = gantt.set_profile(gantt.RunProfile())
+        try:
+            gantt.generate_workbook(table, str(tmp_path / f"結果_{workers}.xlsx"), "期間", data_sheet,
+                                    writer="direct", sheet_workers=workers)
+            counters[workers] = gantt.PROFILE.counters
+        finally:
+            gantt.set_profile(previous)
+            gantt.tracemalloc.stop()   # RunProfile が開始した計測を止める（後のテストが遅くなるため）
+    assert counters[2]["cells_written.gantt"] > 0
+    assert counters[2] == counters[None]
+
+
+def take_dates(table, keep):
+    """表のうち手術実施日が keep に含まれる行"""
+    return table.take(gantt.np.flatnonzero([date_str in keep for date_str in table["手術実施日"]]))
+
+
+@pytest.mark.parametrize("sidecar", ["lost", "stale"])
+def test_append_refuses_to_drop_written_dates(source, tmp_path, sidecar):
+    table, data_sheet = source
+    output_path = str(tmp_path / "手術室ガントチャート-結果.xlsx")
+    dates = gantt.unique_dates(table)
+    gantt.append_output(table, output_path, data_sheet)
+    if sidecar == "lost":
+        gantt.os.remove(gantt.append_layout_path(output_path))
+    else:
+        gantt.os.utime(output_path, ns=(0, 0))   # Excel で保存し直したのと同じく、配置情報と一致しない
+    before = gantt.file_signature(output_path)
+
+    with pytest.raises(SystemExit, match="入力にない出力済みの日付"):
+        gantt.append_output(take_dates(table, set(dates[len(dates) // 2:])), output_path, data_sheet)
+    assert gantt.file_signature(output_path) == before
+    weekday_map = dict(zip(table["手術実施日"], table["曜日"]))
+    assert gantt.written_dates(output_path) == [gantt.day_label(d, weekday_map)[0] for d in dates]
+
+    # 全期間の入力なら、配置情報が使えなくてもブック全体を出力し直せる
+    assert gantt.append_output(table, output_path, data_sheet) == len(dates)
+
+
+def test_store_settings_are_json(source, tmp_path):
+    table, data_sheet = source
+    conn = gantt.connect_store(str(tmp_path / "手術データ.sqlite3"))
+    try:
+        for name, value in (("template", gantt.template_state()), ("rooms", gantt.room_state()),
+                            ("data_sheet_format", gantt.data_sheet_format(data_sheet))):
+            gantt.save_store_setting(conn, name, value)
+            assert gantt.load_store_setting(conn, name) == value
+
+        conn.execute("UPDATE settings SET value = ? WHERE name = 'template'",
+                     (pickle.dumps(gantt.template_state()),))
+        with pytest.raises(SystemExit, match="取り込み直して"):
+            gantt.load_store_setting(conn, "template")
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("data_sheet_mode", ["copy", "link"])
+def test_direct_writer_matches_openpyxl(source, tmp_path, data_sheet_mode):
+    table, data_sheet = source
+    data_link = (gantt.INPUT_FILE, "ガントチャートデータ", len(table)) if data_sheet_mode == "link" else None
+    scenarios = gantt.load_scenarios()
+    outputs = {}
+    for writer in ("openpyxl", "direct"):
+        outputs[writer] = str(tmp_path / f"手術室ガントチャート-結果_{writer}.xlsx")
+        gantt.generate_workbook(table, outputs[writer], "期間", None if data_link else data_sheet, data_link,
+                                scenarios=scenarios, writer=writer)
+    assert "稼働率試算" in workbook_contents(outputs["direct"])["sheets"]
+    assert compare_workbooks(outputs["openpyxl"], outputs["direct"]) == []
+
+
+def test_read_only_data_sheet_matches_full_load(tmp_path):
+    # 行高・セル結合・空行のあるデータシート
+    wb = gantt.load_workbook(gantt.INPUT_FILE)
+    ws = wb["ガントチャートデータ"]
+    ws.row_dimensions[5].height = 30
+    ws.row_dimensions[7].hidden = True
+    ws.merge_cells("I2:I3")
+    last = ws.max_row
+    for col in range(1, ws.max_column + 1):
+        src = ws.cell(row=2, column=col)
+        ws.cell(row=last + 2, column=col, value=src.value)._style = gantt.copy(src._style)
+    path = str(tmp_path / "ガントチャート-元データ.xlsx")
+    wb.save(path)
+    wb.close()
+
+    wb = gantt.load_workbook(path)
+    expected = gantt.read_data_sheet(wb["ガントチャートデータ"])
+    wb.close()
+    _, data_sheet = gantt.load_table(path, with_data_sheet=True)
+    assert data_sheet == expected
+    assert data_sheet['merges'] == ["I2:I3"]
+
+
+def test_set_room_state_defaults_only_note_labels():
+    state = gantt.room_state()
+    del state["ROOM_NOTE_LABELS"]
+    gantt.set_room_state(state)
+    assert gantt.ROOM_NOTE_LABELS == {}
+
+    del state["ROOM_ORDER"]
+    with pytest.raises(KeyError):
+        gantt.set_room_state(state)
+
+
+def test_rereading_template_drops_removed_settings():
+    state = gantt.template_state()
+    try:
+        wb = gantt.load_workbook(gantt.INPUT_FILE)
+        gantt.read_template_settings(wb)
+        assert gantt.TPL_HAS_TEMPLATE and gantt.TPL_COL_WIDTHS
+
+        wb.remove(wb["テンプレート"])
+        gantt.read_template_settings(wb)
+        assert gantt.template_state() == gantt.DEFAULT_TEMPLATE_STATE
+        assert gantt.DEFAULT_TEMPLATE_STATE["TPL_COL_WIDTHS"] == {}
+    finally:
+        gantt.set_template_state(state)
+
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch):
+    """main を一時フォルダの入力・出力・蓄積データで実行する（テンプレートの設定はテスト後に戻す）"""
+    state = gantt.template_state()
+    input_path = tmp_path / "ガントチャート-元データ.xlsx"
+    gantt.shutil.copyfile(gantt.INPUT_FILE, input_path)
+    monkeypatch.setattr(gantt, "INPUT_FILE", str(input_path))
+    monkeypatch.setattr(gantt, "OUTPUT_FILE", str(tmp_path / "手術室ガントチャート-結果.xlsx"))
+    monkeypatch.setattr(gantt, "STORE_FILE", str(tmp_path / "手術データ.sqlite3"))
+    yield tmp_path
+    gantt.set_template_state(state)
+
+
+def test_current_scenario_matches_block_utilization(source):
+    table, _ = source
+    dates = gantt.unique_dates(table)
+    weekday_map = dict(zip(table["手術実施日"], table["曜日"]))
+    scenarios = gantt.load_scenarios()
+    assert scenarios[0]['name'] == "現行"
+    used, available = gantt.evaluate_scenarios(table, dates, weekday_map, scenarios)
+    styles = gantt.StyleRegistry(gantt.Workbook())
+    blocks = gantt.compute_day_blocks(table, dates, weekday_map, gantt.build_day_index(table), styles)
+    expected = [blocks[date_str]['utilization'] for date_str in dates]
+    rates = gantt.np.divide(used[0], available[0], out=gantt.np.zeros(len(dates)), where=available[0] > 0)
+    assert rates == pytest.approx(expected, abs=1e-12)
+
+
+def test_date_filter_keeps_only_dates_in_range(run_dir):
+    gantt.main(["--from", "2025-09-08", "--to", "2025-09-12"])
+    labels = gantt.written_dates(gantt.OUTPUT_FILE)
+    assert labels == ["09/08(月)", "09/09(火)", "09/10(水)", "09/11(木)", "09/12(金)"]
+
+    wb = gantt.load_workbook(gantt.OUTPUT_FILE, read_only=True)
+    rows = list(wb["ガントチャートデータ"].iter_rows(values_only=True))
+    wb.close()
+    date_col = rows[0].index("手術実施日")
+    assert rows[1:] and {row[date_col] for row in rows[1:]} <= {f"2025/09/{day:02d}" for day in range(8, 13)}
+
+
+def test_store_round_trip_matches_xlsx_input(run_dir):
+    gantt.main([])
+    expected = str(run_dir / "from_input.xlsx")
+    gantt.os.replace(gantt.OUTPUT_FILE, expected)
+
+    gantt.main(["--ingest"])
+    gantt.main(["--store"])
+    assert compare_workbooks(expected, gantt.OUTPUT_FILE) == []